@@ -0,0 +1,170 @@
+r"""
+Throughput benchmark of metadataCompleter.py against the local mock providers (mockProviders.py).
+Builds a synthetic dataset of records with DOIs and empty metadata, starts the mock server with the requested
+latency and fault injection, and runs the completer's full main() pipeline against it with a scratch cache,
+checkpoint and changelog. Reports records/sec, provider requests per record, response cache hit rate, the
+latency percentiles of the HTTP exchanges (each retry counted on its own) and, apart from them, the median wait
+for the provider rate limiters, so changes to batching, caching or concurrency can be compared with numbers. With --runs 2 or more the later runs reuse the warm cache.
+
+Usage:
+    python benchmarkCompleter.py [--records 500] [--latency-ms 80] [--throttle-rate 0.01] [--runs 2]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+import metadataCompleter
+import mockProviders
+
+# Columns of a merged Bibliometrix export that the completer reads or fills
+DATASET_COLUMNS = ["AU", "TI", "SO", "PY", "DI", "VL", "IS", "BP", "EP", "PU", "AB", "CR", "LA", "C1", "DE", "RP", "DT"]
+
+
+# Spellings of the same DOI found in merged WoS, Scopus and PubMed exports
+DOI_VARIANTS = ["{}", "https://doi.org/{}", "DOI: {}", "http://dx.doi.org/{}"]
+
+
+def write_dataset(path, records, duplicates=0.0):
+    r"""
+    Write `records` synthetic records with empty metadata. A `duplicates` share of them repeat an earlier
+    record's DOI in another spelling, as near-duplicate rows from different exports do.
+    """
+    rng = random.Random(records)
+    rows = [{column: "" for column in DATASET_COLUMNS} for _ in range(records)]
+    for i, row in enumerate(rows):
+        if i and rng.random() < duplicates:
+            row["DI"] = rng.choice(DOI_VARIANTS).format(f"10.5555/MDMT.{rng.randrange(i)}")
+        else:
+            row["DI"] = f"10.5555/mdmt.{i}"
+    frame = pd.DataFrame(rows, columns=DATASET_COLUMNS)
+    if path.endswith(".csv"):
+        frame.to_csv(path, index=False)
+    else:
+        frame.to_excel(path, index=False)
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+class LatencyRecorder:
+    r"""
+    Records, through HttpTransport.timing_hook, the duration of every HTTP exchange (each retry on its own) and,
+    separately, how long it waited for its provider's rate limiter beforehand.
+    """
+    def __init__(self, transport):
+        self.transport = transport
+        self.lock = threading.Lock()
+        self.seconds = []
+        self.wait_seconds = []
+
+    def record(self, provider, wait_seconds, exchange_seconds):
+        with self.lock:
+            self.seconds.append(exchange_seconds)
+            self.wait_seconds.append(wait_seconds)
+
+    def __enter__(self):
+        self.previous_hook = self.transport.timing_hook
+        self.transport.timing_hook = self.record
+        return self
+
+    def __exit__(self, *exc):
+        self.transport.timing_hook = self.previous_hook
+
+
+def run_completer(server, work_dir, input_file, run, args):
+    state = server.state
+    state.reset_counts()
+    output_file = os.path.join(work_dir, f"enriched{run}{os.path.splitext(input_file)[1]}")
+    metadataCompleter.CHANGELOG_FILE = os.path.join(work_dir, "changelog.txt")
+    metadataCompleter.response_cache = None
+    sys.argv = ["metadataCompleter.py", "--input", input_file, "--output", output_file,
+                "--mock-providers", f"http://127.0.0.1:{server.server_address[1]}",
+                "--cache-file", os.path.join(work_dir, "responseCache.sqlite"),
+                "--checkpoint-file", os.path.join(work_dir, "checkpoint.sqlite"),
+                "--changelog-sink", os.path.join(work_dir, "changelog.jsonl"),
+                "--metrics-report", os.path.join(work_dir, f"metrics{run}.json")]
+    if args.no_batch:
+        sys.argv.append("--no-batch")
+    log = io.StringIO()
+    with LatencyRecorder(metadataCompleter.transport) as latencies:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+            metadataCompleter.main()
+        seconds = time.perf_counter() - start
+    if not os.path.exists(output_file):
+        print(log.getvalue())
+        raise RuntimeError(f"Run {run} did not write {output_file}")
+    cache = metadataCompleter.response_cache
+    lookups = cache.hits + cache.misses if cache is not None else 0
+    return {"run": run, "seconds": seconds, "records_per_sec": args.records / seconds,
+            "requests_per_record": state.total_requests() / args.records,
+            "cache_hit_rate": cache.hits / lookups if lookups else 0.0,
+            "p50_ms": percentile(latencies.seconds, 0.50) * 1000,
+            "p95_ms": percentile(latencies.seconds, 0.95) * 1000,
+            "p99_ms": percentile(latencies.seconds, 0.99) * 1000,
+            "wait_p50_ms": percentile(latencies.wait_seconds, 0.50) * 1000,
+            "duplicate_ratio": metadataCompleter.doi_duplicate_ratio(),
+            "throttled": state.requests.get("throttled", 0), "errors": state.requests.get("error", 0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark metadataCompleter.py against mock providers.")
+    parser.add_argument("--records", type=int, default=500, help="Synthetic records in the dataset.")
+    parser.add_argument("--format", choices=("csv", "xlsx"), default="csv", help="Dataset format.")
+    parser.add_argument("--duplicates", type=float, default=0.0,
+                        help="Share of records repeating an earlier record's DOI in another spelling.")
+    parser.add_argument("--runs", type=int, default=1, help="Runs; every run after the first uses a warm cache.")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Mean added latency per request.")
+    parser.add_argument("--latency-jitter-ms", type=float, default=20.0, help="Standard deviation of the latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for latency and fault injection.")
+    parser.add_argument("--no-rate-limits", action="store_true",
+                        help="Lift the per-provider rate limits to measure the pipeline alone.")
+    parser.add_argument("--no-batch", action="store_true", help="Benchmark without batched lookups.")
+    parser.add_argument("--verbose", action="store_true", help="Show the completer's own output.")
+    args = parser.parse_args()
+
+    if args.no_rate_limits:
+        metadataCompleter.transport.limiters = {}
+    server = mockProviders.start_server(latency_ms=args.latency_ms, latency_jitter_ms=args.latency_jitter_ms,
+                                        error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                                        retry_after=args.retry_after, seed=args.seed)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            input_file = os.path.join(work_dir, f"dataset.{args.format}")
+            write_dataset(input_file, args.records, args.duplicates)
+            print(f"Benchmarking {args.records} records, {args.latency_ms:.0f} ms latency, "
+                  f"{args.error_rate:.0%} errors, {args.throttle_rate:.0%} throttled, "
+                  f"{args.duplicates:.0%} duplicate DOIs\n")
+            # Latency percentiles are of the HTTP exchange alone; rate limiter queueing is the wait column
+            print(f"{'Run':<5}{'Seconds':>9}{'Rec/sec':>9}{'Req/rec':>9}{'Cache hit':>11}{'Dup DOIs':>10}"
+                  f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'Wait p50':>10}{'429s':>7}{'5xx':>6}")
+            for run in range(1, args.runs + 1):
+                r = run_completer(server, work_dir, input_file, run, args)
+                results.append(r)
+                print(f"{r['run']:<5}{r['seconds']:>9.2f}{r['records_per_sec']:>9.1f}{r['requests_per_record']:>9.2f}"
+                      f"{r['cache_hit_rate']:>11.1%}{r['duplicate_ratio']:>10.1%}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+                      f"{r['wait_p50_ms']:>10.1f}{r['throttled']:>7}{r['errors']:>6}")
+    finally:
+        server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    main()
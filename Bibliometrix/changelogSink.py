@@ -0,0 +1,157 @@
+r"""
+Append-only changelog of cell updates for metadataCompleter.py.
+Every update is one structured record (row, column, old, new, provider, timestamp), written as it happens to a
+JSONL file or a SQLite database (chosen by extension), so the changelog never has to fit in memory. The summary
+and the plain-text report are both computed from the sink afterwards.
+"""
+
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY,
+    row INTEGER NOT NULL,
+    "column" TEXT NOT NULL,
+    old TEXT,
+    new TEXT,
+    provider TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+"""
+
+SEPARATOR = "----------------------------------"
+
+
+class ChangelogSink:
+    r"""
+    Records are buffered and written every `buffer_size` records, or on flush().
+    position() and truncate() let a checkpoint pin the sink to what it has saved, so a resumed run
+    neither loses nor repeats records.
+    """
+    def __init__(self, path, buffer_size=1000, resume=False):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.sqlite = os.path.splitext(path)[1].lower() in (".sqlite", ".db", ".sqlite3")
+        self.buffer = []
+        if not resume and os.path.exists(path):
+            os.remove(path)
+        if self.sqlite:
+            self.conn = sqlite3.connect(path)
+            self.conn.executescript(SCHEMA)
+        else:
+            self.file = open(path, "a+b")
+
+    def emit(self, row, column, old, new, provider):
+        self.append({"row": int(row), "column": column, "old": old, "new": new, "provider": provider,
+                     "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds")})
+
+    def append(self, record):
+        r"""
+        Add a complete record, timestamp included, such as one read back from another sink.
+        """
+        self.buffer.append(record)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            if self.sqlite:
+                with self.conn:
+                    self.conn.executemany(
+                        'INSERT INTO changes (row, "column", old, new, provider, timestamp) VALUES (?, ?, ?, ?, ?, ?)',
+                        [(r["row"], r["column"], _text(r["old"]), _text(r["new"]), r["provider"], r["timestamp"])
+                         for r in self.buffer])
+            else:
+                self.file.seek(0, os.SEEK_END)
+                self.file.write(b"".join(json.dumps(r, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+                                         for r in self.buffer))
+                self.file.flush()
+            self.buffer = []
+
+    def position(self):
+        r"""
+        How much of the sink is saved: a byte offset for JSONL, the last record id for SQLite.
+        """
+        self.flush()
+        if self.sqlite:
+            return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()[0]
+        return self.file.seek(0, os.SEEK_END)
+
+    def truncate(self, position):
+        r"""
+        Drop every record written after `position`.
+        """
+        self.buffer = []
+        if self.sqlite:
+            with self.conn:
+                self.conn.execute("DELETE FROM changes WHERE id > ?", (position,))
+        else:
+            self.file.truncate(position)
+
+    def records(self):
+        r"""
+        Iterate over every saved record. SQLite sinks return them in row order, JSONL sinks in the order
+        the records finished.
+        """
+        self.flush()
+        if self.sqlite:
+            query = 'SELECT row, "column", old, new, provider, timestamp FROM changes ORDER BY row, id'
+            for row, column, old, new, provider, timestamp in self.conn.execute(query):
+                yield {"row": row, "column": column, "old": old, "new": new, "provider": provider,
+                       "timestamp": timestamp}
+        else:
+            self.file.seek(0)
+            for line in self.file:
+                if line.strip():
+                    yield json.loads(line)
+
+    def summary(self):
+        r"""
+        Number of distinct records changed and updates per column, in first-seen column order.
+        """
+        if self.sqlite:
+            self.flush()
+            rows_changed = self.conn.execute("SELECT COUNT(DISTINCT row) FROM changes").fetchone()[0]
+            column_counts = dict(self.conn.execute('SELECT "column", COUNT(*) FROM changes GROUP BY "column" '
+                                                   'ORDER BY MIN(id)'))
+            return rows_changed, column_counts
+        rows = set()
+        column_counts = {}
+        for record in self.records():
+            rows.add(record["row"])
+            column_counts[record["column"]] = column_counts.get(record["column"], 0) + 1
+        return len(rows), column_counts
+
+    def render_text(self, path, extra_summary_lines=()):
+        r"""
+        Write the human-readable changelog report.
+        """
+        total_changed_records, column_counts = self.summary()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("Changelog of Spreadsheet Updates\n")
+            f.write(f"{SEPARATOR}\n\n")
+            f.write(f"Total records changed: {total_changed_records}\n")
+            for col, count in column_counts.items():
+                f.write(f"Column {col} updated {count} times.\n")
+            for line in extra_summary_lines:
+                f.write(line + "\n")
+            f.write("\nDetailed Changes:\n")
+            for r in self.records():
+                f.write(f"Row {r['row']} - {r['column']} updated from '{r['old']}' to '{r['new']}' "
+                        f"via {r['provider']}.\n")
+                f.write(f"{SEPARATOR}\n")
+        return total_changed_records, column_counts
+
+    def close(self):
+        self.flush()
+        if self.sqlite:
+            self.conn.close()
+        else:
+            self.file.close()
+
+
+def _text(value):
+    return value if value is None or isinstance(value, str) else str(value)
@@ -0,0 +1,361 @@
+r"""
+Incremental citation graph built from the CR (cited references) field of Bibliometrix records.
+Records are added one at a time as they are enriched (see metadataCompleter.py --citation-graph), or from an
+existing dataset with this script. Every work, citing record or cited reference, is interned to an integer ID;
+references are identified by their DOI when they carry one, else by their normalized text.
+The graph lives in a directory as flat binary files, so only the interning table is held in memory:
+    nodes.tsv       id, key and label of every work, in ID order
+    rows.bin        per citing record: dataset row (int64) and work ID (int64)
+    indptr.bin      CSR row offsets (int64), one more than there are citing records
+    indices.bin     CSR column indices: the cited work IDs (int32)
+Exports stream from memory-mapped copies of these files: the edge list, co-citation counts (works cited together)
+and bibliographic coupling counts (records citing the same works). Pair counts are computed in partitions of at
+most PAIR_BUDGET pairs each, so their memory stays bounded whatever the size of the graph.
+
+Usage:
+    python citationGraph.py --graph ./records/citationGraph --from-dataset ./records/mergedDatasetEnhanced.xlsx
+    python citationGraph.py --graph ./records/citationGraph --edges edges.csv --cocitation cocitation.csv \
+        --coupling coupling.csv --min-count 2
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import re
+from array import array
+
+import numpy as np
+
+INDEX_DTYPE = np.int32
+EDGE_BUFFER = 1 << 20           # Edges held in memory before they are appended to indices.bin
+PAIR_BUDGET = 1 << 23           # Pairs counted at once by the co-citation and coupling exports
+
+DOI_RE = re.compile(r"10\.\d{4,9}/[^\s;,]+", re.IGNORECASE)
+
+
+def reference_key(reference):
+    r"""
+    Identity of a cited reference: "doi:<doi>" when it contains a DOI, else "ref:<normalized text>".
+    """
+    match = DOI_RE.search(reference)
+    if match:
+        return "doi:" + match.group(0).lower().rstrip(".")
+    return "ref:" + " ".join(re.sub(r"[^0-9A-Z]+", " ", reference.upper()).split())
+
+
+def split_references(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return []
+    return [part.strip() for part in str(value).split(";") if part.strip() and part.strip().lower() != "none"]
+
+
+def _key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+class CitationGraph:
+    r"""
+    Append-only graph writer. add_record() takes the records in any order; each one becomes the next CSR row.
+    A graph directory is started over when opened, because a run re-adds every record of the dataset.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.ids = {}           # key hash -> work ID
+        self.edges = 0
+        self.records = 0
+        self._edge_buffer = array("i")
+        self._nodes = open(os.path.join(path, "nodes.tsv"), "w", encoding="utf-8", newline="")
+        self._rows = open(os.path.join(path, "rows.bin"), "wb")
+        self._indptr = open(os.path.join(path, "indptr.bin"), "wb")
+        self._indices = open(os.path.join(path, "indices.bin"), "wb")
+        self._indptr.write(np.zeros(1, dtype=np.int64).tobytes())
+        for name in ("t_indptr.bin", "t_indices.bin"):
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+
+    def intern(self, key, label):
+        key_hash = _key_hash(key)
+        work_id = self.ids.get(key_hash)
+        if work_id is None:
+            work_id = self.ids[key_hash] = len(self.ids)
+            label = " ".join(str(label).split())
+            self._nodes.write(f"{work_id}\t{key}\t{label}\n")
+        return work_id
+
+    def add_record(self, row, doi, references):
+        r"""
+        Add a citing record: its dataset row, its normalized DOI ("" if none) and its CR value.
+        Repeated references and self-citations count once and not at all.
+        """
+        citing = self.intern(f"doi:{doi}" if doi else f"row:{row}", doi or f"row {row}")
+        cited = []
+        for reference in split_references(references):
+            work_id = self.intern(reference_key(reference), reference)
+            if work_id != citing:
+                cited.append(work_id)
+        cited = sorted(set(cited))
+        self._edge_buffer.extend(cited)
+        self.edges += len(cited)
+        self.records += 1
+        self._rows.write(np.array([row, citing], dtype=np.int64).tobytes())
+        self._indptr.write(np.array([self.edges], dtype=np.int64).tobytes())
+        if len(self._edge_buffer) >= EDGE_BUFFER:
+            self.flush()
+
+    def flush(self):
+        self._indices.write(self._edge_buffer.tobytes())
+        self._edge_buffer = array("i")
+        for f in (self._nodes, self._rows, self._indptr, self._indices):
+            f.flush()
+
+    def close(self):
+        self.flush()
+        for f in (self._nodes, self._rows, self._indptr, self._indices):
+            f.close()
+
+
+def _memmap(path, dtype):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class GraphReader:
+    r"""
+    Read-only, memory-mapped view of a graph directory written by CitationGraph.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.indptr = _memmap(os.path.join(path, "indptr.bin"), np.int64)
+        self.indices = _memmap(os.path.join(path, "indices.bin"), INDEX_DTYPE)
+        rows = _memmap(os.path.join(path, "rows.bin"), np.int64).reshape(-1, 2)
+        self.rows, self.citing = rows[:, 0], rows[:, 1]
+        with open(os.path.join(path, "nodes.tsv"), "rb") as f:
+            self.node_count = sum(1 for _ in f)
+
+    def labels(self):
+        r"""
+        Work ID -> label. Loads every label, so exports only call it when labels were asked for.
+        """
+        labels = []
+        with open(os.path.join(self.path, "nodes.tsv"), encoding="utf-8") as f:
+            for line in f:
+                labels.append(line.rstrip("\n").split("\t", 2)[2])
+        return labels
+
+    def transpose(self, block=EDGE_BUFFER):
+        r"""
+        The CSC view (cited work -> citing CSR rows), built once on disk with a counting sort over blocks of edges.
+        """
+        t_indptr_path = os.path.join(self.path, "t_indptr.bin")
+        t_indices_path = os.path.join(self.path, "t_indices.bin")
+        if not os.path.exists(t_indptr_path):
+            t_indptr = np.zeros(self.node_count + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=self.node_count), out=t_indptr[1:])
+            if len(self.indices):
+                t_indices = np.memmap(t_indices_path + ".part", dtype=INDEX_DTYPE, mode="w+",
+                                      shape=(len(self.indices),))
+                cursor = t_indptr[:-1].copy()
+                for start in range(0, len(self.indices), block):
+                    cited = np.asarray(self.indices[start:start + block])
+                    # CSR row of every edge in the block
+                    first_row = np.searchsorted(self.indptr, start, side="right") - 1
+                    last_row = np.searchsorted(self.indptr, start + len(cited), side="left")
+                    bounds = np.clip(np.asarray(self.indptr[first_row:last_row + 1]) - start, 0, len(cited))
+                    citing_rows = np.repeat(np.arange(first_row, last_row, dtype=INDEX_DTYPE), np.diff(bounds))
+                    order = np.argsort(cited, kind="stable")
+                    cited, citing_rows = cited[order], citing_rows[order]
+                    unique, first, counts = np.unique(cited, return_index=True, return_counts=True)
+                    rank = np.arange(len(cited)) - np.repeat(first, counts)
+                    t_indices[cursor[cited] + rank] = citing_rows
+                    cursor[unique] += counts
+                t_indices.flush()
+                del t_indices
+                os.replace(t_indices_path + ".part", t_indices_path)
+            else:
+                open(t_indices_path, "wb").close()
+            t_indptr.tofile(t_indptr_path)
+        return _memmap(t_indptr_path, np.int64), _memmap(t_indices_path, INDEX_DTYPE)
+
+
+def export_edges(graph, path, labels=False):
+    r"""
+    Write the edge list (citing work ID, cited work ID, and the labels if asked) to a CSV file.
+    """
+    names = graph.labels() if labels else None
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "target"] + (["source_label", "target_label"] if labels else []))
+        for row in range(len(graph.citing)):
+            source = int(graph.citing[row])
+            for target in graph.indices[graph.indptr[row]:graph.indptr[row + 1]]:
+                target = int(target)
+                writer.writerow([source, target] + ([names[source], names[target]] if labels else []))
+
+
+def _group_pair_keys(members, start, stop, node_count):
+    r"""
+    Keys a * node_count + b of the pairs (members[i], members[j]) with start <= i < stop and i < j, in slices
+    of at most PAIR_BUDGET pairs.
+    """
+    n = len(members)
+    partners = n - 1 - np.arange(start, stop, dtype=np.int64)
+    cumulative = np.cumsum(partners)
+    done = 0
+    while start < stop:
+        if partners[0] > PAIR_BUDGET:
+            # A single member with more partners than the budget: slice its partners
+            for j in range(start + 1, n, PAIR_BUDGET):
+                yield np.int64(members[start]) * node_count + members[j:j + PAIR_BUDGET]
+            end = start + 1
+        else:
+            end = start + int(np.searchsorted(cumulative, done + PAIR_BUDGET, side="right"))
+            rows = np.arange(start, end)
+            repeats = partners[:end - start]
+            first = np.repeat(rows, repeats)
+            second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+            yield members[first].astype(np.int64) * node_count + members[second]
+        done = cumulative[end - start - 1]
+        partners, cumulative = partners[end - start:], cumulative[end - start:]
+        start = end
+
+
+def _add_counts(keys, counts, batch):
+    merged = np.concatenate([keys] + batch)
+    weights = np.concatenate([counts, np.ones(len(merged) - len(keys), dtype=np.int64)])
+    keys, inverse = np.unique(merged, return_inverse=True)
+    return keys, np.bincount(inverse, weights=weights).astype(np.int64)
+
+
+def pair_counts(indptr, indices, node_count, min_count, eligible):
+    r"""
+    Count how often each pair of nodes occurs in the same group, where group g holds
+    indices[indptr[g]:indptr[g + 1]] (sorted). Only nodes flagged in `eligible` take part.
+    Yields (node a, node b, count) with a < b and count >= min_count, partitioned by node a so that no
+    partition counts more than PAIR_BUDGET pairs. A partition of a single node may count more, but only
+    generates the pairs it counts, PAIR_BUDGET at a time, and holds at most one count per distinct partner.
+    """
+    # Groups of one cannot hold a pair
+    groups = np.flatnonzero(np.diff(np.asarray(indptr)) > 1)
+    # Pairs each node contributes as the smaller member, to size the partitions
+    first_pairs = np.zeros(node_count, dtype=np.int64)
+    for g in groups:
+        members = np.asarray(indices[indptr[g]:indptr[g + 1]])
+        members = members[eligible[members]]
+        if len(members) > 1:
+            first_pairs[members] += np.arange(len(members) - 1, -1, -1)
+    cumulative = np.cumsum(first_pairs)
+    low = 0
+    while low < node_count:
+        high = int(np.searchsorted(cumulative, (cumulative[low - 1] if low else 0) + PAIR_BUDGET, side="right"))
+        high = max(high, low + 1)
+        if cumulative[high - 1] > (cumulative[low - 1] if low else 0):
+            keys, counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+            batch, batched = [], 0
+            for g in groups:
+                members = np.asarray(indices[indptr[g]:indptr[g + 1]])
+                members = members[eligible[members]]
+                if len(members) < 2 or members[0] >= high or members[-2] < low:
+                    continue
+                # Only the members in the partition pair with the members after them
+                start, stop = np.searchsorted(members, [low, high])
+                for pair_keys in _group_pair_keys(members, int(start), min(int(stop), len(members) - 1),
+                                                  node_count):
+                    batch.append(pair_keys)
+                    batched += len(pair_keys)
+                    if batched >= PAIR_BUDGET:
+                        keys, counts = _add_counts(keys, counts, batch)
+                        batch, batched = [], 0
+            if batch:
+                keys, counts = _add_counts(keys, counts, batch)
+            keep = counts >= min_count
+            for key, count in zip(keys[keep], counts[keep]):
+                yield int(key // node_count), int(key % node_count), int(count)
+        low = high
+
+
+def export_cocitation(graph, path, min_count=2, labels=False):
+    r"""
+    Write co-citation counts: pairs of works cited together by at least `min_count` records.
+    """
+    in_degree = np.bincount(graph.indices, minlength=graph.node_count)
+    names = graph.labels() if labels else None
+    pairs = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["work_a", "work_b", "cocitations"] + (["label_a", "label_b"] if labels else []))
+        for a, b, count in pair_counts(graph.indptr, graph.indices, graph.node_count, min_count,
+                                       in_degree >= min_count):
+            writer.writerow([a, b, count] + ([names[a], names[b]] if labels else []))
+            pairs += 1
+    return pairs
+
+
+def export_coupling(graph, path, min_count=1, labels=False):
+    r"""
+    Write bibliographic coupling counts: pairs of citing records sharing at least `min_count` references.
+    Records are given as work IDs (their DOI node) and dataset rows.
+    """
+    t_indptr, t_indices = graph.transpose()
+    out_degree = np.diff(np.asarray(graph.indptr))
+    names = graph.labels() if labels else None
+    pairs = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["work_a", "work_b", "row_a", "row_b", "shared_references"]
+                        + (["label_a", "label_b"] if labels else []))
+        for a, b, count in pair_counts(t_indptr, t_indices, len(graph.citing), min_count, out_degree >= min_count):
+            work_a, work_b = int(graph.citing[a]), int(graph.citing[b])
+            writer.writerow([work_a, work_b, int(graph.rows[a]), int(graph.rows[b]), count]
+                            + ([names[work_a], names[work_b]] if labels else []))
+            pairs += 1
+    return pairs
+
+
+def build_from_dataset(dataset, graph_path, chunk_rows=5000):
+    r"""
+    Build the graph from the CR column of an existing dataset.
+    """
+    from datasetIO import read_chunks
+    graph = CitationGraph(graph_path)
+    try:
+        for chunk in read_chunks(dataset, chunk_rows):
+            dois = chunk["DI"] if "DI" in chunk.columns else [None] * len(chunk)
+            references = chunk["CR"] if "CR" in chunk.columns else [None] * len(chunk)
+            for row, doi, cr in zip(chunk.index, dois, references):
+                match = DOI_RE.search(str(doi)) if doi is not None else None
+                graph.add_record(int(row), match.group(0).lower() if match else "", cr)
+    finally:
+        graph.close()
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and export a citation graph from Bibliometrix CR fields.")
+    parser.add_argument("--graph", required=True, help="Graph directory.")
+    parser.add_argument("--from-dataset", help="Build the graph from this dataset's CR column first.")
+    parser.add_argument("--edges", help="Write the edge list to this CSV file.")
+    parser.add_argument("--cocitation", help="Write co-citation counts to this CSV file.")
+    parser.add_argument("--coupling", help="Write bibliographic coupling counts to this CSV file.")
+    parser.add_argument("--min-count", type=int, default=2, help="Smallest pair count written.")
+    parser.add_argument("--labels", action="store_true", help="Add work labels to the exports.")
+    args = parser.parse_args()
+    if args.from_dataset:
+        graph = build_from_dataset(args.from_dataset, args.graph)
+        print(f"Built {args.graph}: {graph.records} records, {len(graph.ids)} works, {graph.edges} citations")
+    graph = GraphReader(args.graph)
+    if args.edges:
+        export_edges(graph, args.edges, labels=args.labels)
+        print(f"Edge list saved as {args.edges} ({len(graph.indices)} edges)")
+    if args.cocitation:
+        pairs = export_cocitation(graph, args.cocitation, args.min_count, labels=args.labels)
+        print(f"Co-citation counts saved as {args.cocitation} ({pairs} pairs)")
+    if args.coupling:
+        pairs = export_coupling(graph, args.coupling, args.min_count, labels=args.labels)
+        print(f"Bibliographic coupling counts saved as {args.coupling} ({pairs} pairs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+r"""
+Chunked reading and writing of the merged dataset for metadataCompleter.py.
+The format follows the file extension: .xlsx, .csv, .parquet, or .arrow/.feather (Arrow IPC).
+Readers yield DataFrames of at most `chunk_rows` records whose index continues from chunk to chunk, so row numbers
+match a whole-file read. Writers append chunks as they come; the XLSX writer uses openpyxl's write-only mode, so
+neither side ever holds the whole dataset.
+"""
+
+import os
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+DEFAULT_CHUNK_ROWS = 5000
+
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc")
+
+
+def dataset_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".xlsx", ".xlsm"):
+        return "xlsx"
+    if extension in (".csv", ".txt"):
+        return "csv"
+    if extension in (".parquet", ".pq"):
+        return "parquet"
+    if extension in ARROW_EXTENSIONS:
+        return "arrow"
+    raise ValueError(f"Unsupported dataset format: {path} (use .xlsx, .csv, .parquet or .arrow)")
+
+
+def _indexed(frame, start):
+    frame.index = pd.RangeIndex(start, start + len(frame))
+    return frame
+
+
+def _read_xlsx(path, chunk_rows):
+    workbook = load_workbook(path, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(name) if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+        start = 0
+        buffer = []
+        # Blank rows are kept, as pandas.read_excel keeps them, once a later row shows they are not the trailing
+        # blank rows that read_excel drops (read-only sheets often report many of them)
+        blank_rows = 0
+        for values in rows:
+            if all(value is None for value in values):
+                blank_rows += 1
+                continue
+            pending = [(None,) * len(columns)] * blank_rows + [values[:len(columns)]]
+            blank_rows = 0
+            for row in pending:
+                buffer.append(row)
+                if len(buffer) == chunk_rows:
+                    yield _indexed(pd.DataFrame(buffer, columns=columns), start)
+                    start += len(buffer)
+                    buffer = []
+        if buffer:
+            yield _indexed(pd.DataFrame(buffer, columns=columns), start)
+    finally:
+        workbook.close()
+
+
+def _read_csv(path, chunk_rows):
+    # Read as text so identifiers like PMIDs and years are written back exactly as they came in
+    yield from pd.read_csv(path, chunksize=chunk_rows, dtype=str)
+
+
+def _read_parquet(path, chunk_rows):
+    import pyarrow.parquet as pq
+    start = 0
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+        yield _indexed(batch.to_pandas(integer_object_nulls=True), start)
+        start += batch.num_rows
+
+
+def _read_arrow(path, chunk_rows):
+    import pyarrow as pa
+    start = 0
+    with pa.memory_map(path) as source:
+        try:
+            reader = pa.ipc.open_file(source)
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        except pa.ArrowInvalid:
+            source.seek(0)
+            batches = pa.ipc.open_stream(source)
+        for batch in batches:
+            for offset in range(0, batch.num_rows, chunk_rows):
+                piece = batch.slice(offset, chunk_rows)
+                yield _indexed(piece.to_pandas(integer_object_nulls=True), start)
+                start += piece.num_rows
+
+
+def read_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    r"""
+    Yield the dataset at `path` as DataFrames of at most `chunk_rows` records.
+    """
+    readers = {"xlsx": _read_xlsx, "csv": _read_csv, "parquet": _read_parquet, "arrow": _read_arrow}
+    yield from readers[dataset_format(path)](path, chunk_rows)
+
+
+def _is_blank(value):
+    return value is None or (isinstance(value, float) and pd.isna(value))
+
+
+def _xlsx_value(value):
+    if _is_blank(value):
+        return None
+    if isinstance(value, str):
+        # Control characters from API text are not allowed in XLSX and would abort the whole write
+        return ILLEGAL_CHARACTERS_RE.sub("", value)
+    return value
+
+
+class ChunkWriter:
+    r"""
+    Append DataFrame chunks to a dataset file. Every chunk must have the columns given to the constructor.
+    Parquet and Arrow outputs store every column as text, because enriched columns mix strings and numbers.
+    """
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        self.format = dataset_format(path)
+        self.rows_written = 0
+        self._writer = None
+        if self.format == "xlsx":
+            self._workbook = Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet()
+            self._sheet.append(self.columns)
+        elif self.format == "csv":
+            self._file = open(path, "w", encoding="utf-8", newline="")
+        else:
+            import pyarrow as pa
+            self._schema = pa.schema([(column, pa.string()) for column in self.columns])
+
+    def _arrow_table(self, chunk):
+        import pyarrow as pa
+        arrays = [pa.array([None if _is_blank(value) else str(value) for value in chunk[column]], type=pa.string())
+                  for column in self.columns]
+        return pa.Table.from_arrays(arrays, schema=self._schema)
+
+    def write(self, chunk):
+        chunk = chunk[self.columns]
+        if self.format == "xlsx":
+            for values in chunk.itertuples(index=False, name=None):
+                self._sheet.append([_xlsx_value(value) for value in values])
+        elif self.format == "csv":
+            chunk.to_csv(self._file, header=self.rows_written == 0, index=False)
+        elif self.format == "parquet":
+            import pyarrow.parquet as pq
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            self._writer.write_table(self._arrow_table(chunk))
+        else:
+            import pyarrow as pa
+            if self._writer is None:
+                self._writer = pa.ipc.new_file(self.path, self._schema)
+            self._writer.write_table(self._arrow_table(chunk))
+        self.rows_written += len(chunk)
+
+    def close(self):
+        if self.format == "xlsx":
+            self._workbook.save(self.path)
+        elif self.format == "csv":
+            if self.rows_written == 0:
+                pd.DataFrame(columns=self.columns).to_csv(self._file, index=False)
+            self._file.close()
+        else:
+            if self._writer is None:
+                self.write(pd.DataFrame(columns=self.columns))
+            self._writer.close()
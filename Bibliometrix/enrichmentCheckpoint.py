@@ -0,0 +1,98 @@
+r"""
+Checkpoint store for metadataCompleter.py, so a crashed or interrupted enrichment can resume where it stopped.
+A small SQLite sidecar holds, for every finished record, the cell updates it received (column, old value,
+new value, provider), plus the provider query counters and a fingerprint of the input file. The enriched
+dataset is rebuilt from the updates. The changelog sink is flushed with every checkpoint and its saved position
+is stored alongside, so on resume the sink is cut back to exactly what the checkpoint covers.
+"""
+
+import json
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    idx INTEGER PRIMARY KEY,
+    has_doi INTEGER NOT NULL,
+    updates TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def input_fingerprint(path):
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+class EnrichmentCheckpoint:
+    r"""
+    Finished records are buffered and written in one transaction every `interval` records, or on flush().
+    Only the event loop thread uses it. `changelog` is the run's ChangelogSink, if any.
+    """
+    def __init__(self, path, input_file, interval=100, resume=False, changelog=None):
+        self.path = path
+        self.interval = interval
+        self.changelog = changelog
+        self.pending = []
+        if not resume and os.path.exists(path):
+            os.remove(path)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        fingerprint = input_fingerprint(input_file)
+        stored = self.get_meta("input")
+        if stored is not None and stored != fingerprint:
+            self.conn.close()
+            raise ValueError(f"Checkpoint {path} was made from a different version of {input_file}; "
+                             f"run without --resume to start over.")
+        self.set_meta("input", fingerprint)
+        self.conn.commit()
+        self.counters = self.get_meta("counters", {})
+        if changelog is not None:
+            # Records written after the last checkpoint belong to rows that will be enriched again
+            changelog.truncate(self.get_meta("changelog_position", 0))
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value, default=str)))
+
+    def completed(self, first, last):
+        r"""
+        Finished records with index first..last: idx -> (has_doi, [(column, old_value, new_value, provider), ...]).
+        """
+        rows = self.conn.execute("SELECT idx, has_doi, updates FROM rows WHERE idx BETWEEN ? AND ?",
+                                 (int(first), int(last)))
+        return {idx: (bool(has_doi), [tuple(update) for update in json.loads(updates)])
+                for idx, has_doi, updates in rows}
+
+    def record(self, idx, has_doi, updates, counters):
+        r"""
+        Mark a record finished. `counters` are the provider statistics to store alongside it.
+        """
+        self.pending.append((int(idx), int(has_doi), json.dumps(updates, default=str)))
+        self.counters = counters
+        if len(self.pending) >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        changelog_position = self.changelog.position() if self.changelog is not None else None
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?)", self.pending)
+            self.set_meta("counters", self.counters)
+            if changelog_position is not None:
+                self.set_meta("changelog_position", changelog_position)
+        self.pending = []
+
+    def close(self, remove=False):
+        self.flush()
+        self.conn.close()
+        if remove:
+            os.remove(self.path)
@@ -0,0 +1,258 @@
+r"""
+Run metrics for metadataCompleter.py: which providers are slow, rate-limited, or fill nothing for this corpus.
+Two levels are measured:
+    HTTP, per rate-limited provider (NCBI, OpenAlex, ...): requests, response cache hits, statuses, retries
+        and a latency histogram.
+    Lookups, per entry of api_functions (NIH-OCC, PubMed, PMC, ...): lookups made, lookups that found the DOI,
+        a latency histogram, and how many cells of each column the provider filled.
+Everything is kept in memory under one lock, written as a JSON run report at the end of the run, and can be
+served live in the Prometheus text format from a local HTTP endpoint while the run is going.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in seconds; the last bucket is +Inf
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        self.counts[index] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, share):
+        r"""
+        Upper bound of the bucket holding the given quantile (None for an empty histogram or the +Inf bucket).
+        """
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= share * self.count:
+                return bound
+        return None
+
+    def to_dict(self):
+        return {"count": self.count, "sum_seconds": round(self.sum, 6),
+                "mean_seconds": round(self.sum / self.count, 6) if self.count else None,
+                "p50_seconds_at_most": self.quantile(0.5), "p95_seconds_at_most": self.quantile(0.95),
+                "buckets": {str(bound): count for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), self.counts)}}
+
+
+class HttpStats:
+    def __init__(self):
+        self.requests = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.statuses = {}
+        self.latency = Histogram()
+
+
+class LookupStats:
+    def __init__(self):
+        self.lookups = 0
+        self.found = 0
+        self.latency = Histogram()
+        self.fills = {}
+
+
+class EnrichmentMetrics:
+    r"""
+    Thread-safe collector shared by the worker threads and the event loop.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.http = {}
+        self.lookups = {}
+        self.records = 0
+        self.records_without_doi = 0
+        self.server = None
+
+    def _http(self, provider):
+        return self.http.setdefault(provider or "other", HttpStats())
+
+    def _lookup(self, label):
+        return self.lookups.setdefault(label, LookupStats())
+
+    def observe_cache_hit(self, provider):
+        with self.lock:
+            stats = self._http(provider)
+            stats.cache_hits += 1
+
+    def observe_request(self, provider, seconds, status=None):
+        r"""
+        One request that went to the network, retries included. `status` is None if no response ever came.
+        """
+        with self.lock:
+            stats = self._http(provider)
+            stats.requests += 1
+            stats.latency.observe(seconds)
+            if status is None:
+                stats.errors += 1
+            else:
+                stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    def observe_lookup(self, label, seconds, found):
+        with self.lock:
+            stats = self._lookup(label)
+            stats.lookups += 1
+            stats.found += bool(found)
+            stats.latency.observe(seconds)
+
+    def observe_fills(self, label, columns):
+        with self.lock:
+            fills = self._lookup(label).fills
+            for column in columns:
+                fills[column] = fills.get(column, 0) + 1
+
+    def observe_record(self, has_doi):
+        with self.lock:
+            self.records += 1
+            self.records_without_doi += not has_doi
+
+    @staticmethod
+    def _http_report(stats, retries):
+        answered = stats.cache_hits + stats.requests
+        return {"requests": stats.requests, "cache_hits": stats.cache_hits,
+                "cache_hit_rate": round(stats.cache_hits / answered, 4) if answered else None,
+                "retries": retries, "errors": stats.errors,
+                "statuses": {str(status): count for status, count in sorted(stats.statuses.items())},
+                "latency": stats.latency.to_dict()}
+
+    @staticmethod
+    def _lookup_report(stats):
+        return {"lookups": stats.lookups, "found": stats.found,
+                "success_ratio": round(stats.found / stats.lookups, 4) if stats.lookups else None,
+                "cells_filled": sum(stats.fills.values()), "fills_by_column": dict(stats.fills),
+                "latency": stats.latency.to_dict()}
+
+    def report(self, retries=None, extra=None):
+        r"""
+        The run report as a JSON-serializable dict. `retries` maps HTTP providers to retry counts (kept by the
+        transport); `extra` is merged in at the top level.
+        """
+        with self.lock:
+            elapsed = time.time() - self.started
+            report = {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "elapsed_seconds": round(elapsed, 3),
+                "records": self.records,
+                "records_without_doi": self.records_without_doi,
+                "records_per_second": round(self.records / elapsed, 3) if elapsed else None,
+                "http": {provider: self._http_report(stats, (retries or {}).get(provider, 0))
+                         for provider, stats in self.http.items()},
+                "providers": {label: self._lookup_report(stats) for label, stats in self.lookups.items()},
+            }
+        report.update(extra or {})
+        return report
+
+    def write_report(self, path, retries=None, extra=None):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(retries, extra), f, indent=2, ensure_ascii=False)
+
+    def prometheus_text(self, retries=None):
+        r"""
+        Current metrics in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_label_text(labels)} {value}")
+
+        def histogram(name, help_text, series):
+            samples = []
+            for labels, hist in series:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), hist.counts):
+                    cumulative += count
+                    samples.append((dict(labels, le=str(bound)), cumulative))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, value in samples:
+                lines.append(f"{name}_bucket{_label_text(labels)} {value}")
+            for labels, hist in series:
+                lines.append(f"{name}_sum{_label_text(labels)} {hist.sum}")
+                lines.append(f"{name}_count{_label_text(labels)} {hist.count}")
+
+        with self.lock:
+            metric("mdmt_records_processed_total", "counter", "Records finished in this run.",
+                   [({}, self.records)])
+            metric("mdmt_http_requests_total", "counter", "Provider requests sent to the network.",
+                   [({"provider": p}, s.requests) for p, s in self.http.items()])
+            metric("mdmt_http_cache_hits_total", "counter", "Provider requests answered by the response cache.",
+                   [({"provider": p}, s.cache_hits) for p, s in self.http.items()])
+            metric("mdmt_http_responses_total", "counter", "Final responses by HTTP status.",
+                   [({"provider": p, "status": str(status)}, count)
+                    for p, s in self.http.items() for status, count in s.statuses.items()])
+            metric("mdmt_http_errors_total", "counter", "Requests that never got a response.",
+                   [({"provider": p}, s.errors) for p, s in self.http.items()])
+            metric("mdmt_http_retries_total", "counter", "Retries after connection errors or retryable statuses.",
+                   [({"provider": p}, count) for p, count in (retries or {}).items()])
+            histogram("mdmt_http_request_duration_seconds", "Network request latency, retries included.",
+                      [({"provider": p}, s.latency) for p, s in self.http.items()])
+            metric("mdmt_provider_lookups_total", "counter", "Provider lookups made.",
+                   [({"provider": label}, s.lookups) for label, s in self.lookups.items()])
+            metric("mdmt_provider_lookups_found_total", "counter", "Provider lookups that found the DOI.",
+                   [({"provider": label}, s.found) for label, s in self.lookups.items()])
+            metric("mdmt_provider_fills_total", "counter", "Cells filled, by provider and column.",
+                   [({"provider": label, "column": column}, count)
+                    for label, s in self.lookups.items() for column, count in s.fills.items()])
+            histogram("mdmt_provider_lookup_duration_seconds", "Provider lookup latency.",
+                      [({"provider": label}, s.latency) for label, s in self.lookups.items()])
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, retries=None):
+        r"""
+        Serve prometheus_text() at http://127.0.0.1:<port>/metrics from a background thread.
+        `retries` is a callable returning the transport's retry counts.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = metrics.prometheus_text(retries() if retries else None).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    escaped = {key: str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+               for key, value in labels.items()}
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped.items()) + "}"
@@ -0,0 +1,404 @@
+r"""
+Sharded enrichment for metadataCompleter.py: one dataset enriched by independent worker processes, on one host or
+several, and merged back into one enriched dataset.
+A worker is metadataCompleter.py run with --shard K/N. It streams the whole input but only enriches the records of
+shard K, writes them with their input row number in ROW_COLUMN, and keeps its own checkpoint, changelog sink and
+metrics report, all named after the shard (see shard_path). When it finishes it writes a manifest next to its
+output describing the shard, the input it was made from (by content hash) and where its files are.
+Records are assigned to shards by contiguous row ranges or by a hash of the normalized DOI; hash buckets keep every
+spelling of a DOI in one shard, so duplicate rows still share their lookups.
+Merging streams the shard outputs side by side in row order, so no dataset is ever held whole, and checks that
+    every manifest was made from the same input, with the same shard layout, and every shard is present;
+    every input row is covered;
+    a row enriched by more than one worker (a shard re-run on another host, say) got the same values everywhere.
+Disagreeing rows are conflicts: they are written to a CSV report and fail the merge, unless --on-conflict first
+keeps the values of the first manifest (lowest shard, then earliest finished). The shard changelogs are merged in
+row order into one sink, and the text changelog is rendered from it.
+
+Usage:
+    python metadataCompleter.py --shard 2/4 [options]           (once per shard, on any host)
+    python enrichmentShards.py merge records/mergedDatasetEnhanced.shard*of4.json
+    python enrichmentShards.py run --shards 4 -- [metadataCompleter options]    (every shard here, then merge)
+"""
+
+import argparse
+import csv
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from changelogSink import ChangelogSink
+from datasetIO import read_chunks, ChunkWriter, DEFAULT_CHUNK_ROWS
+
+ROW_COLUMN = "_row"             # Input row number of every record in a shard output
+SHARD_METHODS = ("hash", "range")
+SHARD_RE = re.compile(r"^\s*(\d+)\s*/\s*(\d+)\s*$")
+
+# Same defaults as metadataCompleter.py
+OUTPUT_FILE = "./records/mergedDatasetEnhanced.xlsx"
+CHANGELOG_FILE = "changelog.txt"
+CHANGELOG_SINK = "changelog.jsonl"
+CONFLICTS_FILE = "./records/shardConflicts.csv"
+
+
+def parse_shard(text):
+    r"""
+    "K/N" -> (K, N), with shards numbered from 1. Raises ValueError.
+    """
+    match = SHARD_RE.match(text or "")
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"Invalid shard {text!r}: use K/N with 1 <= K <= N, e.g. 2/4")
+    return int(match.group(1)), int(match.group(2))
+
+
+def shard_path(path, index, count):
+    r"""
+    The per-shard name of a file: records/out.xlsx -> records/out.shard2of4.xlsx
+    """
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.shard{index}of{count}{extension}"
+
+
+def manifest_path(output_file):
+    return os.path.splitext(output_file)[0] + ".json"
+
+
+def shard_for_row(row, doi, count, method, total_rows=None):
+    r"""
+    Shard (1..count) of input row `row`. `doi` is the normalized DOI or None; records without one are bucketed
+    by row number. Range sharding needs the input's `total_rows`.
+    """
+    if method == "range":
+        return row * count // max(total_rows, 1) + 1
+    key = doi if doi else f"row:{row}"
+    # A stable hash, unlike hash(), so every process and host agrees
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count + 1
+
+
+def input_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_manifest(path, manifest):
+    # Written under a temporary name, so a merge never sees half a manifest
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def shard_manifest(index, count, method, input_file, input_rows, columns, output_file, changelog_sink,
+                   metrics_report, rows):
+    r"""
+    The manifest a finished worker writes next to its output. File paths are stored relative to the manifest, so
+    shard directories collected from several hosts can be merged wherever they end up.
+    """
+    base = os.path.dirname(os.path.abspath(manifest_path(output_file)))
+    return {
+        "shard": index,
+        "shards": count,
+        "by": method,
+        "input": {"name": os.path.basename(input_file), "size": os.path.getsize(input_file),
+                  "blake2b": input_digest(input_file), "rows": input_rows},
+        "columns": [column for column in columns if column != ROW_COLUMN],
+        "rows": rows,
+        "output": os.path.relpath(os.path.abspath(output_file), base),
+        "changelog_sink": os.path.relpath(os.path.abspath(changelog_sink), base),
+        "metrics_report": os.path.relpath(os.path.abspath(metrics_report), base),
+        "finished": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def load_manifests(paths):
+    r"""
+    Read and cross-check shard manifests. Returns them in merge order: by shard, then earliest finished.
+    Raises ValueError if they do not describe one complete sharded run of one input.
+    """
+    if not paths:
+        raise ValueError("No shard manifests given")
+    manifests = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        base = os.path.dirname(os.path.abspath(path))
+        manifest["path"] = path
+        for key in ("output", "changelog_sink"):
+            manifest[key] = os.path.normpath(os.path.join(base, manifest[key]))
+        manifests.append(manifest)
+    manifests.sort(key=lambda m: (m["shard"], m["finished"], m["path"]))
+    first = manifests[0]
+    for manifest in manifests[1:]:
+        if manifest["input"]["blake2b"] != first["input"]["blake2b"]:
+            raise ValueError(f"{manifest['path']} was made from a different input than {first['path']} "
+                             f"({manifest['input']['name']} vs {first['input']['name']})")
+        if (manifest["shards"], manifest["by"]) != (first["shards"], first["by"]):
+            raise ValueError(f"{manifest['path']} uses {manifest['shards']} shards by {manifest['by']}, "
+                             f"{first['path']} uses {first['shards']} by {first['by']}")
+        if manifest["columns"] != first["columns"]:
+            raise ValueError(f"{manifest['path']} and {first['path']} have different columns")
+    missing = sorted(set(range(1, first["shards"] + 1)) - {m["shard"] for m in manifests})
+    if missing:
+        raise ValueError(f"No manifest for shard(s) {', '.join(map(str, missing))} of {first['shards']}")
+    return manifests
+
+
+def _cell(value):
+    # Values as read back from any output format: blanks are None, everything else compares as text
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    return str(value)
+
+
+def shard_rows(manifest, order, columns, chunk_rows):
+    r"""
+    Yield (input row, manifest order, values) for every record of a shard output, checking the rows ascend.
+    """
+    previous = -1
+    for chunk in read_chunks(manifest["output"], chunk_rows):
+        if ROW_COLUMN not in chunk.columns:
+            raise ValueError(f"{manifest['output']} has no {ROW_COLUMN} column; is it a shard output?")
+        for row, values in zip(chunk[ROW_COLUMN], chunk[columns].itertuples(index=False, name=None)):
+            row = int(row)
+            if row <= previous:
+                raise ValueError(f"{manifest['output']}: rows are not in input order at row {row}")
+            previous = row
+            yield row, order, values
+
+
+class ConflictReport:
+    r"""
+    CSV of every cell that two shard outputs disagree on, opened on the first conflict.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.count = 0
+
+    def add(self, row, column, kept, kept_value, other, other_value):
+        if self.file is None:
+            self.file = open(self.path, "w", encoding="utf-8", newline="")
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(["row", "column", "kept_manifest", "kept_value", "other_manifest", "other_value"])
+        self.writer.writerow([row, column, kept, kept_value, other, other_value])
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def merge_outputs(manifests, output_file, conflicts, chunk_rows):
+    r"""
+    Stream the shard outputs into `output_file` in input row order. Returns (rows written, overlapping rows,
+    winners), where winners maps every row found in several outputs to the manifest order it was taken from.
+    """
+    columns = manifests[0]["columns"]
+    total_rows = manifests[0]["input"]["rows"]
+    streams = [shard_rows(manifest, order, columns, chunk_rows) for order, manifest in enumerate(manifests)]
+    writer = ChunkWriter(output_file, columns)
+    buffer = []
+    winners = {}
+    missing = []
+    expected = 0
+    try:
+        # (row, order) is unique, so the values are never compared
+        for row, group in itertools.groupby(heapq.merge(*streams), key=lambda item: item[0]):
+            if row >= total_rows:
+                raise ValueError(f"Row {row} is beyond the {total_rows} rows of the input")
+            missing.extend(range(expected, row))
+            expected = row + 1
+            _, kept_order, kept = next(group)
+            for _, order, values in group:
+                winners[row] = kept_order
+                for column, kept_value, value in zip(columns, kept, values):
+                    if _cell(kept_value) != _cell(value):
+                        conflicts.add(row, column, manifests[kept_order]["path"], _cell(kept_value),
+                                      manifests[order]["path"], _cell(value))
+            buffer.append(kept)
+            if len(buffer) >= chunk_rows:
+                writer.write(pd.DataFrame(buffer, columns=columns))
+                buffer = []
+        missing.extend(range(expected, total_rows))
+        if missing:
+            shown = ", ".join(map(str, missing[:10])) + (", ..." if len(missing) > 10 else "")
+            raise ValueError(f"{len(missing)} input rows are in no shard output: {shown}")
+        if buffer:
+            writer.write(pd.DataFrame(buffer, columns=columns))
+        writer.close()
+    except BaseException:
+        writer.close()
+        raise
+    return writer.rows_written, len(winners), winners
+
+
+def merge_changelogs(manifests, winners, changelog_sink, changelog_file, extra_summary_lines=()):
+    r"""
+    Merge the shard changelog sinks into `changelog_sink` in row order, keeping the records of rows found in
+    several outputs only from the manifest the row was taken from, and render the text changelog.
+    """
+    staging_path = f"{changelog_sink}.merge.sqlite"
+    # A SQLite sink hands its records back in row order
+    staging = ChangelogSink(staging_path)
+    try:
+        for order, manifest in enumerate(manifests):
+            shard_sink = ChangelogSink(manifest["changelog_sink"], resume=True)
+            try:
+                for record in shard_sink.records():
+                    if winners.get(record["row"], order) == order:
+                        staging.append(record)
+            finally:
+                shard_sink.close()
+        merged = ChangelogSink(changelog_sink)
+        try:
+            for record in staging.records():
+                merged.append(record)
+            return merged.render_text(changelog_file, extra_summary_lines)
+        finally:
+            merged.close()
+    finally:
+        staging.close()
+        os.remove(staging_path)
+
+
+def merge_shards(manifest_paths, output_file=OUTPUT_FILE, changelog_sink=CHANGELOG_SINK,
+                 changelog_file=CHANGELOG_FILE, conflicts_file=CONFLICTS_FILE, on_conflict="fail",
+                 chunk_rows=DEFAULT_CHUNK_ROWS):
+    r"""
+    Merge finished shards into one enriched dataset and changelog. Raises ValueError when the manifests do not
+    fit together, rows are missing, or (with on_conflict="fail") shard outputs disagree.
+    Returns (rows written, rows found in several outputs, conflicting cells).
+    """
+    manifests = load_manifests(manifest_paths)
+    stem, extension = os.path.splitext(output_file)
+    partial_file = f"{stem}.part{extension}"
+    conflicts = ConflictReport(conflicts_file)
+    try:
+        rows, overlapping, winners = merge_outputs(manifests, partial_file, conflicts, chunk_rows)
+        conflicts.close()
+        if conflicts.count and on_conflict == "fail":
+            raise ValueError(f"{conflicts.count} cells differ between shard outputs (see {conflicts_file}); "
+                             f"re-run the shards involved, or merge with --on-conflict first")
+    except BaseException:
+        conflicts.close()
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        raise
+    if not conflicts.count and os.path.exists(conflicts_file):
+        # A report left by an earlier merge would no longer be true
+        os.remove(conflicts_file)
+    summary = [f"Merged from {manifests[0]['shards']} shards by {manifests[0]['by']} "
+               f"({len(manifests)} manifests, {overlapping} rows in more than one)"]
+    if conflicts.count:
+        summary.append(f"Conflicting cells resolved in favour of the first manifest: {conflicts.count}")
+    merge_changelogs(manifests, winners, changelog_sink, changelog_file, summary)
+    os.replace(partial_file, output_file)
+    return rows, overlapping, conflicts.count
+
+
+def run_shards(count, method, completer_args, python=sys.executable):
+    r"""
+    Run every shard as a local metadataCompleter.py process and wait for them. Each process gets 1/count of the
+    provider rate limits, since they all share this host's address; they also share the response cache, which
+    waits out the other processes' writes (see responseCache.py). Returns the manifest paths of the shards that
+    finished; each worker's output is in a log named after its shard.
+    """
+    import metadataCompleter
+    args = metadataCompleter.parse_args(completer_args)
+    completer = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metadataCompleter.py")
+    workers = []
+    finished = []
+    for index in range(1, count + 1):
+        output_file = shard_path(args.output, index, count)
+        manifest = manifest_path(output_file)
+        if os.path.exists(manifest):
+            if args.resume:
+                # With --resume, shards finished by an earlier run are kept as they are
+                print(f"Shard {index}/{count} already finished")
+                finished.append(manifest)
+                continue
+            os.remove(manifest)
+        log_path = shard_path(os.path.splitext(args.output)[0] + ".log", index, count)
+        log = open(log_path, "w", encoding="utf-8")
+        command = [python, completer, *completer_args, "--shard", f"{index}/{count}", "--shard-by", method,
+                   "--rate-share", str(1 / count)]
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+        workers.append((index, manifest, log_path, log, process))
+        print(f"Shard {index}/{count} started (log: {log_path})")
+    for index, manifest, log_path, log, process in workers:
+        process.wait()
+        log.close()
+        if os.path.exists(manifest):
+            finished.append(manifest)
+            print(f"Shard {index}/{count} finished")
+        else:
+            print(f"Shard {index}/{count} did not finish; see {log_path}, then re-run it with --resume")
+    return sorted(finished)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run metadataCompleter.py in shards and merge their outputs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_merge_arguments(subparser):
+        subparser.add_argument("--output", default=OUTPUT_FILE, help="Merged enriched dataset.")
+        subparser.add_argument("--changelog-sink", default=CHANGELOG_SINK, help="Merged structured changelog.")
+        subparser.add_argument("--changelog-file", default=CHANGELOG_FILE, help="Merged text changelog.")
+        subparser.add_argument("--conflicts", default=CONFLICTS_FILE, help="CSV report of conflicting cells.")
+        subparser.add_argument("--on-conflict", choices=("fail", "first"), default="fail",
+                               help="Fail on conflicting shard outputs, or keep the first manifest's values.")
+        subparser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+
+    merge_parser = subparsers.add_parser("merge", help="Merge finished shards into one dataset and changelog.")
+    merge_parser.add_argument("manifests", nargs="+", help="Shard manifests (.json next to each shard output).")
+    add_merge_arguments(merge_parser)
+
+    run_parser = subparsers.add_parser("run", help="Run every shard on this host, then merge them.")
+    run_parser.add_argument("--shards", type=int, required=True, help="Number of shards (worker processes).")
+    run_parser.add_argument("--shard-by", choices=SHARD_METHODS, default="hash")
+    add_merge_arguments(run_parser)
+    run_parser.add_argument("completer_args", nargs=argparse.REMAINDER,
+                            help="Options passed to every metadataCompleter.py worker, after --.")
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.command == "run":
+        if args.shards < 1:
+            print("--shards must be at least 1")
+            return
+        completer_args = args.completer_args[1:] if args.completer_args[:1] == ["--"] else args.completer_args
+        manifests = run_shards(args.shards, args.shard_by, completer_args)
+        if len(manifests) < args.shards:
+            print("Not every shard finished; nothing merged.")
+            return
+    else:
+        manifests = args.manifests
+    try:
+        rows, overlapping, conflicts = merge_shards(manifests, args.output, args.changelog_sink, args.changelog_file,
+                                                    args.conflicts, args.on_conflict, args.chunk_rows)
+    except (ValueError, OSError) as e:
+        print(f"Error merging shards: {e}")
+        return
+    print(f"Merged {rows} records from {len(manifests)} shard manifests into {args.output} "
+          f"in {time.time() - start:.1f} seconds")
+    if overlapping:
+        print(f"{overlapping} rows were enriched by more than one shard; {conflicts} cells disagreed"
+              + (f" (see {args.conflicts})" if conflicts else ""))
+    print(f"Changelog saved as {args.changelog_file} (records in {args.changelog_sink})")
+
+
+if __name__ == "__main__":
+    main()
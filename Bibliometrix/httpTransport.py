@@ -0,0 +1,210 @@
+r"""
+Shared HTTP transport for metadataCompleter.py.
+One keep-alive requests.Session per host, a rate limiter and circuit breaker per provider, and bounded retries with
+exponential backoff and full jitter that honour the server's Retry-After header.
+With `redirect`, every request goes to that base URL instead, as <redirect>/<original host><original path>; this is
+how the completer is pointed at the local mock providers (mockProviders.py).
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Statuses that mean "try again later" rather than "no such record"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class ProviderUnavailable(Exception):
+    r"""
+    Raised when a provider's circuit is open or a request still fails after every retry.
+    """
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces calls at least 1/rate seconds apart.
+    Each caller reserves the next free slot under the lock and sleeps outside it.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def acquire(self):
+        # Returns the seconds spent waiting for the slot
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+        return max(wait, 0.0)
+
+
+class CircuitBreaker:
+    r"""
+    Opens after `threshold` consecutive failed requests. While open, requests fail at once instead of waiting
+    out their retries; after `cooldown` seconds one trial request is let through, and its outcome closes the
+    circuit or opens it again.
+    """
+    def __init__(self, threshold=5, cooldown=300):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_running:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        r"""
+        Returns True if this failure opened (or re-opened) the circuit.
+        """
+        with self.lock:
+            self.failures += 1
+            was_trial = self.trial_running
+            self.trial_running = False
+            if was_trial or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+def retry_after_seconds(response):
+    r"""
+    Seconds the server asked us to wait, from a Retry-After header in either delay or HTTP-date form.
+    """
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpTransport:
+    r"""
+    Thread-safe GET client shared by every worker thread.
+    `rate_limits` maps provider names to requests per second; providers without one are not paced.
+    """
+    def __init__(self, rate_limits=None, pool_size=16, timeout=(10, 60), max_retries=5, backoff_base=1.0,
+                 backoff_cap=120.0, breaker_threshold=5, breaker_cooldown=300, redirect=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.limiters = {provider: RateLimiter(rate) for provider, rate in (rate_limits or {}).items()}
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.breakers = {}
+        self.retries = {}           # provider -> retries made, for the run metrics
+        # Called as timing_hook(provider, wait_seconds, exchange_seconds) after every attempt: the time spent
+        # waiting for the rate limiter, and the HTTP exchange itself
+        self.timing_hook = None
+        self.redirect = redirect.rstrip("/") if redirect else None
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def session_for(self, url):
+        host = urlparse(url).netloc.lower()
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                # Enough pooled connections for every worker thread to keep one alive to this host
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self.sessions[host] = session
+            return session
+
+    def breaker_for(self, provider):
+        with self.lock:
+            breaker = self.breakers.get(provider)
+            if breaker is None:
+                breaker = self.breakers[provider] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            return breaker
+
+    def backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            # Never come back sooner than the server asked, but do not let one header stall a worker for hours
+            delay = max(delay, min(retry_after, self.backoff_cap * 5))
+        return delay
+
+    def get(self, url, provider=None, **kwargs):
+        r"""
+        GET with up to `max_retries` retries on connection errors and retryable statuses.
+        Returns the response (which may still carry a retryable status once retries run out);
+        raises ProviderUnavailable when the provider's circuit is open or no response was ever received.
+        """
+        breaker = self.breaker_for(provider)
+        if not breaker.allow():
+            raise ProviderUnavailable(f"{provider or url} circuit is open; skipping {url}")
+        limiter = self.limiters.get(provider)
+        kwargs.setdefault("timeout", self.timeout)
+        if self.redirect:
+            base, parts = urlsplit(self.redirect), urlsplit(url)
+            url = urlunsplit((base.scheme, base.netloc, f"{base.path}/{parts.netloc}{parts.path}", parts.query, ""))
+        session = self.session_for(url)
+        response = None
+        error = None
+        for attempt in range(self.max_retries + 1):
+            wait = limiter.acquire() if limiter else 0.0
+            start = time.perf_counter()
+            try:
+                response = session.get(url, **kwargs)
+                error = None
+            except requests.exceptions.RequestException as e:
+                response = None
+                error = e
+            if self.timing_hook is not None:
+                self.timing_hook(provider, wait, time.perf_counter() - start)
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                return response
+            if attempt == self.max_retries:
+                break
+            delay = self.backoff(attempt, response)
+            with self.lock:
+                self.retries[provider] = self.retries.get(provider, 0) + 1
+            reason = error if response is None else f"HTTP {response.status_code}"
+            print(f"Error accessing {url}: {reason}. Retry {attempt + 1}/{self.max_retries} in {delay:.1f} seconds...")
+            time.sleep(delay)
+        if breaker.record_failure():
+            print(f"{provider or url}: too many failures, pausing requests for {self.breaker_cooldown} seconds.")
+        if response is None:
+            raise ProviderUnavailable(f"Giving up on {url}: {error}")
+        return response
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
@@ -1,23 +1,51 @@
 r"""
-Enrich exported bibliometric records by sequentially querying multiple APIs for metadata.
-For each record (row) in the input Excel file, the script queries the APIs with priority order:
+Enrich exported bibliometric records with metadata from multiple APIs, many records at a time.
+The dataset is streamed in chunks and its records are enriched concurrently by an asyncio engine. Each record
+queries the providers one after another, in priority order:
     1. NIH Open Citation Collection (NIH-OCC)
     2. PubMed
     3. PubMed Central (PMC)
     4. OpenAlex
     5. Crossref
     6. Semantic Scholar
+Only providers that can still fill one of the record's empty fields are asked. DOIs are normalized, records of
+a chunk with the same DOI share each provider's answer, and OpenAlex, PMC and PubMed are queried in batches.
 For each record, any cell that is empty or contains "none" (case insensitive) is updated with data
 returned by the API. A changelog is produced detailing every cell update, along with a summary.
 API responses are mapped to Bibliometrix field tags.
+Supporting modules:
+    httpTransport.py        pooled connections, per-provider rate limits, retries
+    responseCache.py        persistent response cache (--offline serves from it alone)
+    datasetIO.py            chunked XLSX, CSV, Parquet and Arrow input and output
+    enrichmentCheckpoint.py checkpoints for --resume
+    changelogSink.py        structured changelog
+    snapshotBackend.py      local OpenAlex and Crossref dumps (--openalex-snapshot, --crossref-snapshot)
+    enrichmentMetrics.py    per-provider metrics report (--metrics-port serves them live)
+    citationGraph.py        citation graph from the enriched CR field (--citation-graph)
+    enrichmentShards.py     --shard K/N runs and merging their outputs
 """
 
+import io
+import os
 import time
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, unquote
 import pandas as pd
-import requests
 import json
 import xml.etree.ElementTree as ET
 import re
+from httpTransport import HttpTransport, ProviderUnavailable, RateLimiter
+from datasetIO import read_chunks, ChunkWriter, dataset_format
+from changelogSink import ChangelogSink
+from enrichmentCheckpoint import EnrichmentCheckpoint
+from responseCache import ResponseCache, CachedResponse, normalize_url, OFFLINE_MISS_STATUS, DAY
+from snapshotBackend import SnapshotStore
+from enrichmentMetrics import EnrichmentMetrics
+from citationGraph import CitationGraph
+from enrichmentShards import (ROW_COLUMN, SHARD_METHODS, parse_shard, shard_path, manifest_path, shard_for_row,
+                              shard_manifest, write_manifest)
 
 # =====================================================
 # Global Configuration
@@ -26,7 +54,16 @@ EMAIL = "your_email_here@example.com"  # Replace with your actual email address
 INPUT_FILE = "./records/mergedDataset.xlsx"
 OUTPUT_FILE = "./records/mergedDatasetEnhanced.xlsx"
 CHANGELOG_FILE = "changelog.txt"
+CHANGELOG_SINK = "changelog.jsonl"     # Structured changelog (.jsonl, or .sqlite for a database)
+DATASET_CHUNK_ROWS = 5000       # Records read, enriched and written at a time
+CHECKPOINT_FILE = "./records/enrichmentCheckpoint.sqlite"
+CHECKPOINT_INTERVAL = 100       # Finished records between checkpoint writes
+METRICS_REPORT = "./records/enrichmentMetrics.json"
+CITATION_GRAPH = ""             # Directory for the citation graph built from CR ("" for none)
+SHARD_BY = "hash"               # How --shard splits the records: "hash" of the DOI or "range" of rows
 SEMANTIC_SCHOLAR_API_KEY = ""  # Supply your Semantic Scholar API key if available
+# Send every request to a local mock provider server instead (see mockProviders.py), e.g. "http://127.0.0.1:8765"
+MOCK_PROVIDERS_URL = os.environ.get("MDMT_MOCK_PROVIDERS", "")
 
 HEADERS = {
     "User-Agent": f"BibliometrixMetadataEnhancer/1.0 (mailto:{EMAIL})",
@@ -36,50 +73,150 @@ HEADERS = {
 if SEMANTIC_SCHOLAR_API_KEY:
     HEADERS["x-api-key"] = SEMANTIC_SCHOLAR_API_KEY
 
-# Global cache for OpenAlex citation lookups
+# Number of records enriched at the same time
+CONCURRENCY = 16
+
+# Maximum requests per second for each provider (shared by every record in flight)
+PROVIDER_RATE_LIMITS = {
+    "NCBI": 3,              # NIH-OCC, PubMed and PMC: 3/s without an NCBI API key
+    "OpenAlex": 10,
+    "Crossref": 50,         # Polite pool (mailto in User-Agent)
+    "Semantic Scholar": 1 if SEMANTIC_SCHOLAR_API_KEY else 0.3
+}
+
+# Retries per request before giving up on it, and consecutive failed requests before a provider is paused
+MAX_RETRIES = 5
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 300          # Seconds a paused provider is left alone before it is tried again
+
+# Provider that serves each API host
+PROVIDER_HOSTS = {
+    "api.ncbi.nlm.nih.gov": "NCBI",
+    "eutils.ncbi.nlm.nih.gov": "NCBI",
+    "www.ncbi.nlm.nih.gov": "NCBI",
+    "api.openalex.org": "OpenAlex",
+    "api.crossref.org": "Crossref",
+    "api.semanticscholar.org": "Semantic Scholar"
+}
+
+# Batched lookups: rows prefetched together, and identifiers per request for each provider
+BATCH_WINDOW = 200
+OPENALEX_BATCH_SIZE = 50        # OpenAlex allows up to 100 values in one OR filter; 50 keeps URLs short
+PMC_IDCONV_BATCH_SIZE = 200     # idconv maximum
+PUBMED_CSL_BATCH_SIZE = 100
+OPENALEX_CITATION_BATCH_SIZE = 100      # Cited works resolved per OpenAlex request
+# Only the fields format_openalex_citation() reads
+OPENALEX_CITATION_FIELDS = "id,title,authorships,primary_location,biblio,publication_year"
+
+# Persistent response cache
+CACHE_FILE = "./records/responseCache.sqlite"
+CACHE_MAX_BYTES = 2 * 1024 ** 3     # Least recently used responses are evicted beyond this
+# Days before a cached response is fetched again
+CACHE_TTL_DAYS = {
+    "NCBI": 30,
+    "OpenAlex": 30,
+    "Crossref": 90,             # Crossref records rarely change once deposited
+    "Semantic Scholar": 30
+}
+# Snapshot stores built by snapshotBackend.py from OpenAlex / Crossref dumps ("" for none)
+OPENALEX_SNAPSHOT = ""
+CROSSREF_SNAPSHOT = ""
+openalex_snapshot = None        # SnapshotStore, opened in main()
+crossref_snapshot = None        # SnapshotStore, opened in main()
+network_enabled = True          # False when only snapshot providers are selected
+
+response_cache = None           # ResponseCache, opened in main()
+checkpoint = None               # EnrichmentCheckpoint, opened in main()
+changelog = None                # ChangelogSink, opened in main()
+metrics = EnrichmentMetrics()
+citation_graph = None           # CitationGraph, opened in main()
+shard = None                    # With --shard: index, count, method, and the input's rows and columns
+
+# Formatted OpenAlex citations for the current window; the persistent copy is in the response cache
 openalex_cache = {}
 
-# Global changelog structures
-changelog_entries = []       # List of change log entries
-column_edit_counts = {}      # Dictionary: column -> count of edits
-rows_changed = set()         # Set of row indices that were changed
+# Batch results for the current window. A key that is present but None means the batch found nothing;
+# a key that is absent was not batched and is looked up on its own.
+openalex_batch = {}         # DOI key -> parsed OpenAlex metadata
+pmc_idconv_batch = {}       # DOI key -> idconv record
+pubmed_csl_batch = {}       # PMID -> CSL record
+
+# Query planner statistics
+provider_calls = {}          # Dictionary: provider -> records queried
+provider_calls_avoided = {}  # Dictionary: provider -> records not queried because it could not fill anything
+provider_calls_shared = {}   # Dictionary: provider -> records answered from another record's lookup of the same DOI
+# The same statistics for finished records only, which is what the checkpoint stores: a record still in flight
+# at an interruption is enriched, and its providers queried, again on resume
+finished_counters = {"calls": {}, "avoided": {}, "shared": {}}
+
+# DOI deduplication: lookups already made in the current chunk, and DOIs seen over the whole run
+provider_lookups = {}        # (provider, normalized DOI) -> task resolving to the provider's metadata or None
+doi_rows = 0                 # Records with a DOI
+unique_dois = set()          # Normalized DOIs
 
 # =====================================================
 # Robust Network Functions
 # =====================================================
+transport = HttpTransport(rate_limits=PROVIDER_RATE_LIMITS, pool_size=CONCURRENCY, max_retries=MAX_RETRIES,
+                          breaker_threshold=BREAKER_THRESHOLD, breaker_cooldown=BREAKER_COOLDOWN,
+                          redirect=MOCK_PROVIDERS_URL or None)
+
+def provider_for_url(url):
+    return PROVIDER_HOSTS.get(urlparse(url).hostname)
+
 def robust_get(url, **kwargs):
     """
-    A robust wrapper around requests.get that catches various transient errors
-    and retries indefinitely until a valid response is received.
-    It handles:
-      - ConnectionError
-      - Timeout (including ConnectTimeout and ReadTimeout)
-      - ChunkedEncodingError
-      - RequestException (covers any other requests-related errors)
+    GET through the shared transport (see httpTransport.py): pooled keep-alive connections per host, the
+    provider's rate limiter, and bounded retries with jittered exponential backoff that honour Retry-After.
+    Raises ProviderUnavailable when the provider's circuit breaker is open or every retry failed to connect.
+    Responses are served from and stored in the response cache when one is open. In offline mode, or when
+    only snapshot providers run, a cache miss returns an empty 504 response instead of going to the network.
     """
-    while True:
-        try:
-            response = requests.get(url, **kwargs)
-            return response
-        except (requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout,
-                requests.exceptions.ChunkedEncodingError,
-                requests.exceptions.RequestException) as e:
-            print(f"Error accessing {url}: {e}. Retrying in 30 seconds...")
-            time.sleep(30)
+    provider = provider_for_url(url)
+    key = None
+    if response_cache is not None:
+        key = normalize_url(url, kwargs.get("params"))
+        cached = response_cache.get(key)
+        if cached is not None:
+            metrics.observe_cache_hit(provider)
+            return cached
+        if response_cache.offline:
+            return CachedResponse(OFFLINE_MISS_STATUS, b"{}", from_cache=False)
+    if not network_enabled:
+        return CachedResponse(OFFLINE_MISS_STATUS, b"{}", from_cache=False)
+    start = time.perf_counter()
+    try:
+        response = transport.get(url, provider, **kwargs)
+    except ProviderUnavailable:
+        metrics.observe_request(provider, time.perf_counter() - start)
+        raise
+    metrics.observe_request(provider, time.perf_counter() - start, response.status_code)
+    if key is not None:
+        response_cache.put(key, provider, response.status_code, response.content)
+    return response
+
+def discard_cached(url, **kwargs):
+    # Drop a cached body that turned out to be unusable, so the next attempt goes to the network
+    if response_cache is not None:
+        response_cache.discard(normalize_url(url, kwargs.get("params")))
 
 def robust_json(url, **kwargs):
     """
     A helper that retrieves a URL using robust_get() and attempts to decode its JSON.
-    If a JSONDecodeError occurs, it waits 30 seconds and retries.
+    A 200 response that is not valid JSON (usually truncated) is fetched again up to MAX_RETRIES times;
+    anything else that is not JSON, such as an HTML error page, yields an empty dict.
     """
-    while True:
+    for attempt in range(MAX_RETRIES + 1):
         response = robust_get(url, **kwargs)
         try:
             return response.json()
         except json.decoder.JSONDecodeError as e:
-            print(f"JSON decode error for {url}: {e}. Retrying in 30 seconds...")
-            time.sleep(30)
+            discard_cached(url, **kwargs)
+            if response.status_code != 200 or attempt == MAX_RETRIES:
+                return {}
+            delay = transport.backoff(attempt)
+            print(f"JSON decode error for {url}: {e}. Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
 
 # =====================================================
 # Helper Functions to Process Metadata Fields
@@ -140,45 +277,67 @@ def process_ISSN(value):
         return ", ".join(value)
     return value
 
+def format_openalex_citation(data):
+    r"""
+    Format an OpenAlex work as: AUTHORS, TITLE, JOURNAL, VOLUME, (YEAR)
+    The journal and volume are read from host_venue/volume where present, otherwise from their current
+    locations, primary_location.source and biblio.
+    """
+    authors = []
+    if "authorships" in data:
+        for auth in data["authorships"]:
+            if "author" in auth and "display_name" in auth["author"]:
+                authors.append(auth["author"]["display_name"].upper())
+    authors_str = ", ".join(authors)
+    title = (data.get("title") or "").strip()
+    journal = ""
+    if "host_venue" in data and data["host_venue"]:
+        journal = (data["host_venue"].get("display_name") or "").strip().upper()
+    elif (data.get("primary_location") or {}).get("source"):
+        journal = (data["primary_location"]["source"].get("display_name") or "").strip().upper()
+    volume = data.get("volume") or (data.get("biblio") or {}).get("volume") or ""
+    year = data.get("publication_year", "")
+    parts = []
+    if authors_str:
+        parts.append(authors_str)
+    if title:
+        parts.append(title)
+    if journal:
+        parts.append(journal)
+    if volume:
+        parts.append(volume)
+    if year:
+        parts.append(f"({year})")
+    citation = ", ".join(parts)
+    return clean_citation(citation)
+
 def get_openalex_citation(openalex_id):
     r"""
-    Given an OpenAlex work ID (e.g., "W136575539"), query OpenAlex for its metadata
-    and format a citation as: AUTHORS, TITLE, JOURNAL, VOLUME, (YEAR)
-    Uses caching to avoid redundant API calls
+    Given an OpenAlex work ID (e.g., "W136575539"), return its formatted citation.
+    Looks in this run's citations, then the persistent citation cache and the OpenAlex snapshot, and only then
+    queries OpenAlex.
+    Batched records normally find their citations already resolved by resolve_openalex_citations().
     """
     if openalex_id in openalex_cache:
         return openalex_cache[openalex_id]
+    if response_cache is not None:
+        cached = response_cache.get_citations([openalex_id])
+        if openalex_id in cached:
+            openalex_cache[openalex_id] = cached[openalex_id]
+            return cached[openalex_id]
+    if openalex_snapshot is not None:
+        work = openalex_snapshot.get(openalex_id)
+        if work is not None:
+            citation = openalex_cache[openalex_id] = format_openalex_citation(work)
+            return citation
     url = f"https://api.openalex.org/works/{openalex_id}"
     try:
         resp = robust_get(url, headers=HEADERS)
         if resp.status_code == 200:
-            data = resp.json()
-            authors = []
-            if "authorships" in data:
-                for auth in data["authorships"]:
-                    if "author" in auth and "display_name" in auth["author"]:
-                        authors.append(auth["author"]["display_name"].upper())
-            authors_str = ", ".join(authors)
-            title = data.get("title", "").strip()
-            journal = ""
-            if "host_venue" in data and data["host_venue"]:
-                journal = data["host_venue"].get("display_name", "").strip().upper()
-            volume = data.get("volume", "")
-            year = data.get("publication_year", "")
-            parts = []
-            if authors_str:
-                parts.append(authors_str)
-            if title:
-                parts.append(title)
-            if journal:
-                parts.append(journal)
-            if volume:
-                parts.append(volume)
-            if year:
-                parts.append(f"({year})")
-            citation = ", ".join(parts)
-            citation = clean_citation(citation)
+            citation = format_openalex_citation(resp.json())
             openalex_cache[openalex_id] = citation
+            if response_cache is not None:
+                response_cache.put_citations({openalex_id: citation})
             return citation
         else:
             return None
@@ -186,6 +345,15 @@ def get_openalex_citation(openalex_id):
         print(f"[OpenAlex Lookup] Error: {e}")
         return None
 
+def openalex_work_id(reference):
+    r"""
+    The bare work ID ("W123") of an OpenAlex reference given as an ID or an https://openalex.org/ URL, else None.
+    """
+    reference = str(reference).strip()
+    if reference.startswith("https://openalex.org/"):
+        reference = reference.replace("https://openalex.org/", "").strip()
+    return reference if re.match(r'^W\d+$', reference) else None
+
 def process_reference(value):
     r"""
     Process the reference field into a formatted string.
@@ -271,8 +439,12 @@ def query_nih_occ_metadata(doi):
 def query_pubmed_metadata(query):
     pmid = None
     query_str = str(query).strip()
+    record = pmc_idconv_batch.get(normalize_doi(query_str))
     if query_str.isdigit():
         pmid = query_str
+    elif record and record.get("pmid"):
+        # idconv already mapped this DOI to a PMID
+        pmid = record["pmid"]
     else:
         esearch_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
         params = {"db": "pubmed", "term": query_str, "retmode": "json", "retmax": 1}
@@ -280,6 +452,9 @@ def query_pubmed_metadata(query):
         idlist = data.get("esearchresult", {}).get("idlist", [])
         if idlist:
             pmid = idlist[0]
+    if pmid and pmid in pubmed_csl_batch:
+        result = pubmed_csl_batch[pmid]
+        return (True, result) if result is not None else (False, None)
     if pmid:
         ctxp_url = f"https://api.ncbi.nlm.nih.gov/lit/ctxp/v1/pubmed/?format=csl&id={pmid}"
         try:
@@ -293,51 +468,86 @@ def query_pubmed_metadata(query):
     return False, None
 
 def query_pmc_metadata(doi):
-    conv_url = f"https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/?tool=BibliometrixMetadataEnhancer&email={EMAIL}&ids={doi}&format=json"
-    try:
-        conv_data = robust_json(conv_url, headers=HEADERS)
-        records = conv_data.get("records", [])
-        if records and records[0].get("pmcid"):
-            pmcid = records[0]["pmcid"]
+    key = normalize_doi(doi)
+    if key in pmc_idconv_batch:
+        record = pmc_idconv_batch[key]
+        if record and record.get("pmcid"):
+            pmcid = record["pmcid"]
         else:
             return False, None
-    except Exception as e:
-        print(f"[PMC IDConv] Error: {e}")
-        return False, None
+    else:
+        conv_url = f"https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/?tool=BibliometrixMetadataEnhancer&email={EMAIL}&ids={doi}&format=json"
+        try:
+            conv_data = robust_json(conv_url, headers=HEADERS)
+            records = conv_data.get("records", [])
+            if records and records[0].get("pmcid"):
+                pmcid = records[0]["pmcid"]
+            else:
+                return False, None
+        except Exception as e:
+            print(f"[PMC IDConv] Error: {e}")
+            return False, None
 
-    efetch_url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pmc&id={pmcid}&retmode=xml"
-    try:
-        efetch_response = robust_get(efetch_url, headers=HEADERS)
-        if efetch_response.status_code == 200:
-            xml_data = efetch_response.text
-            try:
-                root = ET.fromstring(xml_data)
-            except ET.ParseError as e:
-                print(f"[PMC EFetch] XML parse error: {e}. Retrying in 30 seconds...")
-                time.sleep(30)
-                return query_pmc_metadata(doi)
-            meta = {}
-            title_elem = root.find(".//article-title")
-            if title_elem is not None:
-                meta["title"] = "".join(title_elem.itertext()).strip()
-            journal_elem = root.find(".//journal-title")
-            if journal_elem is not None:
-                meta["container-title"] = "".join(journal_elem.itertext()).strip()
-            lang = root.attrib.get("{http://www.w3.org/XML/1998/namespace}lang")
-            if lang:
-                meta["language"] = lang
-            pub_date = root.find(".//pub-date")
-            if pub_date is not None:
-                year_elem = pub_date.find("year")
-                if year_elem is not None:
+    return fetch_pmc_article(doi, pmcid)
+
+# Elements whose text parse_pmc_article() reads; everything outside them is discarded as soon as it is parsed
+PMC_CAPTURED_TAGS = {"article-title", "journal-title", "pub-date", "abstract", "contrib", "aff", "kwd", "corresp",
+                     "ref"}
+PMC_FIRST_ONLY = {"article-title": "title", "journal-title": "container-title", "abstract": "abstract",
+                  "corresp": "corresponding-author"}
+PMC_BODY_START_RE = re.compile(rb"<body[\s>]")
+
+def parse_pmc_article(content):
+    r"""
+    Extract the metadata fields from PMC EFetch XML in a single incremental pass. Only the elements holding
+    a field are kept until their end tag; every other element (the full text bodies above all) is dropped as
+    soon as it is parsed, and parsing stops at the end of the top-level article, so the contributors,
+    affiliations, keywords and references of its sub-articles are read too. The full text bodies hold none of
+    the fields, so they are cut out before parsing instead of being tokenized.
+    Raises ET.ParseError for malformed (usually truncated) XML.
+    """
+    parts = []
+    position = 0
+    for body in PMC_BODY_START_RE.finditer(content):
+        if body.start() < position:
+            continue
+        body_end = content.find(b"</body>", body.start())
+        if body_end < 0:
+            break
+        parts.append(content[position:body.start()])
+        position = body_end + len(b"</body>")
+    if parts:
+        content = b"".join(parts) + content[position:]
+    meta = {}
+    authors, affiliations, keywords, refs = [], [], [], []
+    stack = []
+    captured = 0
+    for event, elem in ET.iterparse(io.BytesIO(content), events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            stack.append(elem)
+            if tag in PMC_CAPTURED_TAGS:
+                captured += 1
+            elif tag == "article" and "document-type" not in meta:
+                lang = elem.attrib.get("{http://www.w3.org/XML/1998/namespace}lang")
+                if lang:
+                    meta["language"] = lang
+                if elem.attrib.get("article-type"):
+                    meta["document-type"] = elem.attrib["article-type"]
+            continue
+        stack.pop()
+        if tag in PMC_CAPTURED_TAGS:
+            captured -= 1
+            if tag in PMC_FIRST_ONLY:
+                if PMC_FIRST_ONLY[tag] not in meta:
+                    meta[PMC_FIRST_ONLY[tag]] = "".join(elem.itertext()).strip()
+            elif tag == "pub-date":
+                year_elem = elem.find("year")
+                if "issued" not in meta and year_elem is not None:
                     meta["issued"] = year_elem.text
-            abstract_elem = root.find(".//abstract")
-            if abstract_elem is not None:
-                meta["abstract"] = "".join(abstract_elem.itertext()).strip()
-            authors = []
-            for contrib in root.findall(".//contrib[@contrib-type='author']"):
-                name_elem = contrib.find("name")
-                if name_elem is not None:
+            elif tag == "contrib":
+                name_elem = elem.find("name")
+                if elem.attrib.get("contrib-type") == "author" and name_elem is not None:
                     surname = name_elem.find("surname")
                     given = name_elem.find("given-names")
                     name_str = ""
@@ -347,35 +557,51 @@ def query_pmc_metadata(doi):
                         name_str += ", " + given.text
                     if name_str:
                         authors.append(name_str)
-            if authors:
-                meta["author"] = "; ".join(authors)
-            affiliations = []
-            for aff in root.findall(".//aff"):
-                aff_text = "".join(aff.itertext()).strip()
-                if aff_text:
-                    affiliations.append(aff_text)
-            if affiliations:
-                meta["affiliation"] = "; ".join(affiliations)
-            keywords = []
-            for kwd in root.findall(".//kwd"):
-                kwd_text = "".join(kwd.itertext()).strip()
-                if kwd_text:
-                    keywords.append(kwd_text)
-            if keywords:
-                meta["keywords"] = "; ".join(keywords)
-            corresp_elem = root.find(".//corresp")
-            if corresp_elem is not None:
-                meta["corresponding-author"] = "".join(corresp_elem.itertext()).strip()
-            art_type = root.attrib.get("article-type")
-            if art_type:
-                meta["document-type"] = art_type
-            refs = []
-            for ref in root.findall(".//ref"):
-                doi_elem = ref.find(".//pub-id[@pub-id-type='doi']")
+            elif tag == "ref":
+                doi_elem = elem.find(".//pub-id[@pub-id-type='doi']")
                 if doi_elem is not None and doi_elem.text:
                     refs.append(doi_elem.text.strip())
-            if refs:
-                meta["reference"] = "; ".join(refs)
+            else:
+                text = "".join(elem.itertext()).strip()
+                if text:
+                    (affiliations if tag == "aff" else keywords).append(text)
+        if captured == 0 and stack:
+            # Nothing left to read from this element: free it and its subtree
+            stack[-1].remove(elem)
+        if tag == "article":
+            # Sub-articles (peer reviews, author replies, translations) are <sub-article>, nested inside
+            break
+    if authors:
+        meta["author"] = "; ".join(authors)
+    if affiliations:
+        meta["affiliation"] = "; ".join(affiliations)
+    if keywords:
+        meta["keywords"] = "; ".join(keywords)
+    if refs:
+        meta["reference"] = "; ".join(refs)
+    return meta
+
+def fetch_pmc_article(doi, pmcid):
+    efetch_url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pmc&id={pmcid}&retmode=xml"
+    try:
+        meta = None
+        for attempt in range(MAX_RETRIES + 1):
+            efetch_response = robust_get(efetch_url, headers=HEADERS)
+            if efetch_response.status_code != 200:
+                break
+            try:
+                meta = parse_pmc_article(efetch_response.content)
+                break
+            except ET.ParseError as e:
+                # Usually a truncated download: fetch it again rather than trusting the cached copy
+                discard_cached(efetch_url)
+                if attempt == MAX_RETRIES:
+                    print(f"[PMC EFetch] XML parse error: {e}. Giving up on {pmcid}.")
+                    break
+                delay = transport.backoff(attempt)
+                print(f"[PMC EFetch] XML parse error: {e}. Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+        if meta is not None:
             return True, meta
         else:
             return False, None
@@ -383,31 +609,37 @@ def query_pmc_metadata(doi):
         print(f"[PMC EFetch] Error: {e}")
         return False, None
 
+def parse_openalex_work(data):
+    meta = {}
+    if "doi" in data:
+        meta["DOI"] = data["doi"]
+    if "display_name" in data:
+        meta["title"] = data["display_name"]
+    if "host_venue" in data and data["host_venue"]:
+        meta["container-title"] = data["host_venue"].get("display_name", "")
+    if "authorships" in data:
+        authors = []
+        for auth in data["authorships"]:
+            if "author" in auth and "display_name" in auth["author"]:
+                authors.append(auth["author"]["display_name"])
+        if authors:
+            meta["author"] = "; ".join(authors)
+    if "publication_year" in data:
+        meta["issued"] = data["publication_year"]
+    if "referenced_works" in data:
+        meta["reference"] = data["referenced_works"]  # leave as list
+    return meta
+
 def query_openalex_metadata(doi):
+    key = normalize_doi(doi)
+    if key in openalex_batch:
+        meta = openalex_batch[key]
+        return (True, meta) if meta is not None else (False, None)
     url = f"https://api.openalex.org/works/doi:{doi}"
     try:
         response = robust_get(url, headers=HEADERS)
         if response.status_code == 200:
-            data = response.json()
-            meta = {}
-            if "doi" in data:
-                meta["DOI"] = data["doi"]
-            if "display_name" in data:
-                meta["title"] = data["display_name"]
-            if "host_venue" in data and data["host_venue"]:
-                meta["container-title"] = data["host_venue"].get("display_name", "")
-            if "authorships" in data:
-                authors = []
-                for auth in data["authorships"]:
-                    if "author" in auth and "display_name" in auth["author"]:
-                        authors.append(auth["author"]["display_name"])
-                if authors:
-                    meta["author"] = "; ".join(authors)
-            if "publication_year" in data:
-                meta["issued"] = data["publication_year"]
-            if "referenced_works" in data:
-                meta["reference"] = data["referenced_works"]  # leave as list
-            return True, meta
+            return True, parse_openalex_work(response.json())
         return False, None
     except Exception as e:
         print(f"[OpenAlex] Error: {e}")
@@ -420,11 +652,23 @@ def query_crossref_metadata(doi_or_query, use_direct_lookup=True, spreadsheet_ro
         response = robust_get(url, headers=HEADERS)
         if response.status_code == 200:
             return True, response.json().get("message", {})
+        elif isinstance(response, CachedResponse) and response.status_code == OFFLINE_MISS_STATUS:
+            # Not in the cache, and the network is off: no data, not an error
+            return False, None
         else:
             print(f"[Crossref] Direct lookup for {doi_or_query} returned {response.status_code}. Skipping.")
             return False, None
     return False, None
 
+def query_openalex_snapshot_metadata(doi):
+    work = openalex_snapshot.get(normalize_doi(doi))
+    return (True, parse_openalex_work(work)) if work is not None else (False, None)
+
+def query_crossref_snapshot_metadata(doi):
+    # Crossref dump lines are the same records the API returns under "message"
+    record = crossref_snapshot.get(normalize_doi(doi))
+    return (True, record) if record is not None else (False, None)
+
 def query_semantic_scholar_metadata(doi):
     paper_id = f"DOI:{doi}"
     fields = "title,authors,year,venue,abstract,reference"
@@ -483,17 +727,438 @@ mapping = {
     "document-type": ("DT", lambda v: v)
 }
 
+# Providers in strict priority order:
+# 1. NIH-OCC, 2. PubMed, 3. PMC, 4. OpenAlex, 5. Crossref, 6. Semantic Scholar
+api_functions = [
+    ("NIH-OCC", query_nih_occ_metadata),
+    ("PubMed", query_pubmed_metadata),
+    ("PMC", query_pmc_metadata),
+    ("OpenAlex", query_openalex_metadata),
+    ("Crossref", query_crossref_metadata),
+    ("Semantic Scholar", query_semantic_scholar_metadata)
+]
+
+# Snapshot providers and the API each mirrors; main() puts them just ahead of that API when a store is given
+snapshot_functions = [
+    ("OpenAlex snapshot", query_openalex_snapshot_metadata, "OpenAlex"),
+    ("Crossref snapshot", query_crossref_snapshot_metadata, "Crossref")
+]
+
+# Response keys each provider can return, so records only query providers that can fill what they are missing.
+# PubMed (CSL) and Crossref pass their records through as-is, so they list every CSL key the mapping reads.
+PROVIDER_FIELDS = {
+    "NIH-OCC": {"reference"},
+    "PubMed": {"DOI", "title", "container-title", "author", "issued", "volume", "issue", "page", "publisher",
+               "abstract", "language"},
+    "PMC": {"title", "container-title", "language", "issued", "abstract", "author", "affiliation", "keywords",
+            "corresponding-author", "document-type", "reference"},
+    "OpenAlex": {"DOI", "title", "container-title", "author", "issued", "reference"},
+    "Crossref": {"DOI", "title", "container-title", "author", "issued", "volume", "issue", "page", "publisher",
+                 "abstract", "reference", "language"},
+    "Semantic Scholar": {"DOI", "title", "container-title", "author", "issued", "abstract", "reference"}
+}
+PROVIDER_FIELDS["OpenAlex snapshot"] = PROVIDER_FIELDS["OpenAlex"]
+PROVIDER_FIELDS["Crossref snapshot"] = PROVIDER_FIELDS["Crossref"]
+
 # =====================================================
-# Main Processing: Sequential Fallback Approach with Changelog
+# DOI Normalization
 # =====================================================
-def main():
+DOI_PREFIX_RE = re.compile(r"^(?:(?:https?://)?(?:dx\.)?doi\.org/|doi:\s*|doi\s+)", re.IGNORECASE)
+
+def normalize_doi(doi):
+    r"""
+    Canonical form of a DOI, used for every lookup and as the key for batch results and deduplication.
+    DOIs are case-insensitive; exports and providers also write them as doi.org URLs, with a "doi:" label,
+    percent-encoded, or with trailing punctuation. Returns "" for an empty cell.
+    """
+    if is_empty(doi):
+        return ""
+    doi = unquote(str(doi).strip()).lower()
+    doi = DOI_PREFIX_RE.sub("", doi).strip()
+    return doi.rstrip(".,;")
+
+def doi_duplicate_ratio():
+    r"""
+    Share of the records with a DOI whose DOI already appeared on an earlier record.
+    """
+    return 1 - len(unique_dois) / doi_rows if doi_rows else 0.0
+
+# =====================================================
+# Query Planning
+# =====================================================
+def missing_fields(row):
+    r"""
+    Response keys whose target cells are still empty in a record. A page range counts as missing
+    while either BP or EP is empty.
+    """
+    missing = set()
+    for key, (target_field, _) in mapping.items():
+        columns = target_field if isinstance(target_field, tuple) else (target_field,)
+        if any(is_empty(row.get(column)) for column in columns):
+            missing.add(key)
+    return missing
+
+def plan_providers(row):
+    r"""
+    Providers, in priority order, that can fill at least one of the record's empty fields.
+    """
+    missing = missing_fields(row)
+    return [label for label, _ in api_functions if PROVIDER_FIELDS[label] & missing]
+
+# =====================================================
+# Batched Lookups
+# =====================================================
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def batch_openalex(dois):
+    r"""
+    Resolve up to OPENALEX_BATCH_SIZE DOIs with one filter=doi:a|b|... request.
+    DOIs the response does not contain are recorded as not in OpenAlex.
+    """
+    url = "https://api.openalex.org/works"
+    params = {"filter": "doi:" + "|".join(dois), "per-page": len(dois)}
+    try:
+        data = robust_json(url, params=params, headers=HEADERS)
+    except Exception as e:
+        print(f"[OpenAlex batch] Error: {e}")
+        return
+    if "results" not in data:
+        # Failed or offline: leave these DOIs to the per-row lookup
+        return
+    found = {normalize_doi(work["doi"]): parse_openalex_work(work) for work in data["results"] if work.get("doi")}
+    for doi in dois:
+        openalex_batch[doi] = found.get(doi)
+
+def batch_pmc_idconv(dois):
+    r"""
+    Map up to PMC_IDCONV_BATCH_SIZE DOIs to PMC and PubMed IDs with one idconv request.
+    """
+    url = "https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/"
+    params = {"tool": "BibliometrixMetadataEnhancer", "email": EMAIL, "ids": ",".join(dois), "format": "json"}
+    try:
+        data = robust_json(url, params=params, headers=HEADERS)
+    except Exception as e:
+        print(f"[PMC IDConv batch] Error: {e}")
+        return
+    if "records" not in data:
+        return
+    found = {normalize_doi(record.get("requested-id") or record.get("doi", "")): record for record in data["records"]}
+    for doi in dois:
+        pmc_idconv_batch[doi] = found.get(doi)
+
+def batch_pubmed_csl(pmids):
+    r"""
+    Fetch CSL records for up to PUBMED_CSL_BATCH_SIZE PMIDs with one request.
+    """
+    url = "https://api.ncbi.nlm.nih.gov/lit/ctxp/v1/pubmed/"
+    params = {"format": "csl", "id": ",".join(pmids)}
+    try:
+        data = robust_json(url, params=params, headers=HEADERS)
+    except Exception as e:
+        print(f"[PubMed CSL batch] Error: {e}")
+        return
+    if isinstance(data, dict):
+        # A single record comes back as an object, and failures as an object without an id
+        data = [data] if data.get("id") else []
+    if not data:
+        return
+    found = {}
+    for record in data:
+        pmid = str(record.get("PMID") or str(record.get("id", "")).split(":")[-1])
+        if record.get("DOI"):
+            record["DOI"] = record["DOI"].strip()
+        found[pmid] = record
+    for pmid in pmids:
+        pubmed_csl_batch[pmid] = found.get(pmid)
+
+def batch_openalex_citations(work_ids):
+    r"""
+    Format citations for up to OPENALEX_CITATION_BATCH_SIZE cited works with one filter=openalex:W1|W2|...
+    request that selects only the fields the citation needs.
+    """
+    url = "https://api.openalex.org/works"
+    params = {"filter": "openalex:" + "|".join(work_ids), "select": OPENALEX_CITATION_FIELDS,
+              "per-page": len(work_ids)}
     try:
-        df = pd.read_excel(INPUT_FILE)
+        data = robust_json(url, params=params, headers=HEADERS)
     except Exception as e:
-        print(f"Error reading {INPUT_FILE}: {e}")
+        print(f"[OpenAlex citation batch] Error: {e}")
+        return {}
+    citations = {}
+    for work in data.get("results", []):
+        work_id = openalex_work_id(work.get("id", ""))
+        if work_id:
+            citations[work_id] = format_openalex_citation(work)
+    return citations
+
+async def resolve_openalex_citations(work_ids, executor):
+    r"""
+    Resolve cited works for a whole window at once: the persistent citation cache first, then the OpenAlex
+    snapshot, then bulk OpenAlex queries for the rest. Everything resolved is kept in openalex_cache for
+    process_reference(), and what came from the network is saved to the persistent cache.
+    """
+    loop = asyncio.get_running_loop()
+    pending = [work_id for work_id in dict.fromkeys(work_ids) if work_id not in openalex_cache]
+    if response_cache is not None and pending:
+        cached = response_cache.get_citations(pending)
+        openalex_cache.update(cached)
+        pending = [work_id for work_id in pending if work_id not in cached]
+    if openalex_snapshot is not None and pending:
+        works = await loop.run_in_executor(executor, openalex_snapshot.get_many, pending)
+        openalex_cache.update((work_id, format_openalex_citation(work)) for work_id, work in works.items())
+        pending = [work_id for work_id in pending if work_id not in works]
+    if not pending or not network_enabled:
         return
+    results = await asyncio.gather(*(loop.run_in_executor(executor, batch_openalex_citations, chunk)
+                                     for chunk in chunked(pending, OPENALEX_CITATION_BATCH_SIZE)))
+    for citations in results:
+        openalex_cache.update(citations)
+        if response_cache is not None and citations:
+            response_cache.put_citations(citations)
+
+def batchable(doi):
+    # The batch syntaxes separate identifiers with | and , so DOIs containing them are looked up on their own
+    return "|" not in doi and "," not in doi
+
+async def prefetch_batches(planned, executor, need_references=()):
+    r"""
+    Resolve a window's DOIs with batched requests. `planned` maps each DOI to the providers its record plans
+    to query, so DOIs are only batched for providers they need. OpenAlex and idconv batches run concurrently;
+    the PubMed CSL batches wait for idconv, which supplies their PMIDs. Once OpenAlex has answered, the works
+    cited by the DOIs in `need_references` (records with an empty CR) are resolved in bulk.
+    """
+    loop = asyncio.get_running_loop()
+    openalex_batch.clear()
+    pmc_idconv_batch.clear()
+    pubmed_csl_batch.clear()
+    openalex_cache.clear()
+
+    def keys_for(*labels):
+        return list(dict.fromkeys(normalize_doi(doi) for doi, providers in planned.items()
+                                  if batchable(doi) and any(label in providers for label in labels)))
+
+    openalex_jobs = [loop.run_in_executor(executor, batch_openalex, chunk)
+                     for chunk in chunked(keys_for("OpenAlex"), OPENALEX_BATCH_SIZE)]
+    await asyncio.gather(*(loop.run_in_executor(executor, batch_pmc_idconv, chunk)
+                           for chunk in chunked(keys_for("PubMed", "PMC"), PMC_IDCONV_BATCH_SIZE)))
+    pubmed_keys = keys_for("PubMed")
+    pmids = list(dict.fromkeys(pmc_idconv_batch[key]["pmid"] for key in pubmed_keys
+                               if pmc_idconv_batch.get(key) and pmc_idconv_batch[key].get("pmid")))
+    await asyncio.gather(*openalex_jobs,
+                         *(loop.run_in_executor(executor, batch_pubmed_csl, chunk)
+                           for chunk in chunked(pmids, PUBMED_CSL_BATCH_SIZE)))
+    cited = []
+    for doi in need_references:
+        meta = openalex_batch.get(normalize_doi(doi))
+        if meta and isinstance(meta.get("reference"), list):
+            cited.extend(work_id for work_id in map(openalex_work_id, meta["reference"]) if work_id)
+    await resolve_openalex_citations(cited, executor)
+
+# =====================================================
+# Record Enrichment
+# =====================================================
+def is_empty(value):
+    r"""
+    A cell counts as empty if it is missing, NaN (how pandas reads blank Excel cells), blank or "none".
+    """
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return True
+    text = str(value).strip().lower()
+    return text == "" or text == "none" or text == "nan"
+
+def plan_updates(row, metadata):
+    r"""
+    Work out which cells of a record the metadata from one provider fills.
+    Only empty cells are filled. Returns a list of (column, old_value, new_value).
+    The mapping functions may make network calls (e.g. OpenAlex citation lookups), so this runs in a worker thread.
+    """
+    updates = []
+    for key, (target_field, func) in mapping.items():
+        if key not in metadata:
+            continue
+        if isinstance(target_field, tuple):
+            if not is_empty(row.get("BP")) and not is_empty(row.get("EP")):
+                continue
+            new_value = func(metadata[key])
+            for column, part in zip(target_field, new_value):
+                if is_empty(row.get(column)) and not is_empty(part):
+                    updates.append((column, str(row.get(column, "")), part))
+        else:
+            if not is_empty(row.get(target_field)):
+                continue
+            new_value = func(metadata[key])
+            if isinstance(new_value, str) and (new_value.strip().lower() == "none" or new_value.strip() == ""):
+                continue
+            updates.append((target_field, str(row.get(target_field, "")), new_value))
+    return updates
+
+def query_provider(label, api_fn, doi):
+    r"""
+    Query one provider for a DOI. Runs in a worker thread; returns the metadata, or None if the provider
+    has nothing for this DOI or cannot be reached.
+    """
+    start = time.perf_counter()
+    try:
+        success, metadata = api_fn(doi)
+    except ProviderUnavailable as e:
+        print(f"Provider unavailable for {doi}: {e}")
+        success, metadata = False, None
+    found = bool(success and metadata)
+    metrics.observe_lookup(label, time.perf_counter() - start, found)
+    return metadata if found else None
+
+async def lookup_provider(label, api_fn, doi, executor, row_counts):
+    r"""
+    Metadata from one provider for a normalized DOI, looked up at most once per chunk: records with the same DOI
+    await the first record's lookup, even while it is still in flight. The query is also noted in `row_counts`,
+    the calling record's (counter, provider) list.
+    """
+    key = (label, doi)
+    task = provider_lookups.get(key)
+    if task is None:
+        provider_calls[label] = provider_calls.get(label, 0) + 1
+        row_counts.append(("calls", label))
+        loop = asyncio.get_running_loop()
+        task = provider_lookups[key] = asyncio.ensure_future(loop.run_in_executor(executor, query_provider,
+                                                                                  label, api_fn, doi))
+    else:
+        provider_calls_shared[label] = provider_calls_shared.get(label, 0) + 1
+        row_counts.append(("shared", label))
+    return await task
+
+def apply_updates(row, label, updates, row_updates):
+    r"""
+    Record planned updates in the record snapshot. The DataFrame itself is updated column by column
+    once the whole chunk is done (see write_updates), and the changelog once the record is finished.
+    """
+    for column, old_value, new_value in updates:
+        row[column] = new_value
+        row_updates.append((column, old_value, new_value, label))
+
+def write_updates(chunk, updates_by_row):
+    r"""
+    Apply a chunk's updates to its DataFrame with one assignment per column instead of one per cell.
+    """
+    by_column = {}
+    for idx, row_updates in updates_by_row.items():
+        for column, _, new_value, _ in row_updates:
+            by_column.setdefault(column, {})[idx] = new_value
+    for column, values in by_column.items():
+        chunk.loc[list(values), column] = pd.Series(values, dtype=object)
+
+async def enrich_row(idx, row, executor, semaphore, updates_by_row):
+    r"""
+    Enrich one record, given as a dict snapshot. Providers are queried one after another in priority order,
+    so a lower priority provider only ever fills what the higher priority ones left empty. Providers that
+    cannot fill any still-empty field are skipped. Returns False if the record has no DOI.
+    """
+    loop = asyncio.get_running_loop()
+    doi = normalize_doi(row.get("DI"))
+    if not doi:
+        print(f"Row {idx}: Empty DOI in 'DI'. Skipping.")
+        record_finished(idx, False, [])
+        return False
+
+    row_updates = []
+    row_counts = []
+    async with semaphore:
+        for label, api_fn in api_functions:
+            if not PROVIDER_FIELDS[label] & missing_fields(row):
+                provider_calls_avoided[label] = provider_calls_avoided.get(label, 0) + 1
+                row_counts.append(("avoided", label))
+                continue
+            metadata = await lookup_provider(label, api_fn, doi, executor, row_counts)
+            if metadata is None:
+                continue
+            # Mapping the metadata may resolve citations over the network, so it runs in a worker thread too
+            updates = await loop.run_in_executor(executor, plan_updates, dict(row), metadata)
+            if updates:
+                print(f"Row {idx}: Retrieved metadata from {label}.")
+                apply_updates(row, label, updates, row_updates)
+                metrics.observe_fills(label, [column for column, _, _ in updates])
+    updates_by_row[idx] = row_updates
+    record_finished(idx, True, row_updates, row_counts)
+    return True
+
+def record_finished(idx, has_doi, row_updates, row_counts=()):
+    r"""
+    Emit a finished record's updates to the changelog sink, then checkpoint it along with the provider
+    counters of the records finished so far. Runs on the event loop thread only, so the sink and checkpoint
+    are never written concurrently.
+    """
+    metrics.observe_record(has_doi)
+    for counter, label in row_counts:
+        finished_counters[counter][label] = finished_counters[counter].get(label, 0) + 1
+    if changelog is not None:
+        for column, old_value, new_value, label in row_updates:
+            changelog.emit(idx, column, old_value, new_value, label)
+    if checkpoint is not None:
+        checkpoint.record(idx, has_doi, row_updates, finished_counters)
 
-    # Ensure all target columns exist
+def restore_checkpoint(chunk, updates_by_row):
+    r"""
+    Collect the updates of the chunk's records finished by an earlier run, which are already in the changelog.
+    Returns the finished records' has-DOI flags by index.
+    """
+    finished = {}
+    for idx, (has_doi, updates) in checkpoint.completed(chunk.index[0], chunk.index[-1]).items():
+        finished[idx] = has_doi
+        updates_by_row[idx] = updates
+    return finished
+
+async def enrich_chunk(chunk, executor, semaphore, batch=True):
+    r"""
+    Enrich one chunk of records, with at most CONCURRENCY records (and therefore HTTP requests) in flight.
+    With `batch`, each window of BATCH_WINDOW records is prefetched with batched requests first.
+    Returns the number of records skipped for having no DOI.
+    """
+    global doi_rows
+    updates_by_row = {}
+    results = []
+    rows = chunk.to_dict("index")
+    # Lookups are shared within the chunk only, so memory stays bounded; repeats in later chunks hit the cache
+    provider_lookups.clear()
+    for row in rows.values():
+        doi = normalize_doi(row.get("DI"))
+        if doi:
+            doi_rows += 1
+            unique_dois.add(doi)
+    pending = list(chunk.index)
+    if checkpoint is not None:
+        finished = restore_checkpoint(chunk, updates_by_row)
+        if finished:
+            print(f"Resuming: {len(finished)} records restored from {checkpoint.path}.")
+        results = list(finished.values())
+        pending = [idx for idx in pending if idx not in finished]
+    window = BATCH_WINDOW if batch else len(pending) or 1
+    for start in range(0, len(pending), window):
+        indices = pending[start:start + window]
+        if batch:
+            planned = {}
+            need_references = set()
+            for idx in indices:
+                row = rows[idx]
+                doi = normalize_doi(row.get("DI"))
+                if doi:
+                    planned.setdefault(doi, set()).update(plan_providers(row))
+                    if "reference" in missing_fields(row):
+                        need_references.add(doi)
+            await prefetch_batches(planned, executor, need_references)
+        results += await asyncio.gather(*(enrich_row(idx, rows[idx], executor, semaphore, updates_by_row)
+                                          for idx in indices))
+        if checkpoint is not None:
+            # Every window boundary is a natural checkpoint: the batch results are about to be dropped
+            checkpoint.flush()
+    write_updates(chunk, updates_by_row)
+    return results.count(False)
+
+def prepare_chunk(chunk):
+    r"""
+    Add any missing target columns and let every column hold values of any type.
+    """
     target_cols = set()
     for target, _ in mapping.values():
         if isinstance(target, tuple):
@@ -501,107 +1166,341 @@ def main():
         else:
             target_cols.add(target)
     target_cols.add("CR")
-    for col in target_cols:
-        if col not in df.columns:
-            df[col] = ""
+    for col in sorted(target_cols):
+        if col not in chunk.columns:
+            chunk[col] = ""
+    # Filled values are strings or numbers of any kind, so stop pandas from casting them to the column dtype
+    return chunk.astype(object)
+
+def select_shard(chunk):
+    r"""
+    Keep only the chunk's records that belong to this run's shard, tagged with their input row number.
+    """
+    keep = [shard_for_row(idx, normalize_doi(doi), shard["count"], shard["method"], shard["total_rows"])
+            == shard["index"] for idx, doi in zip(chunk.index, chunk["DI"])]
+    chunk = chunk[keep].copy()
+    chunk.insert(0, ROW_COLUMN, chunk.index)
+    return chunk
+
+def add_to_citation_graph(chunk):
+    r"""
+    Add an enriched chunk's records and their CR references to the citation graph.
+    """
+    for idx, doi, cr in zip(chunk.index, chunk["DI"], chunk["CR"]):
+        citation_graph.add_record(int(idx), normalize_doi(doi), cr)
 
+async def enrich_dataset(input_file, output_file, chunk_rows=DATASET_CHUNK_ROWS, batch=True):
+    r"""
+    Stream the dataset from `input_file` to `output_file` one chunk at a time, enriching each chunk on the way.
+    The output is written under a temporary name and only takes its real name once complete.
+    Returns the number of records skipped for having no DOI.
+    """
+    stem, extension = os.path.splitext(output_file)
+    partial_file = f"{stem}.part{extension}"
+    semaphore = asyncio.Semaphore(CONCURRENCY)
     empty_doi_counter = 0
+    writer = None
+    try:
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+            for chunk in read_chunks(input_file, chunk_rows):
+                chunk = prepare_chunk(chunk)
+                if shard is not None:
+                    shard["input_rows"] += len(chunk)
+                    chunk = select_shard(chunk)
+                if writer is None:
+                    writer = ChunkWriter(partial_file, chunk.columns)
+                if chunk.empty:
+                    continue
+                empty_doi_counter += await enrich_chunk(chunk, executor, semaphore, batch=batch)
+                writer.write(chunk)
+                if citation_graph is not None:
+                    add_to_citation_graph(chunk)
+        if writer is None:
+            raise ValueError(f"{input_file} has no records")
+        writer.close()
+        if shard is not None:
+            shard["columns"] = writer.columns
+            shard["rows"] = writer.rows_written
+    except BaseException:
+        # A resumed run rewrites the whole output, so an incomplete one is of no use
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        raise
+    os.replace(partial_file, output_file)
+    return empty_doi_counter
 
-    # Initialize changelog structures
-    global changelog_entries, column_edit_counts, rows_changed
-    changelog_entries = []
-    column_edit_counts = {}
-    rows_changed = set()
-
-    # Define API functions in strict priority order:
-    # 1. NIH-OCC, 2. PubMed, 3. PMC, 4. OpenAlex, 5. Crossref, 6. Semantic Scholar
-    api_functions = [
-        ("NIH-OCC", query_nih_occ_metadata),
-        ("PubMed", query_pubmed_metadata),
-        ("PMC", query_pmc_metadata),
-        ("OpenAlex", query_openalex_metadata),
-        ("Crossref", query_crossref_metadata),
-        ("Semantic Scholar", query_semantic_scholar_metadata)
-    ]
-
-    # Process each record
-    for idx, row in df.iterrows():
-        doi_raw = row.get("DI")
-        if not doi_raw or str(doi_raw).strip() == "":
-            print(f"Row {idx}: Empty DOI in 'DI'. Skipping.")
-            empty_doi_counter += 1
-            continue
+# =====================================================
+# Main Processing: Streamed Chunks, Concurrent Records, Sequential Fallback per Record, with Changelog
+# =====================================================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fill empty Bibliometrix fields from bibliographic APIs.")
+    parser.add_argument("--input", default=INPUT_FILE, help="Dataset to enrich (.xlsx, .csv, .parquet or .arrow).")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="Enriched dataset (.xlsx, .csv, .parquet or .arrow).")
+    parser.add_argument("--chunk-rows", type=int, default=DATASET_CHUNK_ROWS,
+                        help="Records read, enriched and written at a time.")
+    parser.add_argument("--offline", action="store_true",
+                        help="Serve every request from the response cache; never touch the network.")
+    parser.add_argument("--cache-file", default=CACHE_FILE, help="SQLite response cache.")
+    parser.add_argument("--no-cache", action="store_true", help="Neither read nor write the response cache.")
+    parser.add_argument("--no-batch", action="store_true",
+                        help="Look every record up on its own instead of in batched requests.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run from its checkpoint instead of starting over.")
+    parser.add_argument("--checkpoint-file", default=CHECKPOINT_FILE, help="SQLite checkpoint store.")
+    parser.add_argument("--checkpoint-interval", type=int, default=CHECKPOINT_INTERVAL,
+                        help="Finished records between checkpoint writes.")
+    parser.add_argument("--changelog-sink", default=CHANGELOG_SINK,
+                        help="Structured changelog: a .jsonl file, or a .sqlite database.")
+    parser.add_argument("--openalex-snapshot", default=OPENALEX_SNAPSHOT,
+                        help="OpenAlex snapshot store built by snapshotBackend.py, queried ahead of the OpenAlex API.")
+    parser.add_argument("--crossref-snapshot", default=CROSSREF_SNAPSHOT,
+                        help="Crossref snapshot store built by snapshotBackend.py, queried ahead of the Crossref API.")
+    parser.add_argument("--providers",
+                        help="Comma-separated providers to use, e.g. \"OpenAlex snapshot,Crossref snapshot\" "
+                             "for a run without network access. Default: all.")
+    parser.add_argument("--citation-graph", default=CITATION_GRAPH,
+                        help="Build the citation graph from the enriched CR field into this directory.")
+    parser.add_argument("--metrics-report", default=METRICS_REPORT, help="JSON run report with per-provider metrics.")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve live metrics in the Prometheus text format at http://127.0.0.1:PORT/metrics.")
+    parser.add_argument("--mock-providers", default=MOCK_PROVIDERS_URL,
+                        help="Base URL of a mockProviders.py server to send every request to instead.")
+    parser.add_argument("--shard", help="Only enrich shard K of N (e.g. 2/4) into per-shard output, checkpoint and "
+                                        "changelog files; merge the shards with enrichmentShards.py.")
+    parser.add_argument("--shard-by", choices=SHARD_METHODS, default=SHARD_BY,
+                        help="Split records into shards by a hash of their DOI or by row ranges.")
+    parser.add_argument("--rate-share", type=float, default=1.0,
+                        help="Share of the provider rate limits this process may use, e.g. 0.25 for one of four "
+                             "workers on the same host.")
+    return parser.parse_args(argv)
+
+def select_providers(providers=None):
+    r"""
+    Put the opened snapshot providers ahead of the APIs they mirror, then keep only the `providers` named
+    (comma-separated labels), still in priority order. Raises ValueError for a label that is not available.
+    """
+    global api_functions, network_enabled
+    selected = []
+    for label, api_fn in api_functions:
+        for snapshot_label, snapshot_fn, mirrors in snapshot_functions:
+            store = openalex_snapshot if mirrors == "OpenAlex" else crossref_snapshot
+            if mirrors == label and store is not None:
+                selected.append((snapshot_label, snapshot_fn))
+        selected.append((label, api_fn))
+    if providers:
+        wanted = [label.strip() for label in providers.split(",") if label.strip()]
+        available = [label for label, _ in selected]
+        unknown = [label for label in wanted if label not in available]
+        if unknown:
+            raise ValueError(f"Unknown or unavailable providers: {', '.join(unknown)}. "
+                             f"Choose from: {', '.join(available)}")
+        selected = [(label, api_fn) for label, api_fn in selected if label in wanted]
+    api_functions = selected
+    snapshot_labels = {label for label, _, _ in snapshot_functions}
+    network_enabled = any(label not in snapshot_labels for label, _ in selected)
 
-        doi = str(doi_raw).strip()
+def transport_retries():
+    with transport.lock:
+        return {provider or "other": count for provider, count in transport.retries.items()}
 
-        for label, api_fn in api_functions:
-            success, metadata = api_fn(doi)
-            if success and metadata:
-                print(f"Row {idx}: Retrieved metadata from {label}.")
-                for key, (target_field, func) in mapping.items():
-                    # Check if field is already populated (treat "none" as empty)
-                    if isinstance(target_field, tuple):
-                        current_bp = str(row.get("BP", "")).strip().lower()
-                        current_ep = str(row.get("EP", "")).strip().lower()
-                        if current_bp and current_bp != "none" and current_ep and current_ep != "none":
-                            continue
-                    else:
-                        current_val = str(row.get(target_field, "")).strip().lower()
-                        if current_val and current_val != "none":
-                            continue
-
-                    if key in metadata:
-                        new_value = func(metadata[key])
-                        if isinstance(new_value, str) and (new_value.strip().lower() == "none" or new_value.strip() == ""):
-                            continue
-                        # Log the change
-                        if isinstance(target_field, tuple):
-                            old_bp = str(row.get("BP", ""))
-                            old_ep = str(row.get("EP", ""))
-                            bp, ep = new_value
-                            if not old_bp or old_bp.lower() == "none":
-                                df.at[idx, "BP"] = bp
-                                changelog_entries.append(f"Row {idx} - BP updated from '{old_bp}' to '{bp}' via {label}.\n")
-                                changelog_entries.append("----------------------------------")
-                                column_edit_counts["BP"] = column_edit_counts.get("BP", 0) + 1
-                            if not old_ep or old_ep.lower() == "none":
-                                df.at[idx, "EP"] = ep
-                                changelog_entries.append(f"Row {idx} - EP updated from '{old_ep}' to '{ep}' via {label}.\n")
-                                changelog_entries.append("----------------------------------")
-                                column_edit_counts["EP"] = column_edit_counts.get("EP", 0) + 1
-                        else:
-                            old_val = str(row.get(target_field, ""))
-                            df.at[idx, target_field] = new_value
-                            changelog_entries.append(f"Row {idx} - {target_field} updated from '{old_val}' to '{new_value}' via {label}.")
-                            changelog_entries.append("----------------------------------")
-                            column_edit_counts[target_field] = column_edit_counts.get(target_field, 0) + 1
-                        rows_changed.add(idx)
-                row = df.loc[idx]
-        # End processing for this record
-
-    total_changed_records = len(rows_changed)
-    print(f"Total records changed: {total_changed_records}")
-    print(f"Total rows with empty DOI: {empty_doi_counter}")
+def write_metrics_report(path, status, args):
+    r"""
+    Write the run's metrics, with the planner, DOI and cache statistics alongside, as a JSON report.
+    """
+    extra = {
+        "status": status,
+        "input": args.input,
+        "output": args.output,
+        "planner": {label: {"made": provider_calls.get(label, 0), "avoided": provider_calls_avoided.get(label, 0),
+                            "shared": provider_calls_shared.get(label, 0)} for label, _ in api_functions},
+        "dois": {"records_with_doi": doi_rows, "unique": len(unique_dois),
+                 "duplicate_ratio": round(doi_duplicate_ratio(), 4)},
+    }
+    if response_cache is not None:
+        extra["response_cache"] = {"hits": response_cache.hits, "misses": response_cache.misses}
+    for label, store in (("openalex", openalex_snapshot), ("crossref", crossref_snapshot)):
+        if store is not None:
+            extra.setdefault("snapshots", {})[label] = {"found": store.hits, "missing": store.misses}
     try:
-        df.to_excel(OUTPUT_FILE, index=False)
-        print(f"Updated Excel file saved as {OUTPUT_FILE}")
+        metrics.write_report(path, transport_retries(), extra)
+        print(f"Run metrics saved as {path}")
+    except OSError as e:
+        print(f"Error writing run metrics to {path}: {e}")
+
+def setup_shard(args):
+    r"""
+    Parse --shard and point every per-run file at its per-shard name. Raises ValueError.
+    """
+    global shard
+    index, count = parse_shard(args.shard)
+    if args.citation_graph:
+        raise ValueError("--citation-graph cannot be built per shard; build it from the merged dataset with "
+                         "citationGraph.py --from-dataset")
+    total_rows = None
+    if args.shard_by == "range":
+        total_rows = sum(len(chunk) for chunk in read_chunks(args.input, args.chunk_rows))
+    shard = {"index": index, "count": count, "method": args.shard_by, "total_rows": total_rows, "input_rows": 0}
+    for name in ("output", "checkpoint_file", "changelog_sink", "changelog_file", "metrics_report"):
+        setattr(args, name, shard_path(getattr(args, name), index, count))
+    print(f"Enriching shard {index}/{count} (by {args.shard_by}) into {args.output}")
+
+def main():
+    global response_cache, checkpoint, changelog, openalex_snapshot, crossref_snapshot, metrics, citation_graph
+    global shard
+    args = parse_args()
+    if args.offline and args.no_cache:
+        print("--offline needs the response cache; drop --no-cache.")
+        return
+    if not 0 < args.rate_share <= 1:
+        print("--rate-share must be more than 0 and at most 1.")
+        return
+    try:
+        dataset_format(args.input)
+        dataset_format(args.output)
+    except ValueError as e:
+        print(e)
+        return
+    if not os.path.exists(args.input):
+        print(f"Error reading {args.input}: file not found")
+        return
+    args.changelog_file = CHANGELOG_FILE
+    shard = None
+    if args.shard:
+        try:
+            setup_shard(args)
+        except ValueError as e:
+            print(e)
+            return
+    try:
+        if args.openalex_snapshot:
+            openalex_snapshot = SnapshotStore(args.openalex_snapshot)
+        if args.crossref_snapshot:
+            crossref_snapshot = SnapshotStore(args.crossref_snapshot)
+        select_providers(args.providers)
+    except (FileNotFoundError, ValueError) as e:
+        print(e)
+        return
+    if not network_enabled:
+        print("Only snapshot providers selected; no network requests will be made.")
+    if not args.no_cache:
+        response_cache = ResponseCache(args.cache_file,
+                                       ttls={provider: days * DAY for provider, days in CACHE_TTL_DAYS.items()},
+                                       max_bytes=CACHE_MAX_BYTES, offline=args.offline)
+
+    global provider_calls, provider_calls_avoided, provider_calls_shared, finished_counters, doi_rows
+
+    if args.rate_share < 1:
+        transport.limiters = {provider: RateLimiter(rate * args.rate_share)
+                              for provider, rate in PROVIDER_RATE_LIMITS.items()}
+    if args.mock_providers:
+        transport.redirect = args.mock_providers.rstrip("/")
+        print(f"Sending provider requests to the mock server at {transport.redirect}")
+    if args.resume and not os.path.exists(args.checkpoint_file):
+        print(f"No checkpoint at {args.checkpoint_file}; starting from the first record.")
+    changelog = ChangelogSink(args.changelog_sink, resume=args.resume)
+    try:
+        checkpoint = EnrichmentCheckpoint(args.checkpoint_file, args.input, interval=args.checkpoint_interval,
+                                          resume=args.resume, changelog=changelog)
+        if shard is not None:
+            layout = {"shard": shard["index"], "shards": shard["count"], "by": shard["method"]}
+            if checkpoint.get_meta("shard", layout) != layout:
+                checkpoint.close()
+                raise ValueError(f"Checkpoint {args.checkpoint_file} was made for another shard layout; "
+                                 f"run without --resume to start over.")
+            checkpoint.set_meta("shard", layout)
+    except ValueError as e:
+        changelog.close()
+        print(e)
+        return
+    # The checkpoint's counters cover its finished records only; this run's queries are added to them
+    counters = checkpoint.counters
+    finished_counters = {counter: dict(counters.get(counter, {})) for counter in ("calls", "avoided", "shared")}
+    provider_calls = dict(finished_counters["calls"])
+    provider_calls_avoided = dict(finished_counters["avoided"])
+    provider_calls_shared = dict(finished_counters["shared"])
+    # Every chunk, finished or not, is counted again as it streams past
+    doi_rows = 0
+    unique_dois.clear()
+    metrics = EnrichmentMetrics()
+    with transport.lock:
+        transport.retries.clear()
+    if args.citation_graph:
+        # A resumed run streams every record again, so the graph is always rebuilt whole
+        citation_graph = CitationGraph(args.citation_graph)
+    if args.metrics_port:
+        try:
+            metrics.serve(args.metrics_port, transport_retries)
+            print(f"Live metrics at http://127.0.0.1:{args.metrics_port}/metrics")
+        except OSError as e:
+            print(f"Cannot serve metrics on port {args.metrics_port}: {e}")
+
+    # Process every record
+    try:
+        empty_doi_counter = asyncio.run(enrich_dataset(args.input, args.output, chunk_rows=args.chunk_rows,
+                                                       batch=not args.no_batch))
+        print(f"Updated dataset saved as {args.output}")
+        if shard is not None:
+            manifest = manifest_path(args.output)
+            write_manifest(manifest, shard_manifest(shard["index"], shard["count"], shard["method"], args.input,
+                                                    shard["input_rows"], shard["columns"], args.output,
+                                                    args.changelog_sink, args.metrics_report, shard["rows"]))
+            print(f"Shard {shard['index']}/{shard['count']}: {shard['rows']} of {shard['input_rows']} records; "
+                  f"manifest saved as {manifest}")
+        if citation_graph is not None:
+            citation_graph.close()
+            print(f"Citation graph saved in {args.citation_graph}: {citation_graph.records} records, "
+                  f"{len(citation_graph.ids)} works, {citation_graph.edges} citations")
+        # The run is complete, so the next one starts fresh
+        checkpoint.close(remove=True)
+    except KeyboardInterrupt:
+        checkpoint.close()
+        changelog.close()
+        write_metrics_report(args.metrics_report, "interrupted", args)
+        metrics.close()
+        if citation_graph is not None:
+            citation_graph.close()
+        print(f"Interrupted. Finished records are saved in {args.checkpoint_file}; run again with --resume.")
+        return
     except Exception as e:
-        print(f"Error saving {OUTPUT_FILE}: {e}")
+        checkpoint.close()
+        changelog.close()
+        write_metrics_report(args.metrics_report, "failed", args)
+        metrics.close()
+        if citation_graph is not None:
+            citation_graph.close()
+        print(f"Error enriching {args.input} into {args.output}: {e}")
+        print(f"Finished records are kept in {args.checkpoint_file}; fix the problem and run again with --resume.")
+        return
+
+    total_avoided = sum(provider_calls_avoided.values())
+    print(f"Provider queries made: {sum(provider_calls.values())}, avoided by the query planner: {total_avoided}")
+    for label, _ in api_functions:
+        print(f"  {label}: {provider_calls.get(label, 0)} made, {provider_calls_avoided.get(label, 0)} avoided, "
+              f"{provider_calls_shared.get(label, 0)} shared with a duplicate DOI")
+    duplicates_line = (f"Records with a DOI: {doi_rows}, unique DOIs: {len(unique_dois)} "
+                       f"(duplicate ratio {doi_duplicate_ratio():.1%})")
+    print(duplicates_line)
+    write_metrics_report(args.metrics_report, "complete", args)
+    metrics.close()
+    if response_cache is not None:
+        print(f"Response cache: {response_cache.hits} hits, {response_cache.misses} misses")
+        response_cache.close()
+    for label, store in (("OpenAlex", openalex_snapshot), ("Crossref", crossref_snapshot)):
+        if store is not None:
+            print(f"{label} snapshot: {store.hits} found, {store.misses} not in the snapshot")
+            store.close()
+    transport.close()
 
-    # Write changelog to file
+    # Render the changelog report from the sink
     try:
-        with open(CHANGELOG_FILE, "w", encoding="utf-8") as f:
-            f.write("Changelog of Spreadsheet Updates\n")
-            f.write("----------------------------------\n\n")
-            f.write(f"Total records changed: {total_changed_records}\n")
-            for col, count in column_edit_counts.items():
-                f.write(f"Column {col} updated {count} times.\n")
-            f.write("\nDetailed Changes:\n")
-            for entry in changelog_entries:
-                f.write(entry + "\n")
-        print(f"Changelog saved as {CHANGELOG_FILE}")
+        total_changed_records, _ = changelog.render_text(
+            args.changelog_file, [f"Provider queries avoided by the query planner: {total_avoided}", duplicates_line])
+        print(f"Total records changed: {total_changed_records}")
+        print(f"Total rows with empty DOI: {empty_doi_counter}")
+        print(f"Changelog saved as {args.changelog_file} (records in {args.changelog_sink})")
     except Exception as e:
         print(f"Error writing changelog: {e}")
+    changelog.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,319 @@
+r"""
+Local stand-in for every provider endpoint metadataCompleter.py uses, for benchmarks and offline testing.
+Responses are rendered from the recorded fixtures in mockFixtures/: identifiers, titles and reference lists are
+filled in deterministically from the requested DOI, so any synthetic dataset gets consistent answers from every
+provider. Latency, server errors and 429 throttling can be injected.
+
+Requests arrive as http://HOST:PORT/<provider host>/<original path>, which is how metadataCompleter.py sends them
+when MOCK_PROVIDERS_URL (or --mock-providers) points at this server.
+
+Usage:
+    python mockProviders.py [--port 8765] [--latency-ms 50] [--error-rate 0.01] [--throttle-rate 0.02]
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mockFixtures")
+DEFAULT_PORT = 8765
+REFERENCES_PER_WORK = 20
+REFERENCE_MARKER = "__REFERENCES__"
+
+# Share of DOIs each provider does not know, so fallbacks and the query planner are exercised
+DEFAULT_MISS_RATES = {
+    "nih-occ": 0.5,
+    "pubmed": 0.3,
+    "pmc": 0.6,
+    "openalex": 0.05,
+    "crossref": 0.1,
+    "semantic-scholar": 0.2
+}
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as f:
+        return f.read() if name.endswith(".xml") else json.load(f)
+
+
+def stable_number(*parts):
+    return int(hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:12], 16)
+
+
+class SyntheticWork:
+    r"""
+    Deterministic identifiers and references for a DOI.
+    """
+    def __init__(self, doi):
+        self.doi = doi.lower()
+        n = stable_number(self.doi)
+        self.pmid = str(10000000 + n % 30000000)
+        self.pmcid = f"PMC{1000000 + n % 9000000}"
+        self.work_id = f"W{1000000000 + n % 3000000000}"
+        self.title = f"Synthetic record {n % 100000} on open bibliographic metadata"
+
+    def reference_ids(self):
+        return [f"W{1000000000 + stable_number(self.doi, 'ref', str(i)) % 3000000000}"
+                for i in range(REFERENCES_PER_WORK)]
+
+    def reference_dois(self):
+        return [f"10.5555/ref.{stable_number(self.doi, 'ref', str(i)) % 10000000}" for i in range(REFERENCES_PER_WORK)]
+
+    def tokens(self):
+        return {"__DOI__": self.doi, "__PMID__": self.pmid, "__PMCID__": self.pmcid, "__WID__": self.work_id,
+                "__TITLE__": self.title}
+
+
+def render(template, tokens, references):
+    if isinstance(template, dict):
+        return {key: render(value, tokens, references) for key, value in template.items()}
+    if isinstance(template, list):
+        if template == [REFERENCE_MARKER]:
+            return copy.deepcopy(references)
+        return [render(value, tokens, references) for value in template]
+    if isinstance(template, str):
+        for token, value in tokens.items():
+            template = template.replace(token, value)
+    return template
+
+
+class MockProviderState:
+    r"""
+    Fixtures, fault injection settings and request counters shared by the handler threads.
+    """
+    def __init__(self, latency_ms=0.0, latency_jitter_ms=0.0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1, miss_rates=None, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.miss_rates = dict(DEFAULT_MISS_RATES, **(miss_rates or {}))
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.fixtures = {name: load_fixture(name) for name in os.listdir(FIXTURE_DIR)}
+        # Identifiers handed out so far, so lookups by PMID or PMCID can find their DOI again
+        self.pmid_dois = {}
+        self.pmcid_dois = {}
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def total_requests(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests = {}
+
+    def chance(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def knows(self, provider, doi):
+        return stable_number(provider, doi.lower()) % 1000 >= self.miss_rates.get(provider, 0) * 1000
+
+    def work(self, doi):
+        work = SyntheticWork(doi)
+        with self.lock:
+            self.pmid_dois[work.pmid] = work.doi
+            self.pmcid_dois[work.pmcid] = work.doi
+        return work
+
+    # ----- Endpoint renderers: each returns (status, body, content type) -----
+
+    def nih_occ(self, doi):
+        if not self.knows("nih-occ", doi):
+            return 404, {"error": "not found"}
+        work = self.work(doi)
+        return 200, render(self.fixtures["nih_occ_citations.json"], work.tokens(),
+                           [f"PMID:{stable_number(work.doi, 'cit', str(i)) % 30000000}" for i in range(10)])
+
+    def esearch(self, term):
+        if not self.knows("pubmed", term):
+            return 200, {"esearchresult": {"count": "0", "retmax": "0", "retstart": "0", "idlist": []}}
+        return 200, render(self.fixtures["pubmed_esearch.json"], self.work(term).tokens(), [])
+
+    def csl(self, pmids):
+        records = []
+        for pmid in pmids:
+            with self.lock:
+                doi = self.pmid_dois.get(pmid)
+            if doi is None:
+                continue
+            work = SyntheticWork(doi)
+            records.append(render(self.fixtures["pubmed_csl.json"], work.tokens(), []))
+        if len(pmids) == 1:
+            return (200, records[0]) if records else (200, {"status": "error", "message": "ID not found"})
+        return 200, records
+
+    def idconv(self, ids):
+        records = []
+        for doi in ids:
+            if self.knows("pmc", doi):
+                records.append(render(self.fixtures["pmc_idconv_record.json"], self.work(doi).tokens(), []))
+            else:
+                records.append({"requested-id": doi, "status": "error", "errmsg": "invalid article id"})
+        return 200, {"status": "ok", "responseDate": "2024-05-02 10:00:00", "request": "format=json",
+                     "records": records}
+
+    def efetch(self, pmcid):
+        with self.lock:
+            doi = self.pmcid_dois.get(pmcid)
+        if doi is None:
+            return 200, "<pmc-articleset><error>UID not found</error></pmc-articleset>", "text/xml"
+        work = SyntheticWork(doi)
+        xml = self.fixtures["pmc_efetch.xml"]
+        for token, value in work.tokens().items():
+            xml = xml.replace(token, value)
+        refs = "".join(f'<ref id="r{i}"><element-citation publication-type="journal">'
+                       f'<pub-id pub-id-type="doi">{ref}</pub-id></element-citation></ref>'
+                       for i, ref in enumerate(work.reference_dois(), start=1))
+        return 200, xml.replace("__REF_LIST__", refs), "text/xml"
+
+    def openalex_work(self, doi):
+        if not self.knows("openalex", doi):
+            return None
+        work = self.work(doi)
+        return render(self.fixtures["openalex_work.json"], work.tokens(),
+                      [f"https://openalex.org/{ref}" for ref in work.reference_ids()])
+
+    def openalex_citation(self, work_id):
+        tokens = {"__WID__": work_id, "__TITLE__": f"Cited work {work_id}"}
+        return render(self.fixtures["openalex_citation.json"], tokens, [])
+
+    def openalex_list(self, results):
+        return 200, {"meta": {"count": len(results), "page": 1, "per_page": max(len(results), 1)},
+                     "results": results}
+
+    def crossref(self, doi):
+        if not self.knows("crossref", doi):
+            return 404, "Resource not found.", "text/plain"
+        work = self.work(doi)
+        references = [{"key": f"ref{i}", "DOI": ref, "unstructured": f"Reference {i} of {work.doi}, {ref}"}
+                      for i, ref in enumerate(work.reference_dois(), start=1)]
+        return 200, render(self.fixtures["crossref_work.json"], work.tokens(), references)
+
+    def semantic_scholar(self, doi):
+        if not self.knows("semantic-scholar", doi):
+            return 404, {"error": "Paper not found"}
+        work = self.work(doi)
+        references = [{"paperId": f"{stable_number(ref):040x}"[-40:], "doi": ref} for ref in work.reference_dois()]
+        return 200, render(self.fixtures["semantic_scholar_paper.json"], work.tokens(), references)
+
+    def route(self, host, path, query):
+        r"""
+        Returns (endpoint name, status, body[, content type]) for a request to the real `host` and `path`.
+        """
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        if host == "api.ncbi.nlm.nih.gov" and path.startswith("/oc/v1/citations/"):
+            return ("nih-occ",) + self.nih_occ(unquote(path[len("/oc/v1/citations/"):]))
+        if host == "api.ncbi.nlm.nih.gov" and path.startswith("/lit/ctxp/v1/pubmed"):
+            return ("pubmed-csl",) + self.csl([pmid for pmid in params.get("id", "").split(",") if pmid])
+        if host == "eutils.ncbi.nlm.nih.gov" and path.endswith("/esearch.fcgi"):
+            return ("pubmed-esearch",) + self.esearch(params.get("term", ""))
+        if host == "eutils.ncbi.nlm.nih.gov" and path.endswith("/efetch.fcgi"):
+            return ("pmc-efetch",) + self.efetch(params.get("id", ""))
+        if host == "www.ncbi.nlm.nih.gov" and path.startswith("/pmc/utils/idconv"):
+            return ("pmc-idconv",) + self.idconv([i for i in params.get("ids", "").split(",") if i])
+        if host == "api.openalex.org" and path.startswith("/works/doi:"):
+            work = self.openalex_work(unquote(path[len("/works/doi:"):]))
+            return ("openalex-work",) + ((200, work) if work else (404, {"error": "NotFoundError"}))
+        if host == "api.openalex.org" and re.match(r"^/works/W\d+$", path):
+            return ("openalex-citation", 200, self.openalex_citation(path[len("/works/"):]))
+        if host == "api.openalex.org" and path == "/works":
+            name, _, values = params.get("filter", "").partition(":")
+            values = [value for value in values.split("|") if value]
+            if name == "doi":
+                return ("openalex-batch",) + self.openalex_list([w for w in map(self.openalex_work, values) if w])
+            if name == "openalex":
+                return ("openalex-citation-batch",) + self.openalex_list([self.openalex_citation(v) for v in values])
+        if host == "api.crossref.org" and path.startswith("/works/"):
+            return ("crossref",) + self.crossref(unquote(path[len("/works/"):]))
+        if host == "api.semanticscholar.org" and path.startswith("/graph/v1/paper/DOI:"):
+            return ("semantic-scholar",) + self.semantic_scholar(unquote(path[len("/graph/v1/paper/DOI:"):]))
+        return ("unknown", 404, {"error": f"No mock for {host}{path}"})
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        state = self.server.state
+        parts = urlsplit(self.path)
+        host, _, path = parts.path.lstrip("/").partition("/")
+        if state.latency_ms or state.latency_jitter_ms:
+            with state.lock:
+                delay = max(0.0, state.random.gauss(state.latency_ms, state.latency_jitter_ms))
+            time.sleep(delay / 1000)
+        if state.chance(state.throttle_rate):
+            state.count("throttled")
+            return self.respond(429, {"error": "Too Many Requests"}, headers={"Retry-After": str(state.retry_after)})
+        if state.chance(state.error_rate):
+            state.count("error")
+            return self.respond(503, {"error": "Service Unavailable"})
+        endpoint, status, body, *content_type = state.route(host.lower(), "/" + path, parts.query)
+        state.count(endpoint)
+        self.respond(status, body, content_type[0] if content_type else "application/json")
+
+    def respond(self, status, body, content_type="application/json", headers=None):
+        payload = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, **settings):
+    r"""
+    Start the mock server on a background thread. Returns the server; its base URL is
+    f"http://127.0.0.1:{server.server_address[1]}" and its MockProviderState is server.state.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockProviderHandler)
+    server.daemon_threads = True
+    server.state = MockProviderState(**settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve mock bibliographic API responses from recorded fixtures.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean added latency per request.")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0, help="Standard deviation of the latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s.")
+    parser.add_argument("--seed", type=int, help="Seed for latency and fault injection.")
+    args = parser.parse_args()
+    server = start_server(args.port, latency_ms=args.latency_ms, latency_jitter_ms=args.latency_jitter_ms,
+                          error_rate=args.error_rate, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+                          seed=args.seed)
+    print(f"Mock providers on http://127.0.0.1:{server.server_address[1]} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"Served {server.state.total_requests()} requests: {server.state.requests}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+r"""
+Persistent SQLite cache of API responses for metadataCompleter.py.
+Responses are keyed by their normalized URL (scheme and host lowercased, query parameters merged and sorted),
+expire after a per-provider TTL, and once the stored bodies exceed a size bound the expired entries are dropped,
+then the least recently used ones. Formatted OpenAlex citations are kept in their own table, so a cited work is
+resolved once across every record and every run, however it was fetched; they count against the same bound.
+Several processes (local shards) may share one cache file: a write waits for the others' writes, and an entry
+that still cannot be read or written is a miss or is left uncached rather than an error.
+In offline mode nothing goes to the network: a miss is answered with a 504, the status HTTP caches use for
+"only-if-cached" misses, so callers treat it as a provider without data.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+DAY = 24 * 60 * 60
+
+# Statuses worth remembering: a hit, or a definite "this provider does not have it"
+CACHEABLE_STATUSES = (200, 404)
+
+# Returned for misses in offline mode
+OFFLINE_MISS_STATUS = 504
+
+# Seconds a statement waits for another process's write before the cache gives up on it
+BUSY_TIMEOUT = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    provider TEXT,
+    status INTEGER NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    fetched REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+CREATE TABLE IF NOT EXISTS citations (
+    work_id TEXT PRIMARY KEY,
+    citation TEXT NOT NULL,
+    fetched REAL NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    accessed REAL NOT NULL DEFAULT 0
+);
+"""
+
+# Caches made before citations were size bounded lack these columns
+CITATION_COLUMNS = """
+ALTER TABLE citations ADD COLUMN size INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE citations ADD COLUMN accessed REAL NOT NULL DEFAULT 0;
+UPDATE citations SET size = length(CAST(citation AS BLOB)), accessed = fetched;
+"""
+
+CITATIONS_INDEX = "CREATE INDEX IF NOT EXISTS citations_accessed ON citations (accessed);"
+
+
+def normalize_url(url, params=None):
+    r"""
+    Canonical cache key for a GET request: the same request always maps to the same key,
+    however its query string was written or split between the URL and `params`.
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        items = params.items() if isinstance(params, dict) else params
+        query.extend((str(k), str(v)) for k, v in items)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/",
+                       urlencode(sorted(query)), ""))
+
+
+class CachedResponse:
+    r"""
+    The part of requests.Response the API query functions use, rebuilt from the cache.
+    """
+    def __init__(self, status_code, content, from_cache=True):
+        self.status_code = status_code
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ResponseCache:
+    r"""
+    Thread-safe: one connection is shared by every worker thread behind a lock.
+    `ttls` maps provider names to seconds; providers not listed use `default_ttl`.
+    """
+    def __init__(self, path, ttls=None, default_ttl=30 * DAY, negative_ttl=7 * DAY, max_bytes=1024 ** 3,
+                 offline=False):
+        self.path = path
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.busy_errors = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if "size" not in [column[1] for column in self.conn.execute("PRAGMA table_info(citations)")]:
+            self.conn.executescript(f"BEGIN; {CITATION_COLUMNS} COMMIT;")
+        self.conn.execute(CITATIONS_INDEX)
+        self.total_bytes = self._stored_bytes()
+
+    def _stored_bytes(self):
+        return self.conn.execute("SELECT (SELECT COALESCE(SUM(size), 0) FROM responses) + "
+                                 "(SELECT COALESCE(SUM(size), 0) FROM citations)").fetchone()[0]
+
+    def _busy(self, error):
+        # Caller holds the lock
+        self.busy_errors += 1
+        if self.busy_errors == 1:
+            print(f"Response cache {self.path} unavailable ({error}); going on without it for the affected entries")
+
+    def ttl_for(self, provider, status):
+        ttl = self.ttls.get(provider, self.default_ttl)
+        # Not-found answers change as providers index new works, so they expire sooner
+        return min(ttl, self.negative_ttl) if status != 200 else ttl
+
+    def get(self, key):
+        r"""
+        Return the cached response for a key, or None if it is missing or expired.
+        Expired entries are still served in offline mode: stale data beats no data when there is no network.
+        """
+        now = time.time()
+        with self.lock:
+            try:
+                row = self.conn.execute("SELECT provider, status, body, fetched FROM responses WHERE key = ?",
+                                        (key,)).fetchone()
+            except sqlite3.OperationalError as e:
+                self._busy(e)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            provider, status, body, fetched = row
+            if not self.offline and now - fetched > self.ttl_for(provider, status):
+                self.misses += 1
+                return None
+            try:
+                self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            except sqlite3.OperationalError as e:
+                self._busy(e)
+            self.hits += 1
+        return CachedResponse(status, zlib.decompress(body))
+
+    def put(self, key, provider, status, content):
+        if status not in CACHEABLE_STATUSES:
+            return
+        body = zlib.compress(content)
+        now = time.time()
+        with self.lock:
+            try:
+                previous = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  (key, provider, status, body, len(body), now, now))
+                self.total_bytes += len(body) - (previous[0] if previous else 0)
+                if self.total_bytes > self.max_bytes:
+                    self._evict()
+            except sqlite3.OperationalError as e:
+                self._busy(e)
+
+    def get_citations(self, work_ids, provider="OpenAlex"):
+        r"""
+        Cached citations for the given OpenAlex work IDs that have not expired: work_id -> citation.
+        """
+        ttl = self.ttl_for(provider, 200)
+        now = time.time()
+        found = {}
+        work_ids = list(work_ids)
+        with self.lock:
+            try:
+                # Stay well below SQLite's limit on bound parameters
+                for start in range(0, len(work_ids), 500):
+                    part = work_ids[start:start + 500]
+                    query = (f"SELECT work_id, citation, fetched FROM citations "
+                             f"WHERE work_id IN ({','.join('?' * len(part))})")
+                    for work_id, citation, fetched in self.conn.execute(query, part):
+                        if self.offline or now - fetched <= ttl:
+                            found[work_id] = citation
+                self.conn.executemany("UPDATE citations SET accessed = ? WHERE work_id = ?",
+                                      [(now, work_id) for work_id in found])
+            except sqlite3.OperationalError as e:
+                self._busy(e)
+            self.hits += len(found)
+            self.misses += len(work_ids) - len(found)
+        return found
+
+    def put_citations(self, citations):
+        now = time.time()
+        rows = [(work_id, citation, now, len(citation.encode("utf-8")), now)
+                for work_id, citation in citations.items()]
+        with self.lock:
+            try:
+                replaced = 0
+                work_ids = list(citations)
+                for start in range(0, len(work_ids), 500):
+                    part = work_ids[start:start + 500]
+                    query = (f"SELECT COALESCE(SUM(size), 0) FROM citations "
+                             f"WHERE work_id IN ({','.join('?' * len(part))})")
+                    replaced += self.conn.execute(query, part).fetchone()[0]
+                self.conn.executemany("INSERT OR REPLACE INTO citations VALUES (?, ?, ?, ?, ?)", rows)
+                self.total_bytes += sum(row[3] for row in rows) - replaced
+                if self.total_bytes > self.max_bytes:
+                    self._evict()
+            except sqlite3.OperationalError as e:
+                self._busy(e)
+
+    def discard(self, key):
+        with self.lock:
+            try:
+                row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                if row:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.total_bytes -= row[0]
+            except sqlite3.OperationalError as e:
+                self._busy(e)
+
+    def _evict(self):
+        r"""
+        Drop expired entries, then least recently used responses and citations, until the cache is back to 90%
+        of its bound, so eviction runs once per burst of inserts rather than on every insert. Expired entries
+        are kept in offline mode, where they are still served. Caller holds the lock.
+        """
+        target = self.max_bytes * 0.9
+        if not self.offline:
+            now = time.time()
+            providers = [row[0] for row in self.conn.execute("SELECT DISTINCT provider FROM responses")]
+            for provider in providers:
+                self.conn.execute("DELETE FROM responses WHERE provider IS ? AND status = 200 AND fetched < ?",
+                                  (provider, now - self.ttl_for(provider, 200)))
+                self.conn.execute("DELETE FROM responses WHERE provider IS ? AND status != 200 AND fetched < ?",
+                                  (provider, now - self.ttl_for(provider, 404)))
+            self.conn.execute("DELETE FROM citations WHERE fetched < ?", (now - self.ttl_for("OpenAlex", 200),))
+            self.total_bytes = self._stored_bytes()
+        evicted = {"responses": [], "citations": []}
+        entries = self.conn.execute("SELECT 'responses', key, size, accessed FROM responses "
+                                    "UNION ALL SELECT 'citations', work_id, size, accessed FROM citations "
+                                    "ORDER BY accessed")
+        freed = 0
+        for table, key, size, _ in entries:
+            if self.total_bytes - freed <= target:
+                break
+            evicted[table].append((key,))
+            freed += size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted["responses"])
+        self.conn.executemany("DELETE FROM citations WHERE work_id = ?", evicted["citations"])
+        self.total_bytes -= freed
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,281 @@
+r"""
+Offline metadata from local OpenAlex or Crossref snapshot dumps, for metadataCompleter.py.
+A dump is a directory of gzipped JSONL files with one work per line (OpenAlex's works snapshot, or Crossref's
+public data file). Building a snapshot store reads the dump once and writes:
+    blocks/NNNNN.jsonl.gz   the same lines, re-compressed as independent gzip members of about BLOCK_BYTES each,
+                            so any line can be reached by seeking to its member and decoding only that member
+                            (the dumps themselves are single gzip streams, which can only be read from the start)
+    index.sqlite            an 8-byte hash of every key -> (block file, member offset, line offset)
+Keys are normalized DOIs, plus the bare work ID ("W123") for OpenAlex so cited works resolve offline too.
+Building again after new dump files were added only indexes the new files.
+
+Usage:
+    python snapshotBackend.py --source openalex --dump ./openalex-snapshot/data/works --store ./records/openalexSnapshot
+    python snapshotBackend.py --source crossref --dump ./crossref-public-data --store ./records/crossrefSnapshot
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+SOURCES = ("openalex", "crossref")
+BLOCK_BYTES = 1 << 20     # Uncompressed bytes per gzip member in the store
+INSERT_BATCH = 50000      # Index rows written per transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    key INTEGER PRIMARY KEY,
+    file INTEGER NOT NULL,
+    member INTEGER NOT NULL,
+    line INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    records INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+def dump_doi(doi):
+    # Dumps hold clean DOIs; OpenAlex writes them as https://doi.org/ URLs
+    doi = str(doi).strip().lower()
+    for prefix in ("https://doi.org/", "http://doi.org/"):
+        if doi.startswith(prefix):
+            return doi[len(prefix):]
+    return doi
+
+
+def record_keys(source, record):
+    r"""
+    Index keys of one dump record.
+    """
+    if source == "openalex":
+        keys = []
+        if record.get("doi"):
+            keys.append(dump_doi(record["doi"]))
+        work_id = str(record.get("id") or "").rsplit("/", 1)[-1]
+        if work_id.startswith("W"):
+            keys.append(work_id)
+        return keys
+    return [dump_doi(record["DOI"])] if record.get("DOI") else []
+
+
+def dump_files(paths):
+    r"""
+    Every .gz file under the given files and directories, in path order, so later OpenAlex update partitions
+    (updated_date=...) are indexed after, and win over, earlier ones.
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                found.extend(os.path.join(root, name) for name in names if name.endswith(".gz"))
+        else:
+            found.append(path)
+    return sorted(os.path.abspath(path) for path in found)
+
+
+class SnapshotStore:
+    r"""
+    A built snapshot store. Lookups are thread-safe: the index connection is shared under a lock and every
+    lookup opens its own block file handle.
+    """
+    def __init__(self, path):
+        self.path = path
+        index = os.path.join(path, "index.sqlite")
+        if not os.path.exists(index):
+            raise FileNotFoundError(f"No snapshot index at {index}; build it with snapshotBackend.py first")
+        self.conn = sqlite3.connect(index, check_same_thread=False)
+        self.lock = threading.Lock()
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        self.source = json.loads(row[0]) if row else None
+        self.hits = 0
+        self.misses = 0
+
+    def block_path(self, file_id):
+        return os.path.join(self.path, "blocks", f"{file_id:05d}.jsonl.gz")
+
+    def read_member(self, file_id, offset):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = []
+        with open(self.block_path(file_id), "rb") as f:
+            f.seek(offset)
+            while not decompressor.eof:
+                compressed = f.read(64 * 1024)
+                if not compressed:
+                    break
+                data.append(decompressor.decompress(compressed))
+        return b"".join(data)
+
+    def get_many(self, keys):
+        r"""
+        Records for the given keys (normalized DOIs or OpenAlex work IDs): key -> record dict. Keys not in the
+        snapshot are left out. Each gzip member is decoded once however many of the keys it holds.
+        """
+        keys = list(dict.fromkeys(keys))
+        locations = {}
+        with self.lock:
+            for key in keys:
+                row = self.conn.execute("SELECT file, member, line FROM keys WHERE key = ?",
+                                        (key_hash(key),)).fetchone()
+                if row is not None:
+                    locations.setdefault((row[0], row[1]), []).append((key, row[2]))
+        found = {}
+        for (file_id, offset), wanted in locations.items():
+            try:
+                data = self.read_member(file_id, offset)
+            except (OSError, zlib.error):
+                # A block that is missing or being rewritten by a build: its keys are misses
+                continue
+            for key, line in wanted:
+                end = data.find(b"\n", line)
+                try:
+                    record = json.loads(data[line:end if end >= 0 else None])
+                except ValueError:
+                    continue
+                # Guard against the (vanishingly rare) hash collision
+                if isinstance(record, dict) and key in record_keys(self.source, record):
+                    found[key] = record
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def close(self):
+        self.conn.close()
+
+
+def build_snapshot(source, dump_paths, store_path, block_bytes=BLOCK_BYTES):
+    r"""
+    Build or extend the snapshot store at `store_path` from the dump files under `dump_paths`.
+    Returns the number of records indexed.
+    """
+    if source not in SOURCES:
+        raise ValueError(f"Unknown snapshot source {source!r} (use {' or '.join(SOURCES)})")
+    os.makedirs(os.path.join(store_path, "blocks"), exist_ok=True)
+    conn = sqlite3.connect(os.path.join(store_path, "index.sqlite"))
+    conn.executescript(SCHEMA)
+    row = conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+    if row is not None and json.loads(row[0]) != source:
+        conn.close()
+        raise ValueError(f"{store_path} is a {json.loads(row[0])} snapshot, not {source}")
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('source', ?)", (json.dumps(source),))
+    indexed = 0
+    try:
+        for dump in dump_files(dump_paths):
+            stat = os.stat(dump)
+            known = conn.execute("SELECT size, mtime FROM files WHERE path = ?", (dump,)).fetchone()
+            if known == (stat.st_size, stat.st_mtime):
+                continue
+            start = time.time()
+            if known is None:
+                with conn:
+                    file_id = conn.execute("INSERT INTO files (path, size, mtime, records) VALUES (?, -1, 0, 0)",
+                                           (dump,)).lastrowid
+            else:
+                file_id = conn.execute("SELECT id FROM files WHERE path = ?", (dump,)).fetchone()[0]
+                # A changed dump is re-indexed into the same block file, so its old locations would point at
+                # arbitrary bytes; they are dropped, and marked incomplete, in one transaction
+                with conn:
+                    conn.execute("DELETE FROM keys WHERE file = ?", (file_id,))
+                    conn.execute("UPDATE files SET size = -1 WHERE id = ?", (file_id,))
+            # The size is only recorded once indexing is complete, so an interrupted build redoes the file
+            block_file = os.path.join(store_path, "blocks", f"{file_id:05d}.jsonl.gz")
+            records = index_dump(conn, source, dump, file_id, block_file, block_bytes)
+            with conn:
+                conn.execute("UPDATE files SET size = ?, mtime = ?, records = ? WHERE id = ?",
+                             (stat.st_size, stat.st_mtime, records, file_id))
+            indexed += records
+            print(f"Indexed {records} records from {dump} in {time.time() - start:.1f} seconds")
+    finally:
+        conn.close()
+    return indexed
+
+
+def index_dump(conn, source, dump, file_id, block_file, block_bytes):
+    rows = []
+    block = []
+    block_size = 0
+    records = 0
+    skipped = 0
+
+    def write_block():
+        nonlocal block, block_size
+        member = out.tell()
+        out.write(gzip.compress(b"".join(line for line, _ in block)))
+        line_offset = 0
+        for line, keys in block:
+            rows.extend((key_hash(key), file_id, member, line_offset) for key in keys)
+            line_offset += len(line)
+        block = []
+        block_size = 0
+
+    with gzip.open(dump, "rb") as lines, open(block_file, "wb") as out:
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                keys = record_keys(source, json.loads(line))
+            except (ValueError, AttributeError):
+                skipped += 1
+                continue
+            if not line.endswith(b"\n"):
+                line += b"\n"
+            block.append((line, keys))
+            block_size += len(line)
+            records += 1
+            if block_size >= block_bytes:
+                write_block()
+            if len(rows) >= INSERT_BATCH:
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?)", rows)
+                rows.clear()
+        if block:
+            write_block()
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?)", rows)
+    if skipped:
+        print(f"Skipped {skipped} lines of {dump} that are not JSON records")
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an offline snapshot store from OpenAlex or Crossref dumps.")
+    parser.add_argument("--source", choices=SOURCES, required=True)
+    parser.add_argument("--dump", nargs="+", required=True, help="Dump directories or .gz JSONL files.")
+    parser.add_argument("--store", required=True, help="Directory of the snapshot store to build or extend.")
+    parser.add_argument("--block-kb", type=int, default=BLOCK_BYTES // 1024,
+                        help="Uncompressed size of each independently decodable block.")
+    args = parser.parse_args()
+    start = time.time()
+    try:
+        indexed = build_snapshot(args.source, args.dump, args.store, args.block_kb * 1024)
+    except (ValueError, OSError) as e:
+        print(e)
+        return
+    print(f"Snapshot store {args.store}: {indexed} new records indexed in {time.time() - start:.1f} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+r"""
+Parse Web of Science, Scopus and PubMed exports into Bibliometrix records and merge them without duplicates, in
+Python: the work of convert2df() and mergeDbSources(..., remove.duplicated = TRUE) in main.R, without an R install.
+Every export is streamed one record at a time:
+    Web of Science plaintext    two-letter field tags, continuation lines indented, each record closed by ER
+    Scopus CSV                  one record per row, columns named as in Scopus' export dialog
+    PubMed MEDLINE              tags of up to four letters followed by "- ", records starting at PMID
+Fields are mapped to Bibliometrix tags (WoS tags already are), multi-valued fields are joined with ";", author
+names are written as "SURNAME INITIALS", and text is upper-cased as convert2df() does. CR keeps the raw cited
+references, as main.R keeps CR_raw. Tags outside COLUMNS are dropped.
+As in mergeDbSources(), sources are read in the order WoS, Scopus, PubMed and the first copy of a record is kept.
+A record is a duplicate when its normalized DOI or its normalized title and year were already seen; the index
+holds one 8-byte hash per key, so it stays small next to the records, which are written out as they come.
+With --known, the records of earlier merged datasets are indexed first, so only the new exports written by
+txtFileMerge.py (WoS.new.txt, ...) need to be parsed into a dataset of new records.
+
+Usage:
+    python sourceParser.py [--wos WoS.txt] [--scopus Scopus.csv] [--pubmed Pubmed.txt] \
+        [--output ./records/mergedDataset.xlsx]
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import re
+import time
+
+import pandas as pd
+
+from datasetIO import ChunkWriter, DEFAULT_CHUNK_ROWS, dataset_format, read_chunks
+
+WOS_FILE = "./WoS.txt"
+SCOPUS_FILE = "./Scopus.csv"
+PUBMED_FILE = "./Pubmed.txt"
+OUTPUT_FILE = "./records/mergedDataset.xlsx"
+
+# Output columns, in order
+COLUMNS = ["AU", "AF", "TI", "SO", "JI", "J9", "DT", "LA", "DE", "ID", "AB", "C1", "RP", "EM", "CR", "NR", "TC",
+           "PU", "SN", "PY", "PD", "VL", "IS", "AR", "BP", "EP", "DI", "PMID", "UT", "URL", "FU", "WC", "SC", "DB",
+           "SR"]
+# Left as exported: raw references, identifiers and links
+KEEP_CASE = {"CR", "DI", "URL", "EM"}
+
+# WoS fields whose continuation lines are separate values rather than a wrapped line
+WOS_LIST_FIELDS = {"AU", "AF", "CR", "C1"}
+
+SCOPUS_COLUMNS = {
+    "Authors": "AU",
+    "Author full names": "AF",
+    "Title": "TI",
+    "Year": "PY",
+    "Source title": "SO",
+    "Abbreviated Source Title": "JI",
+    "Volume": "VL",
+    "Issue": "IS",
+    "Art. No.": "AR",
+    "Page start": "BP",
+    "Page end": "EP",
+    "Cited by": "TC",
+    "DOI": "DI",
+    "Link": "URL",
+    "Authors with affiliations": "C1",
+    "Abstract": "AB",
+    "Author Keywords": "DE",
+    "Index Keywords": "ID",
+    "Funding Details": "FU",
+    "References": "CR",
+    "Correspondence Address": "RP",
+    "Publisher": "PU",
+    "ISSN": "SN",
+    "PubMed ID": "PMID",
+    "Language of Original Document": "LA",
+    "Document Type": "DT",
+    "EID": "UT",
+}
+
+# MEDLINE tag -> Bibliometrix tag, for fields copied as they are; list fields are joined with ";"
+PUBMED_FIELDS = {"PMID": "PMID", "TI": "TI", "AB": "AB", "JT": "SO", "TA": "JI", "VI": "VL", "IP": "IS"}
+PUBMED_LIST_FIELDS = {"AU": "AU", "FAU": "AF", "AD": "C1", "LA": "LA", "PT": "DT", "IS": "SN", "OT": "DE",
+                      "MH": "ID", "GR": "FU"}
+
+MEDLINE_TAG_RE = re.compile(r"^([A-Z]{2,4})\s*- ?(.*)$")
+DOI_RE = re.compile(r"10\.\d{4,9}/[^\s;,]+", re.IGNORECASE)
+SCOPUS_AUTHOR_ID_RE = re.compile(r"\s*\(\d+\)\s*$")
+
+
+def doi_key(value):
+    match = DOI_RE.search(str(value or ""))
+    return match.group(0).lower().rstrip(".") if match else ""
+
+
+def title_key(title, year):
+    title = " ".join(re.sub(r"[^0-9A-Z]+", " ", str(title or "").upper()).split())
+    return f"{title}|{year or ''}" if title else ""
+
+
+def _key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+def author_name(name):
+    r"""
+    "Doe, AB" (WoS), "Doe A.B." or "Doe A. B." (Scopus) and "Doe AB" (PubMed) all become "DOE AB".
+    """
+    name = name.replace(". ", ".").replace(".", "").upper()
+    if "," in name:
+        surname, initials = name.split(",", 1)
+        return " ".join(surname.split() + ["".join(initials.split())]).strip()
+    return " ".join(name.split())
+
+
+def split_pages(pages):
+    r"""
+    "123-30" -> ("123", "130"): MEDLINE abbreviates the end page.
+    """
+    begin, _, end = str(pages).partition("-")
+    begin, end = begin.strip(), end.strip()
+    if end.isdigit() and begin.isdigit() and len(end) < len(begin):
+        end = begin[:len(begin) - len(end)] + end
+    return begin, end
+
+
+def _unique(values):
+    return list(dict.fromkeys(value for value in values if value))
+
+
+def finish_record(record, database):
+    r"""
+    Upper-case the text fields and add DB and the SR short reference, as convert2df() does.
+    """
+    for tag in ("DE", "ID"):
+        if record.get(tag):
+            record[tag] = ";".join(part.strip() for part in record[tag].split(";") if part.strip())
+    for tag, value in list(record.items()):
+        if tag not in KEEP_CASE and isinstance(value, str):
+            record[tag] = value.upper()
+    record["DB"] = database
+    first_author = record.get("AU", "").split(";")[0]
+    source = record.get("J9") or record.get("JI") or record.get("SO", "")
+    record["SR"] = ", ".join(part for part in (first_author, record.get("PY", ""), source) if part)
+    return record
+
+
+def parse_wos(path):
+    r"""
+    Yield the records of a WoS plaintext export (or several concatenated ones) as tag -> list of lines.
+    """
+    record = {}
+    tag = None
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
+            if line.startswith("   ") and tag is not None:
+                record[tag].append(line.strip())
+                continue
+            code, value = line[:2], line[3:].strip()
+            if code == "ER":
+                if record:
+                    yield record
+                record = {}
+                tag = None
+            elif code in ("FN", "VR", "EF"):
+                tag = None
+            else:
+                tag = code
+                record.setdefault(tag, []).append(value)
+    if record:
+        yield record
+
+
+def wos_record(fields):
+    record = {}
+    for tag, lines in fields.items():
+        if tag in WOS_LIST_FIELDS:
+            record[tag] = ";".join(line for line in lines if line)
+        else:
+            record[tag] = " ".join(line for line in lines if line)
+    if record.get("AU"):
+        record["AU"] = ";".join(author_name(name) for name in record["AU"].split(";"))
+    if "PM" in record:
+        record["PMID"] = record.pop("PM")
+    return finish_record(record, "ISI")
+
+
+def parse_scopus(path):
+    r"""
+    Yield the rows of a Scopus CSV export as column -> value.
+    """
+    with open(path, encoding="utf-8-sig", errors="replace", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def scopus_record(row):
+    record = {}
+    for column, tag in SCOPUS_COLUMNS.items():
+        value = (row.get(column) or "").strip()
+        if value:
+            record[tag] = value
+    if record.get("AU"):
+        # Recent exports separate authors with ";", older ones with ","
+        separator = ";" if ";" in record["AU"] else ","
+        record["AU"] = ";".join(author_name(name) for name in record["AU"].split(separator) if name.strip())
+    if record.get("AF"):
+        record["AF"] = ";".join(SCOPUS_AUTHOR_ID_RE.sub("", name).strip() for name in record["AF"].split(";"))
+    for tag in ("CR", "C1"):
+        if record.get(tag):
+            record[tag] = ";".join(part.strip() for part in record[tag].split(";") if part.strip())
+    if record.get("JI"):
+        record["J9"] = record["JI"]
+    return finish_record(record, "SCOPUS")
+
+
+def parse_pubmed(path):
+    r"""
+    Yield the records of a PubMed MEDLINE export as tag -> list of values.
+    """
+    record = {}
+    tag = None
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
+            match = MEDLINE_TAG_RE.match(line)
+            if match is None:
+                if tag is not None and line[:1].isspace():
+                    record[tag][-1] += " " + line.strip()
+                continue
+            tag, value = match.group(1), match.group(2).strip()
+            if tag == "PMID" and record:
+                yield record
+                record = {}
+            record.setdefault(tag, []).append(value)
+    if record:
+        yield record
+
+
+def pubmed_record(fields):
+    record = {}
+    for tag, target in PUBMED_FIELDS.items():
+        if fields.get(tag):
+            record[target] = fields[tag][0]
+    for tag, target in PUBMED_LIST_FIELDS.items():
+        values = _unique(fields.get(tag, []))
+        if values:
+            record[target] = ";".join(values)
+    if record.get("AU"):
+        record["AU"] = ";".join(author_name(name) for name in record["AU"].split(";"))
+    if record.get("SN"):
+        # "1234-5678 (Electronic)" -> "1234-5678"
+        record["SN"] = ";".join(_unique(value.split(" ")[0] for value in record["SN"].split(";")))
+    if record.get("JI"):
+        record["J9"] = record["JI"]
+    year = re.match(r"\d{4}", fields.get("DP", [""])[0])
+    if year:
+        record["PY"] = year.group(0)
+    if fields.get("PG"):
+        record["BP"], record["EP"] = split_pages(fields["PG"][0])
+    for value in fields.get("LID", []) + fields.get("AID", []):
+        if value.endswith("[doi]"):
+            record["DI"] = value[:-len("[doi]")].strip()
+            break
+    return finish_record(record, "PUBMED")
+
+
+# Source name -> (record parser, record mapper), in mergeDbSources() order
+SOURCES = {"wos": (parse_wos, wos_record), "scopus": (parse_scopus, scopus_record),
+           "pubmed": (parse_pubmed, pubmed_record)}
+
+
+class DuplicateIndex:
+    r"""
+    Hashes of every DOI and title+year key kept so far.
+    """
+    def __init__(self):
+        self.keys = set()
+
+    @staticmethod
+    def record_keys(record):
+        keys = [_key_hash("doi:" + key) for key in (doi_key(record.get("DI")),) if key]
+        keys += [_key_hash("ti:" + key) for key in (title_key(record.get("TI"), record.get("PY")),) if key]
+        return keys
+
+    def is_duplicate(self, record):
+        keys = self.record_keys(record)
+        if any(key in self.keys for key in keys):
+            return True
+        self.keys.update(keys)
+        return False
+
+    def add_dataset(self, path, chunk_rows=DEFAULT_CHUNK_ROWS):
+        r"""
+        Index the records of an earlier merged dataset, so records it already holds count as duplicates.
+        Returns the number of records indexed.
+        """
+        records = 0
+        for chunk in read_chunks(path, chunk_rows):
+            columns = [column for column in ("DI", "TI", "PY") if column in chunk.columns]
+            for values in chunk[columns].itertuples(index=False, name=None):
+                record = {column: value for column, value in zip(columns, values)
+                          if value is not None and value == value}
+                self.keys.update(self.record_keys(record))
+                records += 1
+        return records
+
+
+def merge_sources(sources, output_file=OUTPUT_FILE, chunk_rows=DEFAULT_CHUNK_ROWS, remove_duplicated=True,
+                  known=None):
+    r"""
+    Parse the exports in `sources` (source name -> list of files, read in SOURCES order) into `output_file`.
+    Records already in the `known` datasets (e.g. the merged dataset when parsing txtFileMerge.py's new exports)
+    are left out as duplicates.
+    Returns per-source statistics: source -> {"records", "duplicates", "written", "seconds"}.
+    """
+    index = DuplicateIndex()
+    for path in known or []:
+        print(f"Indexed {index.add_dataset(path, chunk_rows)} known records from {path}")
+    stem, extension = os.path.splitext(output_file)
+    partial_file = f"{stem}.part{extension}"
+    writer = ChunkWriter(partial_file, COLUMNS)
+    stats = {}
+    buffer = []
+    try:
+        for source, (parse, to_record) in SOURCES.items():
+            for path in sources.get(source) or []:
+                start = time.time()
+                counts = stats.setdefault(source, {"records": 0, "duplicates": 0, "written": 0, "seconds": 0.0})
+                for fields in parse(path):
+                    record = to_record(fields)
+                    counts["records"] += 1
+                    if remove_duplicated and index.is_duplicate(record):
+                        counts["duplicates"] += 1
+                        continue
+                    buffer.append(record)
+                    counts["written"] += 1
+                    if len(buffer) >= chunk_rows:
+                        writer.write(pd.DataFrame(buffer, columns=COLUMNS))
+                        buffer = []
+                counts["seconds"] += time.time() - start
+        if buffer:
+            writer.write(pd.DataFrame(buffer, columns=COLUMNS))
+        writer.close()
+    except BaseException:
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        raise
+    os.replace(partial_file, output_file)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse WoS, Scopus and PubMed exports into one Bibliometrix dataset.")
+    parser.add_argument("--wos", nargs="*", default=[WOS_FILE], help="WoS plaintext exports.")
+    parser.add_argument("--scopus", nargs="*", default=[SCOPUS_FILE], help="Scopus CSV exports.")
+    parser.add_argument("--pubmed", nargs="*", default=[PUBMED_FILE], help="PubMed MEDLINE exports.")
+    parser.add_argument("--output", default=OUTPUT_FILE,
+                        help="Merged dataset (.xlsx, .csv, .parquet or .arrow).")
+    parser.add_argument("--keep-duplicates", action="store_true", help="Write every record, duplicates included.")
+    parser.add_argument("--known", nargs="*", default=[],
+                        help="Earlier merged datasets whose records are left out, to parse only new exports.")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="Records written at a time.")
+    args = parser.parse_args()
+    try:
+        dataset_format(args.output)
+    except ValueError as e:
+        print(e)
+        return
+    sources = {}
+    for source in SOURCES:
+        paths = getattr(args, source)
+        missing = [path for path in paths if not os.path.exists(path)]
+        for path in missing:
+            print(f"Skipping {path}: file not found")
+        sources[source] = [path for path in paths if path not in missing]
+    if not any(sources.values()):
+        print("No exports to merge.")
+        return
+    start = time.time()
+    try:
+        stats = merge_sources(sources, args.output, args.chunk_rows, remove_duplicated=not args.keep_duplicates,
+                              known=args.known)
+    except (OSError, ValueError, csv.Error) as e:
+        print(f"Error merging exports into {args.output}: {e}")
+        return
+    for source, counts in stats.items():
+        print(f"{source}: {counts['records']} records, {counts['duplicates']} duplicates removed, "
+              f"{counts['written']} written ({counts['seconds']:.1f} seconds)")
+    print(f"Merged dataset saved as {args.output}: {sum(c['written'] for c in stats.values())} records "
+          f"in {time.time() - start:.1f} seconds")
+
+
+if __name__ == "__main__":
+    main()
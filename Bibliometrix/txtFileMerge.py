@@ -1,40 +1,269 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
 import pathlib
+import argparse
+import tempfile
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 
+# Merges the exports under ./records into WoS.txt, Scopus.csv and Pubmed.txt for main.R / sourceParser.py.
+# WoS and PubMed exports are plain text and are concatenated as bytes. Scopus exports are read in chunks, several
+# files at a time, and written under the union of their columns (exports made with different field selections
+# line up by column name), so no export is ever held whole in memory.
+#
+# Merging is incremental. mergeManifest.json records every export merged so far (path, size, modification time,
+# content hash) and the size of each merged file, and a run only appends the exports added since. An export that
+# changed or disappeared since it was merged is flagged but left in place until a run with --rebuild; a merged
+# file that no longer matches the manifest, or a new Scopus export with columns the merged header lacks, is
+# rebuilt from every export. The exports merged by a run are also written on their own to WoS.new.txt,
+# Scopus.new.csv and Pubmed.new.txt, so later stages can process just the new records, e.g.
+#   python sourceParser.py --wos WoS.new.txt --scopus Scopus.new.csv --pubmed Pubmed.new.txt \
+#       --known ./records/mergedDataset.xlsx --output ./records/mergedDatasetNew.xlsx
+
 WoSDir = pathlib.Path("./records/WoS")
 ScopusDir = pathlib.Path("./records/Scopus")
 PubmedDir = pathlib.Path("./records/Pubmed")
-WoSFiles = []
-ScopusFiles = []
-PubmedFiles = []
-
-for item in WoSDir.iterdir():
-    if item.is_file():
-        WoSFiles.append(item)
-
-for item in ScopusDir.iterdir():
-    if item.is_file():
-        ScopusFiles.append(item)
-
-for item in PubmedDir.iterdir():
-    if item.is_file():
-        PubmedFiles.append(item)
-
-with open('WoS.txt', 'w') as WoSMergedFile:
-    for item in WoSFiles:
-        with open(item) as inputFile:
-            for line in inputFile:
-                WoSMergedFile.write(line)
-            WoSMergedFile.write("\n")
-WoSMergedFile.close()
-
-ScopusMergedFile = pd.concat([pd.read_csv(f) for f in ScopusFiles], ignore_index=True)
-ScopusMergedFile.to_csv('Scopus.csv')
-
-with open('Pubmed.txt', 'w') as PubmedMergedFile:
-    for item in PubmedFiles:
-        with open(item) as inputFile:
-            for line in inputFile:
-                PubmedMergedFile.write(line)
-            PubmedMergedFile.write("\n")
-PubmedMergedFile.close()
+manifestPath = "./records/mergeManifest.json"
+
+# Rows of a Scopus export parsed at a time, and exports parsed at once
+scopusChunkRows = 20000
+scopusReadWorkers = min(4, os.cpu_count() or 1)
+copyBlockBytes = 1 << 20
+utf8Bom = b"\xef\xbb\xbf"
+
+
+def sourceFiles(directory):
+    if not directory.is_dir():
+        return []
+    return sorted(item for item in directory.iterdir() if item.is_file())
+
+
+def deltaPath(mergedPath):
+    # WoS.txt -> WoS.new.txt
+    stem, extension = os.path.splitext(mergedPath)
+    return f"{stem}.new{extension}"
+
+
+def fileDigest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as inputFile:
+        for block in iter(lambda: inputFile.read(copyBlockBytes), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fileEntry(item, digest, rows=None):
+    stat = item.stat()
+    entry = {"size": stat.st_size, "mtime": stat.st_mtime, "blake2b": digest}
+    if rows is not None:
+        entry["rows"] = rows
+    return entry
+
+
+def loadManifest():
+    if not os.path.exists(manifestPath):
+        return {}
+    with open(manifestPath, encoding='utf-8') as manifestFile:
+        return json.load(manifestFile)
+
+
+def saveManifest(manifest):
+    # Written under a temporary name, so an interrupted run never leaves half a manifest
+    os.makedirs(os.path.dirname(manifestPath) or ".", exist_ok=True)
+    tempPath = f"{manifestPath}.tmp"
+    with open(tempPath, 'w', encoding='utf-8') as manifestFile:
+        json.dump(manifest, manifestFile, indent=2)
+    os.replace(tempPath, manifestPath)
+
+
+def compareFiles(files, known):
+    # Sorts the exports against the manifest into new, changed and removed ones. Files whose size and
+    # modification time are unchanged are trusted; the others are hashed before they count as changed.
+    new, changed, touched = [], [], {}
+    for item in files:
+        entry = known.get(str(item))
+        if entry is None:
+            new.append(item)
+            continue
+        stat = item.stat()
+        if stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+            continue
+        digest = fileDigest(item) if stat.st_size == entry["size"] else None
+        if digest == entry["blake2b"]:
+            touched[str(item)] = dict(entry, mtime=stat.st_mtime)
+        else:
+            changed.append(item)
+    present = {str(item) for item in files}
+    removed = [path for path in known if path not in present]
+    return new, changed, removed, touched
+
+
+def copyTextFiles(files, mergedPath, append, columns=None):
+    # Byte-for-byte block copies to the merged file and the delta file, hashing on the way; a UTF-8 byte order
+    # mark is dropped so none ends up in the middle of the file
+    entries = {}
+    with open(mergedPath, 'ab' if append else 'wb') as mergedFile, open(deltaPath(mergedPath), 'wb') as deltaFile:
+        for item in files:
+            digest = hashlib.blake2b(digest_size=16)
+            with open(item, 'rb') as inputFile:
+                head = inputFile.read(len(utf8Bom))
+                digest.update(head)
+                if head != utf8Bom:
+                    mergedFile.write(head)
+                    deltaFile.write(head)
+                for block in iter(lambda: inputFile.read(copyBlockBytes), b""):
+                    digest.update(block)
+                    mergedFile.write(block)
+                    deltaFile.write(block)
+            mergedFile.write(b"\n")
+            deltaFile.write(b"\n")
+            entries[str(item)] = fileEntry(item, digest.hexdigest())
+    return None, entries, None
+
+
+def scopusColumns(files):
+    # Union of every export's columns, in the order they are first seen; only the header rows are read
+    columns = {}
+    for item in files:
+        for column in pd.read_csv(item, nrows=0, encoding='utf-8-sig').columns:
+            columns.setdefault(column, None)
+    return list(columns)
+
+
+def writeScopusPart(item, columns, partPath):
+    # Values are kept as exported: read as text, and empty or "NA" cells are not turned into missing values
+    rows = 0
+    with open(partPath, 'w', encoding='utf-8', newline='') as partFile:
+        for chunk in pd.read_csv(item, chunksize=scopusChunkRows, dtype=str, encoding='utf-8-sig',
+                                 keep_default_na=False):
+            chunk.reindex(columns=columns).to_csv(partFile, header=False, index=False)
+            rows += len(chunk)
+    return rows, fileDigest(item)
+
+
+def mergeScopusFiles(files, mergedPath, append, columns=None):
+    # When appending, `columns` is the merged file's header and the new exports are written under it
+    if not append:
+        columns = scopusColumns(files)
+    mergedDir = os.path.dirname(os.path.abspath(mergedPath))
+    entries = {}
+    with tempfile.TemporaryDirectory(dir=mergedDir) as partDir:
+        partPaths = [os.path.join(partDir, f"{i}.csv") for i in range(len(files))]
+        with ThreadPoolExecutor(max_workers=scopusReadWorkers) as executor:
+            results = list(executor.map(writeScopusPart, files, [columns] * len(files), partPaths))
+        for item, (rows, digest) in zip(files, results):
+            entries[str(item)] = fileEntry(item, digest, rows)
+        # The header, then every part in file order; an appended-to merged file already has its header
+        for target in [deltaPath(mergedPath)] + ([] if append else [mergedPath]):
+            with open(target, 'w', encoding='utf-8', newline='') as targetFile:
+                pd.DataFrame(columns=columns).to_csv(targetFile, index=False)
+        for target in (deltaPath(mergedPath), mergedPath):
+            with open(target, 'ab') as targetFile:
+                for partPath in partPaths:
+                    with open(partPath, 'rb') as partFile:
+                        shutil.copyfileobj(partFile, targetFile, copyBlockBytes)
+    return sum(rows for rows, _ in results), entries, columns
+
+
+def resetPeakMemory():
+    # Linux lets a process reset its resident set high-water mark; elsewhere the peak covers the run so far
+    try:
+        with open('/proc/self/clear_refs', 'w') as clearRefs:
+            clearRefs.write('5')
+    except OSError:
+        pass
+
+
+def peakMemoryMiB():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes, except on macOS where it is in bytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 1024)
+
+
+def mergeSource(label, files, mergedPath, merge, manifest, rebuild=False):
+    state = manifest.get(mergedPath)
+    reason = None
+    if rebuild:
+        reason = "--rebuild"
+    elif state is None:
+        reason = "not in the manifest yet"
+    elif not os.path.exists(mergedPath) or os.path.getsize(mergedPath) != state["size"]:
+        reason = f"{mergedPath} no longer matches the manifest"
+    known = {} if reason else state["files"]
+    new, changed, removed, touched = compareFiles(files, known)
+    for item in changed:
+        print(f"{label}: {item} changed since it was merged; its old content stays in {mergedPath} until --rebuild")
+    for path in removed:
+        print(f"{label}: {path} was removed since it was merged; it stays in {mergedPath} until --rebuild")
+    if merge is mergeScopusFiles and new and not reason:
+        addedColumns = [column for column in scopusColumns(new) if column not in state["columns"]]
+        if addedColumns:
+            reason = f"new exports add the columns {', '.join(addedColumns)}"
+            known = {}
+            new = files
+    append = reason is None
+
+    if not new:
+        # An empty delta, so later stages do not take the previous run's new records for this run's
+        with open(deltaPath(mergedPath), 'w', encoding='utf-8', newline='') as deltaFile:
+            if append and state["columns"]:
+                pd.DataFrame(columns=state["columns"]).to_csv(deltaFile, index=False)
+        if not files:
+            print(f"{label}: no exports found")
+        else:
+            print(f"{label}: no new exports")
+        if append:
+            state["files"].update(touched)
+            state["added"] = []
+        else:
+            # Nothing left to merge, so nothing may be left in the merged file either
+            open(mergedPath, 'wb').close()
+            manifest.pop(mergedPath, None)
+        return
+
+    if not append:
+        print(f"{label}: merging every export into {mergedPath} ({reason})")
+    resetPeakMemory()
+    start = time.perf_counter()
+    rows, entries, columns = merge(new, mergedPath, append, state["columns"] if append else None)
+    seconds = time.perf_counter() - start
+    peakMiB = peakMemoryMiB()
+    manifest[mergedPath] = {"size": os.path.getsize(mergedPath), "columns": columns,
+                            "files": dict(known, **touched, **entries), "added": [str(item) for item in new],
+                            "updated": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+    inputMiB = sum(os.path.getsize(item) for item in new) / 2 ** 20
+    rowsText = f", {rows} rows" if rows is not None else ""
+    peakText = f", peak memory {peakMiB:.0f} MiB" if peakMiB is not None else ""
+    print(f"{label}: {len(new)} files, {inputMiB:.1f} MiB{rowsText} -> {mergedPath} in {seconds:.2f} seconds "
+          f"({inputMiB / max(seconds, 1e-9):.1f} MiB/s){peakText}; new records in {deltaPath(mergedPath)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the WoS, Scopus and PubMed exports under ./records.")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Merge every export again, taking in changed and removed ones.")
+    args = parser.parse_args()
+    manifest = loadManifest()
+    mergeSource("WoS", sourceFiles(WoSDir), 'WoS.txt', copyTextFiles, manifest, args.rebuild)
+    mergeSource("Scopus", sourceFiles(ScopusDir), 'Scopus.csv', mergeScopusFiles, manifest, args.rebuild)
+    mergeSource("PubMed", sourceFiles(PubmedDir), 'Pubmed.txt', copyTextFiles, manifest, args.rebuild)
+    saveManifest(manifest)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# OCRmyPDF plugin: resample each page image to a resolution Tesseract handles well before OCR.
+# Only the image Tesseract sees is resampled; the original image is kept in the output PDF.
+import logging
+from PIL import Image
+from ocrmypdf import hookimpl
+from ocrmypdf.exceptions import BadArgsError
+from ocrmypdf.builtin_plugins import tesseract_ocr
+
+# Parented to the ocrmypdf logger so ocrmypdf.configure_logging() shows the per-page decisions
+log = logging.getLogger('ocrmypdf.adaptiveResolution')
+
+# Tesseract accuracy plateaus around 300 DPI
+ADAPTIVE_TARGET_DPI = 300
+# Pages above this are downsampled to the target for recognition
+ADAPTIVE_MAX_DPI = 400
+# Pages below this are upsampled to the target for recognition
+ADAPTIVE_MIN_DPI = 200
+
+
+@hookimpl
+def add_options(parser):
+    adaptive = parser.add_argument_group("Adaptive resolution", "Resample page images to a target DPI for OCR")
+    adaptive.add_argument('--adaptive-resolution', action='store_true',
+                          help="Resample each page image to the target DPI before OCR.")
+    adaptive.add_argument('--adaptive-target-dpi', type=int, default=ADAPTIVE_TARGET_DPI, metavar='DPI',
+                          help="Resolution Tesseract sees after resampling.")
+    adaptive.add_argument('--adaptive-max-dpi', type=int, default=ADAPTIVE_MAX_DPI, metavar='DPI',
+                          help="Downsample pages scanned above this resolution.")
+    adaptive.add_argument('--adaptive-min-dpi', type=int, default=ADAPTIVE_MIN_DPI, metavar='DPI',
+                          help="Upsample pages scanned below this resolution.")
+
+
+@hookimpl
+def check_options(options):
+    if not options.adaptive_resolution:
+        return
+    if not 0 < options.adaptive_min_dpi <= options.adaptive_target_dpi <= options.adaptive_max_dpi:
+        raise BadArgsError("Adaptive resolution needs 0 < min DPI <= target DPI <= max DPI")
+
+
+@hookimpl
+def filter_ocr_image(page, image):
+    options = page.options
+    if options.adaptive_resolution:
+        xres, yres = image.info['dpi']
+        effectiveDpi = min(xres, yres)
+        if effectiveDpi > options.adaptive_max_dpi:
+            decision = 'downsampled'
+        elif effectiveDpi < options.adaptive_min_dpi:
+            decision = 'upsampled'
+        else:
+            decision = 'kept'
+        if decision == 'kept':
+            log.info(f"{page.pageno + 1:4d}: adaptive resolution {effectiveDpi:.0f} dpi kept")
+        else:
+            scale = options.adaptive_target_dpi / effectiveDpi
+            newSize = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            resample = Image.Resampling.LANCZOS if scale > 1 else Image.Resampling.BICUBIC
+            # Keep the physical page size so the text layer lines up with the original image
+            dpi = (round(xres * newSize[0] / image.width), round(yres * newSize[1] / image.height))
+            image = image.resize(newSize, resample=resample, reducing_gap=3 if scale < 1 else None)
+            image.info['dpi'] = dpi
+            log.info(f"{page.pageno + 1:4d}: adaptive resolution {effectiveDpi:.0f} dpi "
+                     f"{decision} to {min(dpi)} dpi for OCR")
+    # This hook replaces Tesseract's own, which still has to enforce Tesseract's image size limits
+    return tesseract_ocr.filter_ocr_image(page, image)
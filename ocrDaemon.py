@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+# Headless watch-folder OCR: OCRs every PDF that lands in an input tree into the mirrored MDMT-OCR-Output tree,
+# with the same options the OCR window exposes. No Tk display is needed.
+#
+# Usage:
+#   python ocrDaemon.py --input-dir IN --output-dir OUT [--workers N] [OCR options]          (watch forever)
+#   python ocrDaemon.py --input-dir IN --output-dir OUT --once [OCR options]                 (headless batch)
+import os
+import sys
+import time
+import signal
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import ocrmypdf
+import pikepdf
+from ocrPipeline import addOcrArguments, buildOcrOptions, mirroredOutputPaths, ocrSettingsFromArgs, ocrDocument, \
+    missingLanguages, tessdataPath, checkOcrArguments
+
+# Seconds between scans of the input tree
+POLL_SECONDS = 5
+# A file must keep the same size and modification time this long before it is considered fully written
+SETTLE_SECONDS = 10
+
+
+def warmWorker():
+    # Pay the OCRmyPDF import and logging setup once per worker process instead of once per file
+    ocrmypdf.configure_logging(verbosity=ocrmypdf.Verbosity.default)
+    # Ctrl-C is handled by the daemon, which lets running jobs finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def ocrWatchedFile(inputPdf, outputPdf, ocrOptions, sidecar, modelTier):
+    os.makedirs(os.path.dirname(outputPdf), exist_ok=True)
+    # Write to a temporary name so a half-written output is never mistaken for a finished one
+    partialPdf = outputPdf + '.part'
+    partialSidecar = sidecar + '.part' if sidecar else None
+    ocrDocument(inputPdf, partialPdf, ocrOptions, sidecar=partialSidecar, modelTier=modelTier)
+    os.replace(partialPdf, outputPdf)
+    if partialSidecar:
+        os.replace(partialSidecar, sidecar)
+    return inputPdf
+
+
+def isComplete(pdfPath):
+    # Scanners often write the trailer last; a PDF that cannot be opened is still being written
+    try:
+        with pikepdf.open(pdfPath):
+            return True
+    except pikepdf.PdfError:
+        return False
+
+
+def isUpToDate(inputPdf, outputPdf):
+    return os.path.exists(outputPdf) and os.path.getmtime(outputPdf) >= os.path.getmtime(inputPdf)
+
+
+class watchFolderDaemon:
+    def __init__(self, inputDir, outputDir, ocrOptions, sidecar=False, modelTier='standard', workers=None,
+                 pollSeconds=POLL_SECONDS, settleSeconds=SETTLE_SECONDS):
+        self.inputDir = inputDir
+        self.outputDir = outputDir
+        self.ocrOptions = ocrOptions
+        self.sidecar = sidecar
+        self.modelTier = modelTier
+        self.workers = workers or max(1, (os.cpu_count() or 1) // 2)
+        self.pollSeconds = pollSeconds
+        self.settleSeconds = settleSeconds
+        # inputPdf -> (size, mtime, first time seen with that size and mtime)
+        self._candidates = {}
+        # inputPdf -> future of the running OCR
+        self._running = {}
+        # inputPdf -> mtime of the version that failed, so it is only retried once it changes
+        self._failed = {}
+        self._stopping = False
+        self._once = False
+
+    def stop(self, *args):
+        self._stopping = True
+
+    def scan(self):
+        # Return PDFs whose size and mtime have settled and that still need OCR
+        now = time.monotonic()
+        ready = []
+        seen = set()
+        outputRoot = os.path.abspath(self.outputDir)
+        for dirPath, dirNames, filenames in os.walk(self.inputDir):
+            # Never descend into our own output if it lives under the input tree
+            dirNames[:] = [d for d in dirNames if os.path.abspath(os.path.join(dirPath, d)) != outputRoot]
+            for filename in filenames:
+                if not filename.endswith('.pdf'):
+                    continue
+                inputPdf = os.path.join(dirPath, filename)
+                seen.add(inputPdf)
+                if inputPdf in self._running:
+                    continue
+                try:
+                    stat = os.stat(inputPdf)
+                except FileNotFoundError:
+                    continue
+                if self._failed.get(inputPdf) == stat.st_mtime:
+                    continue
+                outputPdf, _ = mirroredOutputPaths(inputPdf, self.inputDir, self.outputDir)
+                if isUpToDate(inputPdf, outputPdf):
+                    continue
+                previous = self._candidates.get(inputPdf)
+                if previous is None or previous[:2] != (stat.st_size, stat.st_mtime):
+                    # New or still growing: restart the settle timer
+                    self._candidates[inputPdf] = (stat.st_size, stat.st_mtime, now)
+                elif now - previous[2] >= self.settleSeconds and (self._once or isComplete(inputPdf)):
+                    # In batch mode nothing is still being written, so broken PDFs go to OCRmyPDF to report
+                    ready.append(inputPdf)
+        for vanished in set(self._candidates) - seen:
+            del self._candidates[vanished]
+        return ready
+
+    def collect(self):
+        for inputPdf, future in list(self._running.items()):
+            if not future.done():
+                continue
+            del self._running[inputPdf]
+            self._candidates.pop(inputPdf, None)
+            if future.cancelled():
+                # Dropped by a stop before a worker took it; not a failure, so it is picked up on the next start
+                print(f"OCR not started: {inputPdf}", flush=True)
+                continue
+            error = future.exception()
+            if error is None:
+                print(f"OCR done: {inputPdf}", flush=True)
+            else:
+                self._failed[inputPdf] = os.path.getmtime(inputPdf) if os.path.exists(inputPdf) else None
+                print(f"ERROR: {error} in file: {inputPdf}. Will retry if the file changes.", flush=True)
+
+    def run(self, once=False):
+        self._once = once
+        print(f"Watching {self.inputDir} with {self.workers} OCR workers", flush=True)
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=warmWorker) as executor:
+            while not self._stopping:
+                self.collect()
+                for inputPdf in self.scan():
+                    outputPdf, sidecarTextFile = mirroredOutputPaths(inputPdf, self.inputDir, self.outputDir,
+                                                                     sidecar=self.sidecar)
+                    print(f"OCR queued: {inputPdf}", flush=True)
+                    self._running[inputPdf] = executor.submit(ocrWatchedFile, inputPdf, outputPdf, self.ocrOptions,
+                                                              sidecarTextFile, self.modelTier)
+                if once and not self._running and not self._candidates:
+                    break
+                time.sleep(self.pollSeconds)
+            if self._stopping:
+                print("Stopping: finishing running OCR jobs...", flush=True)
+                executor.shutdown(wait=True, cancel_futures=True)
+            self.collect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a folder and OCR PDFs as they arrive.")
+    parser.add_argument('--input-dir', required=True)
+    parser.add_argument('--output-dir', required=True)
+    parser.add_argument('--workers', type=int, help="Warm OCR worker processes (default: half the CPUs).")
+    parser.add_argument('--poll-seconds', type=float, default=POLL_SECONDS)
+    parser.add_argument('--settle-seconds', type=float, default=SETTLE_SECONDS,
+                        help="Seconds a file must stay unchanged before it is OCR'd.")
+    parser.add_argument('--once', action='store_true', help="OCR what is there now, then exit (headless batch).")
+    addOcrArguments(parser)
+    args = parser.parse_args()
+    checkOcrArguments(parser, args)
+
+    if os.path.abspath(args.input_dir) == os.path.abspath(args.output_dir):
+        sys.exit("Input and output directory cannot be the same.")
+    missing = missingLanguages(args.language, args.model_tier)
+    if missing:
+        sys.exit(f"No {args.model_tier} model for: {', '.join(missing)}. Add the language data to "
+                 f"{tessdataPath(args.model_tier)}.")
+    daemon = watchFolderDaemon(args.input_dir, args.output_dir, buildOcrOptions(**ocrSettingsFromArgs(args)),
+                               sidecar=args.sidecar, modelTier=args.model_tier, workers=args.workers,
+                               pollSeconds=args.poll_seconds, settleSeconds=0 if args.once else args.settle_seconds)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+import os
+import heapq
+import signal
+import itertools
+import threading
+import multiprocessing
+import ocrmypdf
+import pikepdf
+from ocrPipeline import ocrDocument, DEFAULT_MODEL_TIER
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Pixels assumed for a page without any images (US Letter at 300 DPI)
+DEFAULT_PAGE_PIXELS = int(8.5 * 300) * int(11 * 300)
+
+
+def estimateOcrCost(pdfPath):
+    # Page count x pixels on a sample page: Tesseract time grows with pixel count
+    with pikepdf.open(pdfPath) as pdf:
+        numPages = len(pdf.pages)
+        pagePixels = 0
+        if numPages:
+            for image in pdf.pages[0].images.values():
+                try:
+                    pagePixels += int(image.Width) * int(image.Height)
+                except (AttributeError, TypeError, ValueError):
+                    continue
+    return numPages, numPages * (pagePixels or DEFAULT_PAGE_PIXELS)
+
+
+class ocrJob:
+    def __init__(self, inputPdf, outputPdf, sidecar=None, priority=0, modelTier=DEFAULT_MODEL_TIER):
+        self.inputPdf = inputPdf
+        self.outputPdf = outputPdf
+        self.sidecar = sidecar
+        # Tesseract model tier (fast, standard or best) used for this job only
+        self.modelTier = modelTier
+        # Higher priority jobs run first regardless of cost
+        self.priority = priority
+        self.state = QUEUED
+        self.error = None
+        try:
+            self.pageCount, self.estimatedCost = estimateOcrCost(inputPdf)
+        except Exception:
+            # Unreadable PDFs are cheap to fail, so run them early and let OCRmyPDF report the error
+            self.pageCount, self.estimatedCost = 0, 0
+
+
+def stopOcrJob(signum, frame):
+    # Unwinds the job, so a chunked OCR stops its chunk workers and removes its work directory
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise SystemExit(1)
+
+
+def runOcrJob(inputPdf, outputPdf, ocrOptions, sidecar, modelTier, errorPipe):
+    # Runs in its own process so a running job can be cancelled without killing the app. Where process groups
+    # exist the job leads its own, so cancelling also reaches chunk workers and their Tesseract processes.
+    if hasattr(os, 'setpgid'):
+        os.setpgid(0, 0)
+    signal.signal(signal.SIGTERM, stopOcrJob)
+    try:
+        ocrmypdf.configure_logging(verbosity=ocrmypdf.Verbosity.default)
+        ocrDocument(inputPdf, outputPdf, ocrOptions, sidecar=sidecar, modelTier=modelTier)
+        errorPipe.send(None)
+    except Exception as e:
+        errorPipe.send(str(e))
+    finally:
+        errorPipe.close()
+
+
+class ocrJobQueue:
+    def __init__(self, shortestFirst=True):
+        self.shortestFirst = shortestFirst
+        self.jobs = []
+        self._heap = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._paused = False
+        self._cancelled = False
+        self._runningJob = None
+        self._runningProcess = None
+
+    def add(self, job):
+        with self._condition:
+            cost = job.estimatedCost if self.shortestFirst else 0
+            # Ties (and every job when shortestFirst is off) keep insertion order
+            heapq.heappush(self._heap, (-job.priority, cost, next(self._order), job))
+            self.jobs.append(job)
+            self._condition.notify_all()
+        return job
+
+    def setPriority(self, job, priority):
+        # Reorders a queued job; a job that is running or finished keeps its place
+        with self._condition:
+            job.priority = priority
+            for i, entry in enumerate(self._heap):
+                if entry[-1] is job:
+                    self._heap[i] = (-priority,) + entry[1:]
+                    heapq.heapify(self._heap)
+                    break
+
+    def pause(self):
+        # The running job finishes; no new job starts until resume()
+        with self._condition:
+            self._paused = True
+
+    def resume(self):
+        with self._condition:
+            self._paused = False
+            self._condition.notify_all()
+
+    def isPaused(self):
+        return self._paused
+
+    def cancel(self):
+        # Drop every queued job and stop the running one
+        with self._condition:
+            self._cancelled = True
+            self._paused = False
+            while self._heap:
+                heapq.heappop(self._heap)[-1].state = CANCELLED
+            if self._runningJob is not None:
+                self._terminateRunningJob()
+            self._condition.notify_all()
+
+    def cancelJob(self, job):
+        with self._condition:
+            if job.state == QUEUED:
+                job.state = CANCELLED
+            elif job is self._runningJob:
+                self._terminateRunningJob()
+
+    def _terminateRunningJob(self):
+        # Caller holds the lock
+        self._runningJob.state = CANCELLED
+        if self._runningProcess is not None and self._runningProcess.is_alive():
+            try:
+                os.killpg(self._runningProcess.pid, signal.SIGTERM)
+            except (AttributeError, ProcessLookupError, PermissionError):
+                # No process groups (Windows), or the job has not made its own group yet
+                self._runningProcess.terminate()
+
+    def stateCounts(self):
+        with self._condition:
+            counts = {state: 0 for state in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+            for job in self.jobs:
+                counts[job.state] += 1
+        return counts
+
+    def _nextJob(self):
+        with self._condition:
+            while True:
+                if self._cancelled:
+                    return None
+                if not self._paused:
+                    while self._heap and self._heap[0][-1].state == CANCELLED:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        return None
+                    job = heapq.heappop(self._heap)[-1]
+                    job.state = RUNNING
+                    self._runningJob = job
+                    return job
+                self._condition.wait()
+
+    def run(self, ocrOptions):
+        # Generator: OCR jobs one at a time and yield each job once it has left the running state
+        context = multiprocessing.get_context('spawn')
+        while True:
+            job = self._nextJob()
+            if job is None:
+                return
+            receivePipe, sendPipe = context.Pipe(duplex=False)
+            process = context.Process(target=runOcrJob,
+                                      args=(job.inputPdf, job.outputPdf, ocrOptions, job.sidecar, job.modelTier,
+                                            sendPipe))
+            with self._condition:
+                # cancel() may have landed between taking the job and starting it
+                if job.state != CANCELLED:
+                    self._runningProcess = process
+                    process.start()
+            sendPipe.close()
+            if self._runningProcess is process:
+                process.join()
+            with self._condition:
+                self._runningJob = None
+                self._runningProcess = None
+            try:
+                error = receivePipe.recv()
+            except EOFError:
+                # Worker never started or was terminated before reporting back
+                error = None
+            receivePipe.close()
+            if job.state == CANCELLED:
+                # Terminated by cancel(): remove any partial output
+                for partialFile in (job.outputPdf, job.sidecar):
+                    if partialFile and os.path.exists(partialFile):
+                        os.remove(partialFile)
+            elif error is None and process.exitcode == 0:
+                job.state = DONE
+            else:
+                job.state = FAILED
+                job.error = error or f"OCR worker exited with code {process.exitcode}"
+            yield job
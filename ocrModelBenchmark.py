@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+# Offline accuracy-vs-speed benchmark of the Tesseract model tiers (fast, standard, best).
+# Every page in the reference set is a ground-truth file NAME.gt.txt, optionally with a scan NAME.png/.tif/.jpg
+# beside it; pages without a scan are rendered from their ground truth. Reports pages/sec and character
+# error rate (CER) per tier so the tier for a batch can be chosen with data.
+import os
+import re
+import time
+import argparse
+import tempfile
+import subprocess
+from PIL import Image, ImageDraw, ImageFont
+from ocrPipeline import MODEL_TIERS, tessdataPath, missingLanguages
+
+REFERENCE_DIR = os.path.join(os.getcwd(), 'OCR', 'benchmark')
+IMAGE_EXTENSIONS = ('.png', '.tif', '.tiff', '.jpg', '.jpeg')
+RENDER_DPI = 300
+
+
+def renderReferencePage(text, imagePath, dpi=RENDER_DPI):
+    # US Letter, one inch margins, 12 pt type
+    page = Image.new('L', (int(8.5 * dpi), 11 * dpi), color=255)
+    draw = ImageDraw.Draw(page)
+    font = ImageFont.load_default(size=round(12 / 72 * dpi))
+    lineHeight = round(12 / 72 * dpi * 1.4)
+    y = dpi
+    for line in text.splitlines():
+        draw.text((dpi, y), line, font=font, fill=0)
+        y += lineHeight
+    page.save(imagePath, dpi=(dpi, dpi))
+
+
+def loadReferencePages(referenceDir, workDir):
+    pages = []
+    for fileName in sorted(os.listdir(referenceDir)):
+        if not fileName.endswith('.gt.txt'):
+            continue
+        stem = fileName[:-len('.gt.txt')]
+        with open(os.path.join(referenceDir, fileName), encoding='utf-8') as groundTruthFile:
+            groundTruth = groundTruthFile.read()
+        imagePath = next((os.path.join(referenceDir, stem + extension) for extension in IMAGE_EXTENSIONS
+                          if os.path.isfile(os.path.join(referenceDir, stem + extension))), None)
+        if imagePath is None:
+            imagePath = os.path.join(workDir, stem + '.png')
+            renderReferencePage(groundTruth, imagePath)
+        pages.append((stem, imagePath, groundTruth))
+    return pages
+
+
+def tesseractText(imagePath, language, tessdataDir):
+    result = subprocess.run(['tesseract', imagePath, 'stdout', '-l', language, '--tessdata-dir', tessdataDir],
+                            capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def normalizeText(text):
+    # Layout whitespace is not a recognition error
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def editDistance(reference, hypothesis):
+    previousRow = list(range(len(hypothesis) + 1))
+    for i, referenceChar in enumerate(reference, start=1):
+        currentRow = [i]
+        for j, hypothesisChar in enumerate(hypothesis, start=1):
+            currentRow.append(min(previousRow[j] + 1,
+                                  currentRow[j - 1] + 1,
+                                  previousRow[j - 1] + (referenceChar != hypothesisChar)))
+        previousRow = currentRow
+    return previousRow[-1]
+
+
+def benchmarkTier(modelTier, pages, language):
+    errors = 0
+    referenceLength = 0
+    start = time.perf_counter()
+    recognized = [tesseractText(imagePath, language, tessdataPath(modelTier)) for _, imagePath, _ in pages]
+    seconds = time.perf_counter() - start
+    for (_, _, groundTruth), text in zip(pages, recognized):
+        reference = normalizeText(groundTruth)
+        errors += editDistance(reference, normalizeText(text))
+        referenceLength += len(reference)
+    return {
+        'pages': len(pages),
+        'seconds': seconds,
+        'pagesPerSecond': len(pages) / seconds if seconds else 0.0,
+        'cer': errors / referenceLength if referenceLength else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Tesseract model tiers on a reference page set.")
+    parser.add_argument('--reference-dir', default=REFERENCE_DIR,
+                        help="Directory of NAME.gt.txt ground truth files and optional scans.")
+    parser.add_argument('--language', default='eng', help="Tesseract language string, e.g. eng or eng+fra.")
+    parser.add_argument('--tiers', nargs='+', default=list(MODEL_TIERS), choices=list(MODEL_TIERS))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='mdmt-benchmark-') as workDir:
+        pages = loadReferencePages(args.reference_dir, workDir)
+        if not pages:
+            print(f"No *.gt.txt reference pages found in {args.reference_dir}")
+            return
+        print(f"Benchmarking {len(pages)} reference pages, language '{args.language}'\n")
+        print(f"{'Tier':<10}{'Pages':>7}{'Seconds':>10}{'Pages/sec':>11}{'CER':>9}")
+        for modelTier in args.tiers:
+            missing = missingLanguages(args.language, modelTier)
+            if missing:
+                print(f"{modelTier:<10}skipped: no {', '.join(missing)} model in {tessdataPath(modelTier)}")
+                continue
+            result = benchmarkTier(modelTier, pages, args.language)
+            print(f"{modelTier:<10}{result['pages']:>7}{result['seconds']:>10.2f}"
+                  f"{result['pagesPerSecond']:>11.2f}{result['cer']:>8.2%}")
+
+
+if __name__ == "__main__":
+    main()
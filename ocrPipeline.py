@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+import os
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import ocrmypdf
+import pikepdf
+
+PROJECT_PATH = os.getcwd()
+OCR_DATA_PATH = os.path.join(PROJECT_PATH, 'OCR')
+# Output tree mirrored from the input tree
+OUTPUT_DIR_NAME = 'MDMT-OCR-Output'
+# Tesseract model tiers, each a tessdata directory under OCR/ (fast and best are downloaded separately from
+# https://github.com/tesseract-ocr/tessdata_fast and https://github.com/tesseract-ocr/tessdata_best)
+MODEL_TIERS = {
+    'fast': 'tessdata_fast',
+    'standard': 'tessdata',
+    'best': 'tessdata_best'
+}
+DEFAULT_MODEL_TIER = 'standard'
+
+# Documents longer than this are split into page-range chunks that are OCR'd concurrently
+CHUNK_THRESHOLD_PAGES = 200
+# Number of pages in each chunk
+CHUNK_SIZE_PAGES = 50
+
+
+def tessdataPath(modelTier=DEFAULT_MODEL_TIER):
+    return os.path.join(OCR_DATA_PATH, MODEL_TIERS[modelTier])
+
+
+def missingLanguages(language, modelTier=DEFAULT_MODEL_TIER):
+    # Languages in a Tesseract '+'-joined language string that the tier has no model for
+    tessdataDir = tessdataPath(modelTier)
+    return [lang for lang in language.split('+')
+            if not os.path.isfile(os.path.join(tessdataDir, lang + '.traineddata'))]
+
+
+def buildOcrOptions(language, pdfa=False, rotatePages=False, rotateThreshold=15, deskew=False, redoOcr=False,
+                    adaptiveResolution=False):
+    # OCRmyPDF options for the settings the OCR window exposes, shared by the window and the headless modes
+    ocrOptions = {
+        'language': language,
+        'tesseract_config': os.path.join(OCR_DATA_PATH, 'tessdata', 'tessconfigs'),
+        'redo_ocr': redoOcr,
+        'skip_text': not redoOcr,
+        'deskew': deskew,
+        'rotate_pages': rotatePages,
+        'output_type': 'pdfa' if pdfa else 'pdf',
+        'invalidate_digital_signatures': True
+    }
+    if rotatePages:
+        ocrOptions['rotate_pages_threshold'] = rotateThreshold
+    if adaptiveResolution:
+        ocrOptions['plugins'] = [os.path.join(PROJECT_PATH, 'ocrAdaptiveResolution.py')]
+        ocrOptions['adaptive_resolution'] = True
+    return ocrOptions
+
+
+def addOcrArguments(parser):
+    # Command line equivalents of the OCR window's options, for the headless modes
+    parser.add_argument('--language', default='eng', help="Tesseract language string, e.g. eng or eng+fra.")
+    parser.add_argument('--pdfa', action='store_true', help="PDF/A output (archive ready).")
+    parser.add_argument('--sidecar', action='store_true', help="Also extract text to a text file.")
+    parser.add_argument('--redo-ocr', action='store_true', help="Redo existing OCR.")
+    parser.add_argument('--rotate-pages', action='store_true', help="Correct page rotation.")
+    parser.add_argument('--rotate-threshold', type=float, default=15,
+                        help="Rotation confidence threshold: 2 = low, 15 = normal, 30 = high.")
+    parser.add_argument('--deskew', action='store_true', help="Correct skewed scans.")
+    parser.add_argument('--adaptive-resolution', action='store_true', help="Adaptive OCR resolution.")
+    parser.add_argument('--model-tier', default=DEFAULT_MODEL_TIER, choices=list(MODEL_TIERS),
+                        help="Tesseract model tier.")
+
+
+def checkOcrArguments(parser, args):
+    # Call after parse_args(): OCRmyPDF rejects some combinations only once a file is being OCR'd
+    if args.redo_ocr and args.deskew:
+        parser.error("--redo-ocr and --deskew cannot be combined")
+
+
+def ocrSettingsFromArgs(args):
+    # Plain settings dict (JSON serializable) that buildOcrOptions() accepts
+    return {
+        'language': args.language,
+        'pdfa': args.pdfa,
+        'rotatePages': args.rotate_pages,
+        'rotateThreshold': args.rotate_threshold,
+        'deskew': args.deskew,
+        'redoOcr': args.redo_ocr,
+        'adaptiveResolution': args.adaptive_resolution
+    }
+
+
+def mirroredOutputPaths(inputPdf, inputDir, outputDir, sidecar=False):
+    # Output PDF (and sidecar text file) at the same relative path under outputDir/MDMT-OCR-Output
+    outputPdf = os.path.join(outputDir, OUTPUT_DIR_NAME, os.path.relpath(inputPdf, inputDir))
+    sidecarTextFile = os.path.splitext(outputPdf)[0] + '.txt' if sidecar else None
+    return outputPdf, sidecarTextFile
+
+
+def pdfPageCount(pdfPath):
+    with pikepdf.open(pdfPath) as pdf:
+        return len(pdf.pages)
+
+
+def pageRanges(numPages, chunkSize=CHUNK_SIZE_PAGES):
+    # Half-open [start, end) page ranges covering the whole document in order
+    return [(start, min(start + chunkSize, numPages)) for start in range(0, numPages, chunkSize)]
+
+
+def splitPdf(inputPdf, ranges, workDir):
+    chunkPaths = []
+    with pikepdf.open(inputPdf) as pdf:
+        for chunkNumber, (start, end) in enumerate(ranges):
+            chunkPath = os.path.join(workDir, f'chunk{chunkNumber:05d}.pdf')
+            with pikepdf.new() as chunk:
+                chunk.pages.extend(pdf.pages[start:end])
+                chunk.save(chunkPath)
+            chunkPaths.append(chunkPath)
+    return chunkPaths
+
+
+def ocrChunk(chunkInput, chunkOutput, chunkSidecar, ocrOptions):
+    # Runs in a worker process: ocrmypdf.ocr() must not run twice concurrently in one interpreter
+    ocrmypdf.configure_logging(verbosity=ocrmypdf.Verbosity.default)
+    ocrmypdf.ocr(chunkInput, chunkOutput, sidecar=chunkSidecar, **ocrOptions)
+    return chunkOutput
+
+
+def reassemblePdf(inputPdf, ranges, chunkOutputs, outputPdf):
+    # Graft the OCR'd pages back onto the original page objects so the outline, page labels,
+    # document info and XMP metadata of the original keep pointing at the right pages
+    with pikepdf.open(inputPdf) as pdf:
+        for (start, end), chunkOutput in zip(ranges, chunkOutputs):
+            with pikepdf.open(chunkOutput) as chunk:
+                if len(chunk.pages) != end - start:
+                    raise RuntimeError(f"OCR of pages {start + 1}-{end} returned {len(chunk.pages)} pages")
+                for offset, chunkPage in enumerate(chunk.pages):
+                    pdf.pages[start + offset].emplace(pikepdf.Page(pdf.copy_foreign(chunkPage.obj)))
+        pdf.save(outputPdf)
+
+
+def mergeSidecars(chunkSidecars, sidecarTextFile):
+    # OCRmyPDF separates pages in the sidecar with a form feed
+    with open(sidecarTextFile, 'w', encoding='utf-8') as mergedSidecar:
+        for chunkNumber, chunkSidecar in enumerate(chunkSidecars):
+            with open(chunkSidecar, encoding='utf-8') as sidecarFile:
+                text = sidecarFile.read()
+            mergedSidecar.write(text)
+            if chunkNumber < len(chunkSidecars) - 1 and not text.endswith('\f'):
+                mergedSidecar.write('\f')
+
+
+def stopChunkWorkers(executor):
+    workers = list((executor._processes or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
+
+
+def ocrDocumentInChunks(inputPdf, outputPdf, ocrOptions, sidecar=None, numPages=None, maxWorkers=None):
+    if numPages is None:
+        numPages = pdfPageCount(inputPdf)
+    ranges = pageRanges(numPages)
+    if maxWorkers is None:
+        maxWorkers = min(len(ranges), os.cpu_count() or 1)
+    chunkOptions = dict(ocrOptions)
+    # PDF/A conversion happens once on the reassembled document
+    outputType = chunkOptions.get('output_type', 'pdfa')
+    convertToPDFA = outputType.startswith('pdfa')
+    chunkOptions['output_type'] = 'pdf'
+    # Share the CPUs between chunks instead of letting every chunk claim all of them
+    chunkOptions.setdefault('jobs', max(1, (os.cpu_count() or 1) // maxWorkers))
+    chunkOptions.setdefault('use_threads', True)
+
+    with tempfile.TemporaryDirectory(prefix='mdmt-ocr-') as workDir:
+        chunkInputs = splitPdf(inputPdf, ranges, workDir)
+        chunkOutputs = [os.path.splitext(chunk)[0] + '.ocr.pdf' for chunk in chunkInputs]
+        chunkSidecars = [os.path.splitext(chunk)[0] + '.txt' for chunk in chunkInputs] if sidecar else \
+            [None] * len(chunkInputs)
+        # Spawn rather than fork; this is usually called from a GUI worker thread
+        with ProcessPoolExecutor(max_workers=maxWorkers,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(ocrChunk, chunkInput, chunkOutput, chunkSidecar, chunkOptions)
+                       for chunkInput, chunkOutput, chunkSidecar in zip(chunkInputs, chunkOutputs, chunkSidecars)]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # A failed chunk, or a cancelled job (see runOcrJob): stop the other chunks instead of finishing
+                # them, so the work directory can be removed once the workers are gone
+                stopChunkWorkers(executor)
+                raise
+
+        if convertToPDFA:
+            reassembledPdf = os.path.join(workDir, 'reassembled.pdf')
+            reassemblePdf(inputPdf, ranges, chunkOutputs, reassembledPdf)
+            # Every page already has a text layer, so this pass only converts to PDF/A
+            ocrmypdf.ocr(reassembledPdf, outputPdf,
+                         language=ocrOptions.get('language'),
+                         tesseract_config=ocrOptions.get('tesseract_config'),
+                         skip_text=True,
+                         output_type=outputType,
+                         invalidate_digital_signatures=True)
+        else:
+            reassemblePdf(inputPdf, ranges, chunkOutputs, outputPdf)
+        if sidecar:
+            mergeSidecars(chunkSidecars, sidecar)
+
+
+def ocrDocument(inputPdf, outputPdf, ocrOptions, sidecar=None, modelTier=DEFAULT_MODEL_TIER):
+    # Small documents go straight to OCRmyPDF; large ones are split, OCR'd in parallel and reassembled
+    # Tesseract (and any chunk worker spawned from here) reads its models from TESSDATA_PREFIX
+    os.environ["TESSDATA_PREFIX"] = tessdataPath(modelTier)
+    try:
+        numPages = pdfPageCount(inputPdf)
+    except pikepdf.PdfError:
+        # Let OCRmyPDF report unreadable input in its own words
+        numPages = 0
+    if numPages > CHUNK_THRESHOLD_PAGES:
+        ocrDocumentInChunks(inputPdf, outputPdf, ocrOptions, sidecar=sidecar, numPages=numPages)
+    else:
+        ocrmypdf.ocr(inputPdf, outputPdf, sidecar=sidecar, **ocrOptions)
@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+# Headless multi-node OCR over a directory-based job queue on a shared filesystem (e.g. NFS), no broker needed.
+#
+# Queue layout:
+#   batch.json          input/output directories and OCR settings for the whole batch
+#   jobs/ID.json        one file per PDF (path relative to the input directory, estimated cost)
+#   leases/ID.lease     claim on a job, created with O_CREAT|O_EXCL and touched by a heartbeat while OCR runs;
+#                       a lease not touched for leaseSeconds belongs to a dead worker and may be taken over
+#   done/ID.json        result of a finished job (done or failed), written atomically
+#
+# Usage:
+#   python ocrSharedQueue.py enqueue QUEUE_DIR --input-dir IN --output-dir OUT [OCR options]
+#   python ocrSharedQueue.py work QUEUE_DIR [--processes N]   (on every node)
+#   python ocrSharedQueue.py status QUEUE_DIR                 (from any node)
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import argparse
+import threading
+import multiprocessing
+import ocrmypdf
+from ocrJobQueue import estimateOcrCost
+from ocrPipeline import addOcrArguments, buildOcrOptions, mirroredOutputPaths, ocrSettingsFromArgs, ocrDocument, \
+    checkOcrArguments
+
+# Seconds without a heartbeat after which a lease is considered abandoned
+LEASE_SECONDS = 300
+# Seconds an idle worker waits before looking for expired leases again
+POLL_SECONDS = 15
+
+
+def writeJsonAtomic(path, data):
+    # rename() within one directory is atomic on local filesystems and NFS alike
+    tempPath = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tempPath, 'w', encoding='utf-8') as tempFile:
+        json.dump(data, tempFile, indent=2)
+    os.replace(tempPath, path)
+
+
+def readJson(path):
+    with open(path, encoding='utf-8') as jsonFile:
+        return json.load(jsonFile)
+
+
+class sharedOcrQueue:
+    def __init__(self, queueDir, leaseSeconds=LEASE_SECONDS):
+        self.queueDir = queueDir
+        self.leaseSeconds = leaseSeconds
+        self.jobsDir = os.path.join(queueDir, 'jobs')
+        self.leasesDir = os.path.join(queueDir, 'leases')
+        self.doneDir = os.path.join(queueDir, 'done')
+        self.batchFile = os.path.join(queueDir, 'batch.json')
+
+    def jobIds(self):
+        return sorted(f[:-len('.json')] for f in os.listdir(self.jobsDir) if f.endswith('.json'))
+
+    def leasePath(self, jobId):
+        return os.path.join(self.leasesDir, jobId + '.lease')
+
+    def donePath(self, jobId):
+        return os.path.join(self.doneDir, jobId + '.json')
+
+    def enqueue(self, inputDir, outputDir, settings, modelTier, sidecar, retryFailed=False):
+        for directory in (self.jobsDir, self.leasesDir, self.doneDir):
+            os.makedirs(directory, exist_ok=True)
+        writeJsonAtomic(self.batchFile, {
+            'inputDir': os.path.abspath(inputDir),
+            'outputDir': os.path.abspath(outputDir),
+            'settings': settings,
+            'modelTier': modelTier,
+            'sidecar': sidecar
+        })
+        added = 0
+        for dirPath, dirNames, filenames in os.walk(inputDir):
+            for filename in filenames:
+                if not filename.endswith('.pdf'):
+                    continue
+                relativePath = os.path.relpath(os.path.join(dirPath, filename), inputDir)
+                jobId = hashlib.sha1(relativePath.encode('utf-8')).hexdigest()
+                if retryFailed and os.path.exists(self.donePath(jobId)) and \
+                        readJson(self.donePath(jobId))['state'] == 'failed':
+                    os.remove(self.donePath(jobId))
+                jobPath = os.path.join(self.jobsDir, jobId + '.json')
+                if os.path.exists(jobPath):
+                    continue
+                try:
+                    pageCount, estimatedCost = estimateOcrCost(os.path.join(dirPath, filename))
+                except Exception:
+                    pageCount, estimatedCost = 0, 0
+                writeJsonAtomic(jobPath, {'relativePath': relativePath, 'pageCount': pageCount,
+                                          'estimatedCost': estimatedCost})
+                added += 1
+        return added
+
+    def _tryCreateLease(self, jobId, workerId):
+        try:
+            leaseFd = os.open(self.leasePath(jobId), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(leaseFd, 'w') as leaseFile:
+            json.dump({'worker': workerId, 'claimed': time.time()}, leaseFile)
+        return True
+
+    def _leaseAge(self, jobId):
+        try:
+            return time.time() - os.stat(self.leasePath(jobId)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def leaseOwner(self, jobId):
+        try:
+            return readJson(self.leasePath(jobId))['worker']
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def claim(self, workerId):
+        # Cheapest unfinished job first; returns (jobId, job) or None if nothing is claimable right now
+        candidates = []
+        for jobId in self.jobIds():
+            if os.path.exists(self.donePath(jobId)):
+                continue
+            leaseAge = self._leaseAge(jobId)
+            if leaseAge is not None and leaseAge < self.leaseSeconds:
+                continue
+            job = readJson(os.path.join(self.jobsDir, jobId + '.json'))
+            candidates.append((job['estimatedCost'], jobId, job, leaseAge is not None))
+        for _, jobId, job, expired in sorted(candidates, key=lambda candidate: candidate[:2]):
+            if expired:
+                # Only one worker can rename the stale lease away; the others get FileNotFoundError
+                expiredLease = f"{self.leasePath(jobId)}.expired.{workerId}"
+                try:
+                    os.rename(self.leasePath(jobId), expiredLease)
+                except FileNotFoundError:
+                    continue
+                if time.time() - os.stat(expiredLease).st_mtime < self.leaseSeconds:
+                    # Another worker re-claimed it between our scan and the rename: put its lease back
+                    try:
+                        os.link(expiredLease, self.leasePath(jobId))
+                    except FileExistsError:
+                        pass
+                    os.remove(expiredLease)
+                    continue
+                os.remove(expiredLease)
+                print(f"[{workerId}] Lease on {job['relativePath']} expired, taking over.", flush=True)
+            if self._tryCreateLease(jobId, workerId):
+                # A result may have landed between the scan and the claim
+                if os.path.exists(self.donePath(jobId)):
+                    self.release(jobId)
+                    continue
+                return jobId, job
+        return None
+
+    def heartbeat(self, jobId):
+        try:
+            os.utime(self.leasePath(jobId))
+        except FileNotFoundError:
+            pass
+
+    def release(self, jobId):
+        try:
+            os.remove(self.leasePath(jobId))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, jobId, workerId, state, seconds, error=None):
+        writeJsonAtomic(self.donePath(jobId), {'state': state, 'worker': workerId, 'seconds': seconds,
+                                               'error': error, 'finished': time.time()})
+        self.release(jobId)
+
+    def progress(self):
+        jobIds = self.jobIds()
+        counts = {'total': len(jobIds), 'done': 0, 'failed': 0, 'running': 0, 'expired': 0, 'pending': 0}
+        workers = {}
+        for jobId in jobIds:
+            if os.path.exists(self.donePath(jobId)):
+                result = readJson(self.donePath(jobId))
+                counts['done' if result['state'] == 'done' else 'failed'] += 1
+                workers[result['worker']] = workers.get(result['worker'], 0) + 1
+                continue
+            leaseAge = self._leaseAge(jobId)
+            if leaseAge is None:
+                counts['pending'] += 1
+            elif leaseAge < self.leaseSeconds:
+                counts['running'] += 1
+            else:
+                counts['expired'] += 1
+        return counts, workers
+
+
+def removePartialFiles(*partialFiles):
+    for partialFile in partialFiles:
+        if partialFile and os.path.exists(partialFile):
+            os.remove(partialFile)
+
+
+def runWorker(queueDir, workerId, inputDir=None, outputDir=None, leaseSeconds=LEASE_SECONDS, exitWhenIdle=False):
+    queue = sharedOcrQueue(queueDir, leaseSeconds)
+    batch = readJson(queue.batchFile)
+    # Mount points may differ between nodes
+    inputDir = inputDir or batch['inputDir']
+    outputDir = outputDir or batch['outputDir']
+    ocrOptions = buildOcrOptions(**batch['settings'])
+    ocrmypdf.configure_logging(verbosity=ocrmypdf.Verbosity.default)
+    print(f"[{workerId}] Worker started on {queueDir}", flush=True)
+
+    while True:
+        claimed = queue.claim(workerId)
+        if claimed is None:
+            counts, _ = queue.progress()
+            if counts['pending'] + counts['running'] + counts['expired'] == 0 or exitWhenIdle:
+                print(f"[{workerId}] No jobs left, exiting.", flush=True)
+                return
+            # Other workers still hold leases; wait in case one of them dies
+            time.sleep(POLL_SECONDS)
+            continue
+
+        jobId, job = claimed
+        inputPdf = os.path.join(inputDir, job['relativePath'])
+        outputPdf, sidecarTextFile = mirroredOutputPaths(inputPdf, inputDir, outputDir, sidecar=batch['sidecar'])
+        os.makedirs(os.path.dirname(outputPdf), exist_ok=True)
+        # Write under worker-unique names and rename into place, so a worker that lost its lease
+        # can never leave a half-written file where another worker's result belongs
+        partialPdf = f"{outputPdf}.{workerId}.part"
+        partialSidecar = f"{sidecarTextFile}.{workerId}.part" if sidecarTextFile else None
+
+        stopHeartbeat = threading.Event()
+
+        def heartbeatLoop():
+            while not stopHeartbeat.wait(leaseSeconds / 3):
+                queue.heartbeat(jobId)
+
+        heartbeatThread = threading.Thread(target=heartbeatLoop, daemon=True)
+        heartbeatThread.start()
+        print(f"[{workerId}] OCR {job['relativePath']} ({job['pageCount']} pages)", flush=True)
+        start = time.perf_counter()
+        try:
+            ocrDocument(inputPdf, partialPdf, ocrOptions, sidecar=partialSidecar, modelTier=batch['modelTier'])
+            state, error = 'done', None
+        except Exception as e:
+            state, error = 'failed', str(e)
+        finally:
+            stopHeartbeat.set()
+            heartbeatThread.join()
+        seconds = time.perf_counter() - start
+
+        if queue.leaseOwner(jobId) != workerId:
+            # Our lease expired and another worker took the job over; its result wins
+            print(f"[{workerId}] Lost lease on {job['relativePath']}, discarding result.", flush=True)
+            removePartialFiles(partialPdf, partialSidecar)
+            continue
+        if state == 'done':
+            os.replace(partialPdf, outputPdf)
+            if partialSidecar:
+                os.replace(partialSidecar, sidecarTextFile)
+        else:
+            # A retry writes its own partial files, so a failed job's would stay in the output tree for good
+            removePartialFiles(partialPdf, partialSidecar)
+        queue.complete(jobId, workerId, state, seconds, error)
+        print(f"[{workerId}] {state} {job['relativePath']} in {seconds:.1f} s" +
+              (f": {error}" if error else ""), flush=True)
+
+
+def printProgress(queueDir):
+    counts, workers = sharedOcrQueue(queueDir).progress()
+    finished = counts['done'] + counts['failed']
+    percent = 100 * finished / counts['total'] if counts['total'] else 100
+    print(f"{finished}/{counts['total']} finished ({percent:.1f}%): {counts['done']} done, {counts['failed']} failed, "
+          f"{counts['running']} running, {counts['expired']} expired leases, {counts['pending']} pending")
+    for workerId, jobCount in sorted(workers.items()):
+        print(f"  {workerId}: {jobCount} jobs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-node OCR over a shared filesystem job queue.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueueParser = subparsers.add_parser('enqueue', help="Add every PDF under the input directory to the queue.")
+    enqueueParser.add_argument('queue_dir')
+    enqueueParser.add_argument('--input-dir', required=True)
+    enqueueParser.add_argument('--output-dir', required=True)
+    enqueueParser.add_argument('--retry-failed', action='store_true', help="Queue failed jobs again.")
+    addOcrArguments(enqueueParser)
+
+    workParser = subparsers.add_parser('work', help="Claim and OCR jobs until the queue is empty.")
+    workParser.add_argument('queue_dir')
+    workParser.add_argument('--input-dir', help="Input directory as mounted on this node.")
+    workParser.add_argument('--output-dir', help="Output directory as mounted on this node.")
+    workParser.add_argument('--processes', type=int, default=1, help="Worker processes to run on this node.")
+    workParser.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS)
+    workParser.add_argument('--exit-when-idle', action='store_true',
+                            help="Exit when nothing is claimable instead of waiting for other workers' leases.")
+
+    statusParser = subparsers.add_parser('status', help="Report aggregate progress of all workers.")
+    statusParser.add_argument('queue_dir')
+
+    args = parser.parse_args()
+    if args.command == 'enqueue':
+        checkOcrArguments(enqueueParser, args)
+        if os.path.abspath(args.input_dir) == os.path.abspath(args.output_dir):
+            sys.exit("Input and output directory cannot be the same.")
+        added = sharedOcrQueue(args.queue_dir).enqueue(args.input_dir, args.output_dir, ocrSettingsFromArgs(args),
+                                                       args.model_tier, args.sidecar, retryFailed=args.retry_failed)
+        print(f"Queued {added} new PDFs.")
+        printProgress(args.queue_dir)
+    elif args.command == 'work':
+        workerOptions = (args.input_dir, args.output_dir, args.lease_seconds, args.exit_when_idle)
+        if args.processes == 1:
+            runWorker(args.queue_dir, f"{socket.gethostname()}-{os.getpid()}", *workerOptions)
+        else:
+            # Several workers on one node behave exactly like several nodes
+            context = multiprocessing.get_context('spawn')
+            processes = [context.Process(target=runWorker,
+                                         args=(args.queue_dir, f"{socket.gethostname()}-{os.getpid()}-{n}",
+                                               *workerOptions))
+                         for n in range(args.processes)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+        printProgress(args.queue_dir)
+    elif args.command == 'status':
+        printProgress(args.queue_dir)
+
+
+if __name__ == "__main__":
+    main()
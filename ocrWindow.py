@@ -3,10 +3,11 @@ import os
 import shutil
 import time
 import tkinter as tk
-from tkinter import messagebox
-import ocrmypdf
+from tkinter import messagebox, filedialog
 import pygubu
 import threading
+from ocrJobQueue import ocrJob, ocrJobQueue, FAILED
+from ocrPipeline import buildOcrOptions, mirroredOutputPaths, missingLanguages, tessdataPath, OUTPUT_DIR_NAME
 
 PROJECT_PATH = os.getcwd()
 PROJECT_UI = os.path.join(PROJECT_PATH, 'ocrWindow.ui')
@@ -193,6 +194,9 @@ class ocrWindow:
         self.textFileCheckbox = builder.get_object("extractToTextFile_Checkbox", self.ocrWindow)
         self.redoOCRCheckbox = builder.get_object("redoOCR_Checkbox", self.ocrWindow)
         self.runOCRButton = builder.get_object("button_run_ocr", self.ocrWindow)
+        self.pauseOCRButton = builder.get_object("button_pause_ocr", self.ocrWindow)
+        self.cancelOCRButton = builder.get_object("button_cancel_ocr", self.ocrWindow)
+        self.queueStatusLabel = builder.get_object("queueStatusLabel", self.ocrWindow)
         self.progressBar = builder.get_object("progressBar", self.ocrWindow)
         self.langListBoxScrollbar = builder.get_object("langSelection_Scrollbar", self.ocrWindow)
         self.rotateThresholdLowRadiobutton = builder.get_object("rotationConfidenceLow_RadioButton", self.ocrWindow)
@@ -200,6 +204,14 @@ class ocrWindow:
         self.rotateThresholdHighRadiobutton = builder.get_object("rotationConfidenceHigh_RadioButton", self.ocrWindow)
         # Get rotate confidence threshold
         self.rotateThresholdSelection = builder.get_variable("rotateThresholdSelection")
+        # Standard Tesseract models by default
+        builder.get_variable('modelTierSelection').set('Standard')
+        # Smallest PDFs first by default
+        builder.get_variable('shortestFirstCheckboxState').set(1)
+        # Queue of the batch currently being OCR'd
+        self.jobQueue = None
+        # PDFs the user wants OCR'd before the rest of the batch
+        self.priorityPdfs = set()
         # Link langbox with scrollbar
         self.langListbox['yscrollcommand'] = self.langListBoxScrollbar.set
         self.langListBoxScrollbar['command'] = self.langListbox.yview
@@ -215,6 +227,43 @@ class ocrWindow:
         ocrThread = threading.Thread(target=self.ocrmypdfThread, daemon=True)
         ocrThread.start()
 
+    def on_pauseOCR_clicked(self):
+        if self.jobQueue is None:
+            return
+        if self.jobQueue.isPaused():
+            self.jobQueue.resume()
+            self.pauseOCRButton.configure(text='Pause')
+        else:
+            self.jobQueue.pause()
+            self.pauseOCRButton.configure(text='Resume')
+
+    def on_cancelOCR_clicked(self):
+        if self.jobQueue is not None:
+            self.jobQueue.cancel()
+            self.pauseOCRButton.configure(state='disabled', text='Pause')
+            self.cancelOCRButton.configure(state='disabled')
+
+    def on_prioritizePdfs_clicked(self):
+        # Works before a batch starts and while it runs: chosen PDFs that are still queued move to the front
+        pdfInputDir = self.PDFInputDir.cget('path')
+        chosenPdfs = filedialog.askopenfilenames(parent=self.ocrWindow, title='OCR these PDFs first',
+                                                 initialdir=pdfInputDir or None, filetypes=[('PDF', '*.pdf')])
+        if not chosenPdfs:
+            return
+        self.priorityPdfs.update(os.path.normcase(os.path.abspath(pdf)) for pdf in chosenPdfs)
+        if self.jobQueue is not None:
+            for job in list(self.jobQueue.jobs):
+                if self.jobPriority(job.inputPdf):
+                    self.jobQueue.setPriority(job, 1)
+
+    def jobPriority(self, inputPdf):
+        return 1 if os.path.normcase(os.path.abspath(inputPdf)) in self.priorityPdfs else 0
+
+    def updateQueueStatus(self):
+        counts = self.jobQueue.stateCounts()
+        self.queueStatusLabel.configure(text=', '.join(f"{count} {state}" for state, count in counts.items()))
+        self.progressBar['value'] = len(self.jobQueue.jobs) - counts['queued'] - counts['running']
+
     def on_pageRotation_clicked(self):
         rotatePageState = self.builder.get_variable('rotatePagesCheckboxState').get()
         if rotatePageState == 0:
@@ -259,20 +308,26 @@ class ocrWindow:
         pdfOutputDir = self.PDFOutputDir.cget('path')
         PDFACheckboxState = self.builder.get_variable('PDFACheckboxState').get()  # 0 = unchecked; 1 = checked
         rotateThresholdSelection = self.rotateThresholdSelection.get()  # 30 = high; 15 = normal; 2 = low
-        if bool(PDFACheckboxState):
-            pdfType = 'pdfa'
-        elif not bool(PDFACheckboxState):
-            pdfType = 'pdf'
         rotatePagesCheckboxState = self.builder.get_variable(
             'rotatePagesCheckboxState').get()  # 0 = unchecked; 1 = checked
         deskewCheckboxState = self.builder.get_variable('deskewCheckboxState').get()  # 0 = unchecked; 1 = checked
         textFileCheckboxState = self.builder.get_variable('textFileCheckboxState').get()  # 0 = unchecked; 1 = checked
         redoOCRCheckboxState = self.builder.get_variable('redoOCRCheckboxState').get()  # 0 = unchecked; 1 = checked
+        adaptiveResolutionCheckboxState = self.builder.get_variable(
+            'adaptiveResolutionCheckboxState').get()  # 0 = unchecked; 1 = checked
+        modelTier = self.builder.get_variable('modelTierSelection').get().lower()  # fast; standard; best
 
         if pdfInputDir == pdfOutputDir:
             messagebox.showerror(title='Error', message='Input and output directory cannot be the same.')
             # Enable OCR Button
             self.runOCRButton.configure(state='normal')
+        elif bool(pdfLanguageKeys) and missingLanguages(pdfLanguageValsString, modelTier):
+            error = "ERROR: No " + modelTier + " model for: " + ', '.join(
+                missingLanguages(pdfLanguageValsString, modelTier)) + ".\nAdd the language data to " + \
+                tessdataPath(modelTier) + " or choose another OCR model."
+            messagebox.showerror(title='Error', message=error)
+            # Enable OCR Button
+            self.runOCRButton.configure(state='normal')
         elif pdfInputDir != '' and pdfOutputDir != '' and bool(pdfLanguageKeys):  # Go condition
             # Start the progress bar
             self.progressBar.configure(mode='indeterminate')
@@ -296,78 +351,50 @@ class ocrWindow:
                 return [f for f in files if os.path.isfile(os.path.join(dir, f))]
 
             try:
-                outputDirMDMT = os.path.join(pdfOutputDir, 'MDMT-OCR-Output')
+                outputDirMDMT = os.path.join(pdfOutputDir, OUTPUT_DIR_NAME)
                 if os.path.exists(outputDirMDMT) and os.path.isdir(outputDirMDMT):
                     shutil.rmtree(outputDirMDMT)
                 shutil.copytree(pdfInputDir, outputDirMDMT, ignore=shutilsIgnoreFiles)
             except Exception as e:
                 error = "ERROR: " + str(e) + ".\nDelete and recreate output directory then retry."
                 messagebox.showerror(title='Error', message=error)
-            # Set Tesseract env. variable for tessdata path (system agnostic)
-            os.environ["TESSDATA_PREFIX"] = os.path.join(PROJECT_PATH, 'OCR', 'tessdata')
-            # Set tessconfigs path (system agnostic)
-            tesseractConfig = os.path.join(PROJECT_PATH, 'OCR', 'tessdata', 'tessconfigs')
+            # OCRmyPDF options shared by every PDF in the batch
+            ocrOptions = buildOcrOptions(pdfLanguageValsString,
+                                         pdfa=bool(PDFACheckboxState),
+                                         rotatePages=bool(rotatePagesCheckboxState),
+                                         rotateThreshold=rotateThresholdSelection,
+                                         deskew=bool(deskewCheckboxState),
+                                         redoOcr=bool(redoOCRCheckboxState),
+                                         adaptiveResolution=bool(adaptiveResolutionCheckboxState))
 
-            # OCR the PDF using OCRmyPDF
+            # Queue every PDF, smallest estimated cost first unless the user wants directory order
+            shortestFirstCheckboxState = self.builder.get_variable('shortestFirstCheckboxState').get()
+            self.jobQueue = ocrJobQueue(shortestFirst=bool(shortestFirstCheckboxState))
             for i in pdfsInInputDir:
-                try:
-                    inputDirStructure = os.path.relpath(i, pdfInputDir)
-                    outputDirPreserveStructure = os.path.join(pdfOutputDir, 'MDMT-OCR-Output', inputDirStructure)
-                    sidecarTextFile = os.path.splitext(outputDirPreserveStructure)[0] + '.txt'
-                    if bool(textFileCheckboxState) == True and bool(rotatePagesCheckboxState) == True:
-                        ocrmypdf.configure_logging(verbosity=ocrmypdf.Verbosity.default)
-                        ocrmypdf.ocr(i, outputDirPreserveStructure,
-                                     language=pdfLanguageValsString,
-                                     tesseract_config=tesseractConfig,
-                                     redo_ocr=bool(redoOCRCheckboxState),
-                                     skip_text=not (bool(redoOCRCheckboxState)),
-                                     deskew=bool(deskewCheckboxState),
-                                     rotate_pages=bool(rotatePagesCheckboxState),
-                                     rotate_pages_threshold=rotateThresholdSelection,
-                                     sidecar=sidecarTextFile,
-                                     output_type=pdfType,
-                                     invalidate_digital_signatures=True)
-                    elif bool(textFileCheckboxState) == False and bool(rotatePagesCheckboxState) == False:
-                        ocrmypdf.configure_logging(verbosity=ocrmypdf.Verbosity.default)
-                        ocrmypdf.ocr(i, outputDirPreserveStructure,
-                                     language=pdfLanguageValsString,
-                                     tesseract_config=tesseractConfig,
-                                     redo_ocr=bool(redoOCRCheckboxState),
-                                     skip_text=not (bool(redoOCRCheckboxState)),
-                                     deskew=bool(deskewCheckboxState),
-                                     rotate_pages=bool(rotatePagesCheckboxState),
-                                     output_type=pdfType,
-                                     invalidate_digital_signatures=True)
-                    elif bool(textFileCheckboxState) == True and bool(rotatePagesCheckboxState) == False:
-                        ocrmypdf.configure_logging(verbosity=ocrmypdf.Verbosity.default)
-                        ocrmypdf.ocr(i, outputDirPreserveStructure,
-                                     language=pdfLanguageValsString,
-                                     tesseract_config=tesseractConfig,
-                                     redo_ocr=bool(redoOCRCheckboxState),
-                                     skip_text=not (bool(redoOCRCheckboxState)),
-                                     deskew=bool(deskewCheckboxState),
-                                     rotate_pages=bool(rotatePagesCheckboxState),
-                                     sidecar=sidecarTextFile,
-                                     output_type=pdfType,
-                                     invalidate_digital_signatures=True)
-                    elif bool(textFileCheckboxState) == False and bool(rotatePagesCheckboxState) == True:
-                        ocrmypdf.configure_logging(verbosity=ocrmypdf.Verbosity.default)
-                        ocrmypdf.ocr(i, outputDirPreserveStructure,
-                                     language=pdfLanguageValsString,
-                                     tesseract_config=tesseractConfig,
-                                     redo_ocr=bool(redoOCRCheckboxState),
-                                     skip_text=not (bool(redoOCRCheckboxState)),
-                                     deskew=bool(deskewCheckboxState),
-                                     rotate_pages=bool(rotatePagesCheckboxState),
-                                     rotate_pages_threshold=rotateThresholdSelection,
-                                     output_type=pdfType,
-                                     invalidate_digital_signatures=True)
-                except Exception as e:
-                    error = "ERROR: " + str(e) + ".\nCheck PDF inputs and retry.\nNot a fatal error, continuing..."
+                outputDirPreserveStructure, sidecarTextFile = mirroredOutputPaths(
+                    i, pdfInputDir, pdfOutputDir, sidecar=bool(textFileCheckboxState))
+                self.jobQueue.add(ocrJob(i, outputDirPreserveStructure, sidecar=sidecarTextFile,
+                                         priority=self.jobPriority(i), modelTier=modelTier))
+            # Switch the progress bar to done/total and enable the queue controls
+            self.progressBar.stop()
+            self.progressBar.configure(mode='determinate', maximum=max(len(self.jobQueue.jobs), 1), value=0)
+            self.pauseOCRButton.configure(state='normal', text='Pause')
+            self.cancelOCRButton.configure(state='normal')
+            self.updateQueueStatus()
+
+            # OCR the PDFs using OCRmyPDF (large PDFs are OCR'd in parallel page-range chunks)
+            for job in self.jobQueue.run(ocrOptions):
+                self.updateQueueStatus()
+                if job.state == FAILED:
+                    error = "ERROR: " + str(job.error) + " in file: " + job.inputPdf + \
+                            ".\nCheck PDF inputs and retry.\nNot a fatal error, continuing..."
                     messagebox.showerror(title='Error', message=error)
+            # Prioritized PDFs apply to this batch only
+            self.priorityPdfs.clear()
             # Stop progress bar
-            self.progressBar.configure(mode='determinate')  # Hide progress bar pip
-            self.progressBar.stop()
+            self.progressBar.configure(value=0)  # Hide progress bar pip
+            self.pauseOCRButton.configure(state='disabled', text='Pause')
+            self.cancelOCRButton.configure(state='disabled')
             # Enable OCR Button
             self.runOCRButton.configure(state='normal')
         else: